@@ -13,11 +13,15 @@ POST_PROCESS_SCRIPTS_FOLDER="clair.post_processing"
 deep_learning_folder = [
     "callVarBamParallel",
     "callVarBam",
+    "callVarGenome",
     "call_var",
     "evaluate",
+    "export_inference_model",
     "plot_tensor",
+    "serve",
     "train",
     "train_clr",
+    "worker",
 ]
 data_prep_scripts_folder = [
     "CreateTensor",
@@ -27,9 +31,11 @@ data_prep_scripts_folder = [
     "Tensor2Bin",
     "CombineBins",
     "Bin2To3",
+    "BenchmarkCompression",
 ]
 post_process_scripts_folder = [
     'ensemble',
+    'merge_vcf',
     'overlap_variant',
 ]
 
@@ -0,0 +1,353 @@
+import os
+import sys
+import heapq
+import pickle
+import shutil
+import struct
+import tempfile
+import zlib
+import numpy as np
+
+import shared.param as param
+from clair.dataset import DatasetWriter
+from clair.positions import (
+    ContigTable,
+    position_rows_from,
+    region_index_file_path_from,
+    region_index_from_position_blocks,
+)
+from clair.utils import (
+    PREFIX_CHAR_STR,
+    LABEL_FORMAT_INDEX,
+    BlockPacker,
+    label_from_reference,
+    variant_map_from,
+    training_tensors_from,
+)
+from shared.interval_tree import bed_tree_from
+from shared.utils import IUPAC_base_to_ACGT_base_dict as BASE2ACGT
+
+BIN_FORMAT_PICKLE = "pickle"
+BIN_FORMAT_MMAP = "mmap"
+
+# rows kept for each bucket before appended to its file in pass one
+BUCKET_BUFFER_SIZE = 64
+
+
+def pickle_dump(obj, file):
+    return pickle.dump(obj, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def pickled_objects_from(file_path):
+    with open(file_path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+class PickledListWriter(object):
+    """
+    Write a list of bytes to a file item by item, read back with a single pickle.load as in a whole pickled list
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.file.write(pickle.PROTO + b"\x03" + pickle.EMPTY_LIST)
+
+    def append(self, item):
+        if len(item) < 256:
+            self.file.write(pickle.SHORT_BINBYTES + struct.pack("<B", len(item)))
+        else:
+            self.file.write(pickle.BINBYTES + struct.pack("<I", len(item)))
+        self.file.write(item)
+        self.file.write(pickle.APPEND)
+
+    def close(self):
+        self.file.write(pickle.STOP)
+
+
+class PickledCountWriter(object):
+    """
+    A pickled int written in a fixed width, so that it can be overwritten once known
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.offset = file.tell()
+        self.write(0)
+
+    def write(self, count):
+        self.file.write(pickle.PROTO + b"\x03" + pickle.BININT + struct.pack("<i", count) + pickle.STOP)
+
+    def update(self, count):
+        current_offset = self.file.tell()
+        self.file.seek(self.offset)
+        self.write(count)
+        self.file.seek(current_offset)
+
+
+class PickledBinWriter(object):
+    """
+    Write blocks to a pickled bin as they come: X blocks to the bin directly, Y and position blocks spooled to
+    temporary files until all X blocks are written
+    """
+
+    def __init__(self, bin_fn, temporary_directory):
+        self.bin_file = open(bin_fn, "wb")
+        self.total = 0
+        self.count_writer = PickledCountWriter(self.bin_file)
+        self.x_blocks = PickledListWriter(self.bin_file)
+        self.y_spool_path = os.path.join(temporary_directory, "y.spool")
+        self.position_spool_path = os.path.join(temporary_directory, "position.spool")
+        self.y_spool = open(self.y_spool_path, "wb")
+        self.position_spool = open(self.position_spool_path, "wb")
+
+    def add_block(self, x_blob, y_blob, position_blob, no_of_rows):
+        self.x_blocks.append(x_blob)
+        pickle_dump(y_blob, self.y_spool)
+        pickle_dump(position_blob, self.position_spool)
+        self.total += no_of_rows
+
+    def close(self, contig_names=None):
+        self.x_blocks.close()
+        self.y_spool.close()
+        self.position_spool.close()
+        for spool_path in [self.y_spool_path, self.position_spool_path]:
+            blocks = PickledListWriter(self.bin_file)
+            for block in pickled_objects_from(spool_path):
+                blocks.append(block)
+            blocks.close()
+        if contig_names is not None:
+            pickle_dump(contig_names, self.bin_file)
+        self.count_writer.update(self.total)
+        self.bin_file.close()
+        return self.total
+
+
+def bin_writer_from(bin_fn, bin_format, temporary_directory):
+    if bin_format == BIN_FORMAT_MMAP:
+        return DatasetWriter(bin_fn, param.bloscBlockSize)
+    return PickledBinWriter(bin_fn, temporary_directory)
+
+
+class BlockWriter(object):
+    """
+    Group rows into blocks of param.bloscBlockSize as they are added, and pass the compressed blocks to a bin writer
+    Compressed position blocks are kept for the region index
+    """
+
+    def __init__(self, bin_writer, block_packer):
+        self.bin_writer = bin_writer
+        self.block_packer = block_packer
+        self.contig_table = ContigTable()
+        self.position_blobs = []
+        self.no_of_rows = 0
+        self.X_array, self.Y_array, self.pos_array = [], [], []
+
+    def add(self, x, y, position):
+        self.X_array.append(x)
+        self.Y_array.append(y)
+        self.pos_array.append(position)
+        if len(self.X_array) == param.bloscBlockSize:
+            self.flush()
+
+    def flush(self):
+        if len(self.X_array) == 0:
+            return
+        self.add_blocks(self.block_packer.put(
+            [np.array(self.X_array), np.array(self.Y_array), position_rows_from(self.pos_array, self.contig_table)],
+            len(self.X_array)
+        ))
+        self.no_of_rows += len(self.X_array)
+        self.X_array, self.Y_array, self.pos_array = [], [], []
+
+        if self.no_of_rows % 50000 < param.bloscBlockSize:
+            print("Compressed %d tensors" % (self.no_of_rows), file=sys.stderr)
+
+    def add_blocks(self, finished_blocks):
+        for (x_blob, y_blob, position_blob), no_of_rows in finished_blocks:
+            self.bin_writer.add_block(x_blob, y_blob, position_blob, no_of_rows)
+            self.position_blobs.append(position_blob)
+
+    def close(self):
+        self.flush()
+        self.add_blocks(self.block_packer.close())
+        return self.bin_writer.close(self.contig_table.names)
+
+    def write_region_index(self, bin_fn):
+        region_index_from_position_blocks(self.position_blobs, self.contig_table.names).write(
+            region_index_file_path_from(bin_fn)
+        )
+
+
+def bucket_index_from(key, no_of_buckets):
+    # the same chr:pos always falls into the same bucket, so that duplicates are resolved within a bucket
+    return zlib.crc32(key.encode()) % no_of_buckets
+
+
+def bucket_files_from(
+    tensor_fn,
+    var_fn,
+    bed_fn,
+    temporary_directory,
+    no_of_buckets,
+    tensor_dtype=np.float32,
+    label_format=LABEL_FORMAT_INDEX,
+):
+    """
+    Pass one, partition the labeled tensors into bucket files by chr:pos, in the order of the tensor input
+    Returns:
+        file paths of the buckets
+    """
+    tree = bed_tree_from(bed_file_path=bed_fn)
+    is_tree_empty = len(tree.keys()) == 0
+
+    Y = variant_map_from(var_fn, tree, is_tree_empty, label_format)
+
+    bucket_file_paths = [os.path.join(temporary_directory, "%d.bucket" % (i)) for i in range(no_of_buckets)]
+    bucket_files = [open(file_path, "wb") for file_path in bucket_file_paths]
+    buffers = [[] for _ in range(no_of_buckets)]
+
+    def flush(bucket_index):
+        keys, xs, ys = zip(*buffers[bucket_index])
+        pickle_dump((list(keys), np.array(xs), np.array(ys)), bucket_files[bucket_index])
+        buffers[bucket_index] = []
+
+    total = 0
+    for key, seq, x in training_tensors_from(tensor_fn, tree, is_tree_empty, tensor_dtype):
+        y = Y[key] if key in Y else label_from_reference(BASE2ACGT[seq[param.flankingBaseNum]], label_format)
+        bucket_index = bucket_index_from(key, no_of_buckets)
+        buffers[bucket_index].append((key, x, y))
+        if len(buffers[bucket_index]) == BUCKET_BUFFER_SIZE:
+            flush(bucket_index)
+
+        total += 1
+        if total % 100000 == 0:
+            print("Processed %d tensors" % total, file=sys.stderr)
+
+    for bucket_index in range(no_of_buckets):
+        if len(buffers[bucket_index]) > 0:
+            flush(bucket_index)
+        bucket_files[bucket_index].close()
+
+    return bucket_file_paths
+
+
+def examples_in_bucket_from(bucket_file_path, is_allow_duplicate_chr_pos):
+    """
+    Returns:
+        (keys, X, Y, positions) of a bucket, with duplicate chr:pos dropped or prefixed as in get_training_array,
+        a duplicate takes the label of the first tensor at its chr:pos, positions are (chr:pos, duplicate count)
+    """
+    keys, positions, X_chunks, Y_chunks, kept_indexes, label_indexes = [], [], [], [], [], []
+    first_index_of = {}
+    seen_keys = set()
+    index = 0
+    for chunk_keys, chunk_X, chunk_Y in pickled_objects_from(bucket_file_path):
+        X_chunks.append(chunk_X)
+        Y_chunks.append(chunk_Y)
+        for key in chunk_keys:
+            new_key = None
+            if key not in seen_keys:
+                new_key = key
+                first_index_of[key] = index
+            elif is_allow_duplicate_chr_pos:
+                for character in PREFIX_CHAR_STR:
+                    if character + key not in seen_keys:
+                        new_key = character + key
+                        break
+            if new_key is not None:
+                seen_keys.add(new_key)
+                keys.append(new_key)
+                positions.append((key, 0 if new_key == key else PREFIX_CHAR_STR.index(new_key[0]) + 1))
+                kept_indexes.append(index)
+                label_indexes.append(first_index_of[key])
+            index += 1
+
+    if len(keys) == 0:
+        return [], None, None, []
+    X, Y = np.concatenate(X_chunks), np.concatenate(Y_chunks)
+    if len(kept_indexes) < index:
+        X = X[kept_indexes]
+    if label_indexes != list(range(index)):
+        Y = Y[label_indexes]
+    return keys, X, Y, positions
+
+
+def sorted_bucket_rows_from(bucket_file_path):
+    for keys, X, Y, positions in pickled_objects_from(bucket_file_path):
+        for i in range(len(keys)):
+            yield keys[i], X[i], Y[i], positions[i]
+
+
+def build_bin_streaming(
+    tensor_fn,
+    var_fn,
+    bed_fn,
+    bin_fn,
+    shuffle=True,
+    is_allow_duplicate_chr_pos=False,
+    no_of_buckets=256,
+    temporary_directory=None,
+    bin_format=BIN_FORMAT_PICKLE,
+    block_packer=None,
+    tensor_dtype=np.float32,
+    label_format=LABEL_FORMAT_INDEX,
+):
+    """
+    Build the same bin as get_training_array without holding the dataset in memory.
+    Pass one partitions tensors into bucket files by chr:pos. Pass two loads one bucket at a time, shuffles it and
+    compresses rows into blocks as they come (buckets are visited in a random order), or without shuffle sorts it and
+    writes it back, the sorted buckets are then merged into chr:pos order.
+    Peak memory is about one bucket, i.e. (no. of tensors / no_of_buckets) * 4.2 KB, plus the bucket buffers.
+    """
+    temporary_directory = tempfile.mkdtemp(
+        prefix="tensor2bin.", dir=temporary_directory or os.path.dirname(os.path.abspath(bin_fn))
+    )
+    try:
+        bucket_file_paths = bucket_files_from(
+            tensor_fn, var_fn, bed_fn, temporary_directory, no_of_buckets, tensor_dtype, label_format
+        )
+
+        block_writer = BlockWriter(bin_writer_from(bin_fn, bin_format, temporary_directory), block_packer or BlockPacker())
+
+        if shuffle:
+            for bucket_index in np.random.permutation(no_of_buckets):
+                keys, X, Y, positions = examples_in_bucket_from(
+                    bucket_file_paths[bucket_index], is_allow_duplicate_chr_pos
+                )
+                os.remove(bucket_file_paths[bucket_index])
+                for i in np.random.permutation(len(keys)):
+                    block_writer.add(X[i], Y[i], positions[i])
+                del keys, X, Y, positions
+        else:
+            sorted_bucket_file_paths = []
+            for bucket_file_path in bucket_file_paths:
+                keys, X, Y, positions = examples_in_bucket_from(bucket_file_path, is_allow_duplicate_chr_pos)
+                os.remove(bucket_file_path)
+                order = sorted(range(len(keys)), key=keys.__getitem__)
+                sorted_bucket_file_path = bucket_file_path + ".sorted"
+                with open(sorted_bucket_file_path, "wb") as f:
+                    for start in range(0, len(order), param.bloscBlockSize):
+                        indexes = order[start:start + param.bloscBlockSize]
+                        pickle_dump((
+                            [keys[i] for i in indexes], X[indexes], Y[indexes], [positions[i] for i in indexes]
+                        ), f)
+                sorted_bucket_file_paths.append(sorted_bucket_file_path)
+                del keys, X, Y, positions
+
+            # keys are unique across buckets, rows are never compared beyond their keys
+            for _, x, y, position in heapq.merge(
+                *[sorted_bucket_rows_from(file_path) for file_path in sorted_bucket_file_paths],
+                key=lambda row: row[0]
+            ):
+                block_writer.add(x, y, position)
+
+        total = block_writer.close()
+        block_writer.write_region_index(bin_fn)
+    finally:
+        shutil.rmtree(temporary_directory, ignore_errors=True)
+
+    return total
@@ -1,11 +1,13 @@
+import os
 import sys
 import shlex
-import subprocess
-import multiprocessing
 import signal
+import multiprocessing
 import random
 from os.path import dirname
-from time import sleep
+from time import sleep, time
+from queue import Queue
+from threading import Thread
 from argparse import ArgumentParser
 
 from shared.command_options import (
@@ -15,48 +17,59 @@ from shared.command_options import (
     command_string_from,
     command_option_from
 )
-from shared.utils import file_path_from, executable_command_string_from, subprocess_popen
-
-
-class InstancesClass(object):
-    def __init__(self):
-        self.extract_variant_candidate = None
-        self.create_tensor = None
-        self.call_variant = None
-
-    def poll(self):
-        self.extract_variant_candidate.poll()
-        self.create_tensor.poll()
-        self.call_variant.poll()
-
-
-c = InstancesClass()
-
-
-def check_return_code(signum, frame):
-    c.poll()
-    #print >> sys.stderr, c.extract_variant_candidate.returncode, c.create_tensor.returncode, c.call_variant.returncode
-    if c.extract_variant_candidate.returncode != None and c.extract_variant_candidate.returncode != 0:
-        c.create_tensor.kill()
-        c.call_variant.kill()
-        sys.exit("ExtractVariantCandidates.py or GetTruth.py exited with exceptions. Exiting...")
-
-    if c.create_tensor.returncode != None and c.create_tensor.returncode != 0:
-        c.extract_variant_candidate.kill()
-        c.call_variant.kill()
-        sys.exit("CreateTensor.py exited with exceptions. Exiting...")
-
-    if c.call_variant.returncode != None and c.call_variant.returncode != 0:
-        c.extract_variant_candidate.kill()
-        c.create_tensor.kill()
-        sys.exit("call_variant.py exited with exceptions. Exiting...")
-
-    if (
-        c.extract_variant_candidate.returncode == None or
-        c.create_tensor.returncode == None or
-        c.call_variant.returncode == None
-    ):
-        signal.alarm(5)
+from shared.utils import (
+    file_path_from,
+    model_file_path_from,
+    executable_command_string_from,
+    is_command_exists,
+    subprocess_popen
+)
+from shared.cpu_scheduler import CpuScheduler, cpu_list_string_from, DEFAULT_ALLOCATION_FILE_PATH
+
+# cpus reserved for the pypy stages, ExtractVariantCandidates (or GetTruth) and CreateTensor
+PYPY_STAGE_CPUS = 2
+
+
+class PipelineStage(object):
+    def __init__(self, name, process):
+        self.name = name
+        self.process = process
+        self.start_time = time()
+        self.elapsed_time = None
+
+
+def wait_for(stage, exit_queue):
+    stage.process.wait()
+    stage.elapsed_time = time() - stage.start_time
+    exit_queue.put(stage)
+
+
+def supervise(stages):
+    """
+    Wait for all stages at once, each in a thread, the other stages are killed as soon as one stage fails
+    Returns:
+        the failed stage, or None if all stages succeeded
+    """
+    exit_queue = Queue()
+    for stage in stages:
+        waiter = Thread(target=wait_for, args=(stage, exit_queue))
+        waiter.daemon = True
+        waiter.start()
+
+    failed_stage = None
+    for _ in range(len(stages)):
+        stage = exit_queue.get()
+        if stage.process.returncode != 0 and failed_stage is None:
+            failed_stage = stage
+            for other_stage in stages:
+                if other_stage.process.poll() is None:
+                    other_stage.process.kill()
+
+    for stage in stages:
+        print("[INFO] %s exited with %d in %.1f s" % (
+            stage.name, stage.process.returncode, stage.elapsed_time
+        ), file=sys.stderr)
+    return failed_stage
 
 
 def Run(args):
@@ -69,7 +82,8 @@ def Run(args):
     pypyBin = executable_command_string_from(args.pypy, exit_on_not_found=True)
     samtoolsBin = executable_command_string_from(args.samtools, exit_on_not_found=True)
 
-    chkpnt_fn = file_path_from(args.chkpnt_fn, suffix=".meta", exit_on_not_found=True)
+    server_socket = args.server_socket
+    chkpnt_fn = model_file_path_from(args.chkpnt_fn, exit_on_not_found=server_socket is None)
     bam_fn = file_path_from(args.bam_fn, exit_on_not_found=True)
     ref_fn = file_path_from(args.ref_fn, exit_on_not_found=True)
     vcf_fn = file_path_from(args.vcf_fn)
@@ -77,6 +91,9 @@ def Run(args):
 
     dcov = args.dcov
     call_fn = args.call_fn
+    # written to a temporary file of this process first, a VCF at call_fn is then always complete, also if another
+    # process is calling the same chunk
+    temporary_call_fn = "%s.%d.tmp" % (call_fn, os.getpid()) if call_fn is not None else None
     af_threshold = args.threshold
     minCoverage = int(args.minCoverage)
     sampleName = args.sampleName
@@ -93,6 +110,9 @@ def Run(args):
     debug = command_option_from(args.debug, 'debug')
     qual = command_option_from(args.qual, 'qual', option_value=args.qual)
     fast_plotting = command_option_from(args.fast_plotting, 'fast_plotting')
+    progress_prefix = command_option_from(args.progress_prefix, 'progress_prefix', option_value=args.progress_prefix)
+    adaptive_batch_size = command_option_from(args.adaptive_batch_size, 'adaptive_batch_size')
+    batch_timeout = command_option_from(args.batch_timeout, 'batch_timeout', option_value=args.batch_timeout)
 
     ctgStart = None
     ctgEnd = None
@@ -105,21 +125,29 @@ def Run(args):
     else:
         numCpus = args.threads if args.threads < multiprocessing.cpu_count() else multiprocessing.cpu_count()
 
-    maxCpus = multiprocessing.cpu_count()
-    _cpuSet = ",".join(str(x) for x in random.sample(range(0, maxCpus), numCpus))
-
-    taskSet = "taskset -c %s" % (_cpuSet)
-    try:
-        subprocess.check_output("which %s" % ("taskset"), shell=True)
-    except:
-        taskSet = ""
-
     if args.delay > 0:
         delay = random.randrange(0, args.delay)
         print("Delay %d seconds before starting variant calling ..." % (delay), file=sys.stderr)
         sleep(delay)
 
+    # the job gets a set of cpus not used by other jobs on the node, PYPY_STAGE_CPUS of them for the pypy stages and
+    # the rest for call_var, all stages share the cpus if too few are free
+    cpu_scheduler = None
+    taskSet = ""
+    pypyTaskSet = ""
+    if is_command_exists("taskset"):
+        cpu_scheduler = CpuScheduler(args.cpu_allocation_fn)
+        cpus = cpu_scheduler.allocate(numCpus + PYPY_STAGE_CPUS)
+        if len(cpus) > PYPY_STAGE_CPUS:
+            pypy_cpus, tensorflow_cpus = cpus[:PYPY_STAGE_CPUS], cpus[PYPY_STAGE_CPUS:]
+        else:
+            pypy_cpus, tensorflow_cpus = cpus, cpus
+        numCpus = len(tensorflow_cpus)
+        taskSet = "taskset -c %s" % (cpu_list_string_from(tensorflow_cpus))
+        pypyTaskSet = "taskset -c %s" % (cpu_list_string_from(pypy_cpus))
+
     extract_variant_candidate_command_options = [
+        pypyTaskSet,
         pypyBin,
         EVCBin,
         CommandOption('bam_fn', bam_fn),
@@ -130,9 +158,11 @@ def Run(args):
         ctgEnd,
         CommandOption('threshold', af_threshold),
         CommandOption('minCoverage', minCoverage),
-        CommandOption('samtools', samtoolsBin)
+        CommandOption('samtools', samtoolsBin),
+        progress_prefix
     ]
     get_truth_command_options = [
+        pypyTaskSet,
         pypyBin,
         GTBin,
         CommandOption('vcf_fn', vcf_fn),
@@ -142,6 +172,7 @@ def Run(args):
     ]
 
     create_tensor_command_options = [
+        pypyTaskSet,
         pypyBin,
         CTBin,
         CommandOption('bam_fn', bam_fn),
@@ -151,14 +182,17 @@ def Run(args):
         ctgEnd,
         stop_consider_left_edge,
         CommandOption('samtools', samtoolsBin),
-        CommandOption('dcov', dcov)
+        CommandOption('dcov', dcov),
+        progress_prefix
     ]
 
     call_variant_command_options = [
         taskSet,
         ExecuteCommand('python', CVBin),
         CommandOption('chkpnt_fn', chkpnt_fn),
-        CommandOption('call_fn', call_fn),
+        CommandOption('server_socket', server_socket),
+        CommandOption('call_fn', temporary_call_fn),
+        progress_prefix,
         CommandOption('bam_fn', bam_fn),
         CommandOption('sampleName', sampleName),
         CommandOption('threads', numCpus),
@@ -168,7 +202,9 @@ def Run(args):
         haploid_sensitive_mode,
         output_for_ensemble,
         qual,
-        debug
+        debug,
+        adaptive_batch_size,
+        batch_timeout,
     ]
     call_variant_with_activation_command_options = [
         CommandOptionWithNoValue('activation_only'),
@@ -179,67 +215,76 @@ def Run(args):
         fast_plotting,
     ] if args.activation_only else []
 
-    is_true_variant_call = vcf_fn is not None
     try:
-        c.extract_variant_candidate = subprocess_popen(
-            shlex.split(command_string_from(
-                get_truth_command_options if is_true_variant_call else extract_variant_candidate_command_options
-            ))
+        run_pipeline(
+            get_truth_command_options if vcf_fn is not None else extract_variant_candidate_command_options,
+            create_tensor_command_options,
+            call_variant_command_options + call_variant_with_activation_command_options,
+        )
+        if temporary_call_fn is not None:
+            os.replace(temporary_call_fn, call_fn)
+    finally:
+        if temporary_call_fn is not None and os.path.exists(temporary_call_fn):
+            os.remove(temporary_call_fn)
+        if cpu_scheduler is not None:
+            cpu_scheduler.release()
+
+
+def run_pipeline(
+    extract_variant_candidate_command_options,
+    create_tensor_command_options,
+    call_variant_command_options,
+):
+    stages = []
+    try:
+        extract_variant_candidate = subprocess_popen(
+            shlex.split(command_string_from(extract_variant_candidate_command_options))
         )
+        stages.append(PipelineStage("ExtractVariantCandidates.py or GetTruth.py", extract_variant_candidate))
 
-        c.create_tensor = subprocess_popen(
+        create_tensor = subprocess_popen(
             shlex.split(command_string_from(create_tensor_command_options)),
-            stdin=c.extract_variant_candidate.stdout
+            stdin=extract_variant_candidate.stdout
         )
+        stages.append(PipelineStage("CreateTensor.py", create_tensor))
 
-        c.call_variant = subprocess_popen(
-            shlex.split(command_string_from(
-                call_variant_command_options + call_variant_with_activation_command_options
-            )),
-            stdin=c.create_tensor.stdout, stdout=sys.stderr
+        call_variant = subprocess_popen(
+            shlex.split(command_string_from(call_variant_command_options)),
+            stdin=create_tensor.stdout, stdout=sys.stderr
         )
+        stages.append(PipelineStage("call_var.py", call_variant))
     except Exception as e:
         print(e, file=sys.stderr)
+        for stage in stages:
+            stage.process.kill()
         sys.exit("Failed to start required processes. Exiting...")
 
-    signal.signal(signal.SIGALRM, check_return_code)
-    signal.alarm(2)
+    # the pipes are held by the next stages only, a stage exiting early is then seen by its neighbours at once
+    extract_variant_candidate.stdout.close()
+    create_tensor.stdout.close()
 
     try:
-        c.call_variant.wait()
-        c.create_tensor.stdout.close()
-        c.create_tensor.wait()
-        c.extract_variant_candidate.stdout.close()
-        c.extract_variant_candidate.wait()
-    except KeyboardInterrupt as e:
-        print("KeyboardInterrupt received when waiting at CallVarBam, terminating all scripts.")
-        try:
-            c.call_variant.terminate()
-            c.create_tensor.terminate()
-            c.extract_variant_candidate.terminate()
-        except Exception as e:
-            print(e)
-
-        raise KeyboardInterrupt
-    except Exception as e:
-        print("Exception received when waiting at CallVarBam, terminating all scripts.")
-        print(e)
-        try:
-            c.call_variant.terminate()
-            c.create_tensor.terminate()
-            c.extract_variant_candidate.terminate()
-        except Exception as e:
-            print(e)
+        failed_stage = supervise(stages)
+    except KeyboardInterrupt:
+        print("KeyboardInterrupt received when waiting at CallVarBam, terminating all scripts.", file=sys.stderr)
+        for stage in stages:
+            if stage.process.poll() is None:
+                stage.process.terminate()
+        raise
 
-        raise e
+    if failed_stage is not None:
+        sys.exit("%s exited with exceptions. Exiting..." % (failed_stage.name))
 
 
-def main():
+def argument_parser():
     parser = ArgumentParser(description="Call variants using a trained model and a BAM file")
 
     parser.add_argument('--chkpnt_fn', type=str, default=None,
                         help="Input a model")
 
+    parser.add_argument('--server_socket', type=str, default=None,
+                        help="Predict using an inference server started by serve at this UNIX socket, --chkpnt_fn is not required if set, optional")
+
     parser.add_argument('--ref_fn', type=str, default="ref.fa",
                         help="Reference fasta file input, default: %(default)s")
 
@@ -289,8 +334,17 @@ def main():
     parser.add_argument('--threads', type=int, default=None,
                         help="Number of threads, optional")
 
-    parser.add_argument('--delay', type=int, default=10,
-                        help="Wait a short while for no more than %(default)s to start the job. This is to avoid starting multiple jobs simultaneously that might use up the maximum number of threads allowed, because Tensorflow will create more threads than needed at the beginning of running the program.")
+    parser.add_argument('--delay', type=int, default=0,
+                        help="Wait a short while for no more than %(default)s seconds to start the job, not needed with the cpu allocation, default: %(default)s")
+
+    parser.add_argument('--cpu_allocation_fn', type=str, default=DEFAULT_ALLOCATION_FILE_PATH,
+                        help="File shared by concurrent jobs on the node for allocating disjoint cpus to each job, a job waits if no cpu is free, default: %(default)s")
+
+    parser.add_argument('--adaptive_batch_size', action='store_true',
+                        help="Tune the batch size of call_var at runtime for the highest throughput (tensors/s), optional")
+
+    parser.add_argument('--batch_timeout', type=float, default=None,
+                        help="Predict a partial batch in call_var once its first tensor has waited for this many seconds, optional")
 
     parser.add_argument('--debug', action='store_true',
                         help="Debug mode, optional")
@@ -319,14 +373,28 @@ def main():
     parser.add_argument('--output_for_ensemble', action='store_true',
                         help="Output for ensemble")
 
+    parser.add_argument('--progress_prefix', type=str, default=None,
+                        help="Prefix of the files for progress and memory reports and chunk splits, used by callVarBamParallel --split_stragglers and --memory_budget, optional")
+
+    return parser
+
+
+def main():
+    parser = argument_parser()
     args = parser.parse_args()
 
     if len(sys.argv[1:]) == 0:
         parser.print_help()
         sys.exit(1)
 
+    # terminated, e.g. by a worker which lost the lease of the chunk, the stages and the temporary VCF are cleaned up
+    signal.signal(signal.SIGTERM, raise_keyboard_interrupt)
     Run(args)
 
 
+def raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
 if __name__ == "__main__":
     main()
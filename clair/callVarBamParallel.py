@@ -1,6 +1,15 @@
 import os
 import sys
+import shlex
+import signal
 import argparse
+import multiprocessing
+from time import time, sleep
+from shutil import rmtree
+from tempfile import mkdtemp
+from collections import namedtuple, deque
+
+import clair.callVarBam as callVarBam
 
 from shared.command_options import (
     CommandOption,
@@ -10,7 +19,41 @@ from shared.command_options import (
     command_option_from
 )
 from shared.interval_tree import bed_tree_from, is_region_in
-from shared.utils import file_path_from, executable_command_string_from
+from shared.bam_index import BamIndex
+from shared.chunk_progress import ChunkProgress, CREATE_TENSOR_STAGE
+from shared.chunk_queue import ChunkQueue
+from shared.chunk_manifest import (
+    ChunkManifest,
+    parameters_hash_from,
+    CHUNK_RUNNING,
+    CHUNK_DONE,
+    CHUNK_FAILED,
+    CHUNK_PENDING,
+)
+from shared.utils import (
+    file_path_from,
+    model_file_path_from,
+    model_hash_from,
+    executable_command_string_from,
+    is_command_exists,
+    subprocess_popen,
+)
+
+ChunkJob = namedtuple('ChunkJob', ['name', 'args'])
+
+# balanced chunk planning (--balanced_chunks)
+MIN_SKIPPED_REGION_SIZE = 1000000
+MAX_BALANCED_CHUNK_SIZE_RATIO = 4
+
+# splitting straggler chunks (--split_stragglers), the minimum size of both parts of a split
+MIN_SPLIT_REGION_SIZE = 1000000
+
+# admission control (--memory_budget), the reported peak memory of chunks is sampled, scaled up by a margin
+MEMORY_ESTIMATE_MARGIN = 1.2
+GIGABYTE = 1024 ** 3
+
+# seconds to wait for the model to be loaded by the shared inference server (--share_model)
+SHARED_SERVER_START_TIMEOUT = 600
 
 major_contigs = {"chr"+str(a) for a in list(range(1, 23))+["X", "Y"]}.union({str(a) for a in list(range(1, 23))+["X", "Y"]})
 
@@ -22,7 +65,8 @@ def Run(args):
     pypyBin = executable_command_string_from(args.pypy, exit_on_not_found=True)
     samtoolsBin = executable_command_string_from(args.samtools, exit_on_not_found=True)
 
-    chkpnt_fn = file_path_from(args.chkpnt_fn, suffix=".meta", exit_on_not_found=True)
+    server_socket = args.server_socket
+    chkpnt_fn = model_file_path_from(args.chkpnt_fn, exit_on_not_found=server_socket is None)
     bam_fn = file_path_from(args.bam_fn, exit_on_not_found=True)
     ref_fn = file_path_from(args.ref_fn, exit_on_not_found=True)
     fai_fn = file_path_from(args.ref_fn + ".fai", exit_on_not_found=True)
@@ -30,6 +74,8 @@ def Run(args):
     vcf_fn = file_path_from(args.vcf_fn)
 
     output_prefix = args.output_prefix
+    if output_prefix is None:
+        sys.exit("[ERROR] --output_prefix must be specified, the VCF of each chunk and the manifest are named after it")
     af_threshold = args.threshold
 
     tree = bed_tree_from(bed_file_path=bed_fn)
@@ -51,18 +97,16 @@ def Run(args):
     debug = command_option_from(args.debug, 'debug')
     qual = command_option_from(args.qual, 'qual', option_value=args.qual)
     fast_plotting = command_option_from(args.fast_plotting, 'fast_plotting')
+    adaptive_batch_size = command_option_from(args.adaptive_batch_size, 'adaptive_batch_size')
+    batch_timeout = command_option_from(args.batch_timeout, 'batch_timeout', option_value=args.batch_timeout)
 
-    call_var_bam_command_options = [
-        ExecuteCommand('python', callVarBamBin),
-        CommandOption('chkpnt_fn', chkpnt_fn),
+    call_var_bam_command = ExecuteCommand('python', callVarBamBin)
+    # options affecting the calls, recorded in the manifest for --resume
+    calling_command_options = [
         CommandOption('ref_fn', ref_fn),
         CommandOption('bam_fn', bam_fn),
         CommandOption('threshold', af_threshold),
         CommandOption('minCoverage', minCoverage),
-        CommandOption('pypy', pypyBin),
-        CommandOption('samtools', samtoolsBin),
-        CommandOption('delay', delay),
-        CommandOption('threads', threads),
         CommandOption('sampleName', sampleName),
         # optional command options
         CommandOption('vcf_fn', vcf_fn) if vcf_fn is not None else None,
@@ -74,6 +118,16 @@ def Run(args):
         haploid_sensitive_mode,
         output_for_ensemble,
     ]
+    call_var_bam_command_options = [
+        CommandOption('chkpnt_fn', chkpnt_fn),
+        CommandOption('server_socket', server_socket),
+        CommandOption('pypy', pypyBin),
+        CommandOption('samtools', samtoolsBin),
+        CommandOption('delay', delay),
+        CommandOption('threads', threads),
+        adaptive_batch_size,
+        batch_timeout,
+    ] + calling_command_options
 
     activation_only_command_options = [
         CommandOptionWithNoValue('activation_only'),
@@ -84,9 +138,165 @@ def Run(args):
         fast_plotting,
     ] if args.activation_only else []
 
-    is_bed_file_provided = bed_fn is not None
-    command_string = command_string_from(call_var_bam_command_options + activation_only_command_options)
+    # in plain print mode, the chunks are recorded only if --manifest_fn is given
+    is_recording_manifest = args.execute is not None or args.resume or args.manifest_fn is not None
+    manifest_fn = args.manifest_fn if args.manifest_fn is not None else output_prefix + ".manifest.json"
+    parameters_hash = parameters_hash_from(command_string_from(
+        calling_command_options + activation_only_command_options + [CommandOption('bed_fn', bed_fn)]
+    ))
+    model_hash = model_hash_from(chkpnt_fn) if chkpnt_fn is not None and is_recording_manifest else None
 
+    if args.resume:
+        manifest = resumed_manifest_from(manifest_fn, parameters_hash, model_hash)
+    else:
+        is_bed_file_provided = bed_fn is not None
+        chunks = (balanced_chunks_from if args.balanced_chunks else chunks_from)(
+            fai_fn=fai_fn,
+            bam_fn=bam_fn,
+            tree=tree,
+            is_bed_file_provided=is_bed_file_provided,
+            is_include_all_contigs=is_include_all_contigs,
+            region_chunk_size=region_chunk_size,
+        )
+        manifest = ChunkManifest(manifest_fn, parameters_hash, model_hash)
+        for contig_name, region_start, region_end, is_region_in_bed in chunks:
+            manifest.add(
+                name="%s:%d-%d" % (contig_name, region_start, region_end),
+                ctg_name=contig_name,
+                ctg_start=region_start,
+                ctg_end=region_end,
+                call_fn="%s.%s_%d_%d.vcf" % (output_prefix, contig_name, region_start, region_end),
+                is_region_in_bed=is_region_in_bed,
+            )
+        if is_recording_manifest:
+            manifest.save()
+
+    chunk_names, chunk_command_options = [], []
+    for name, chunk in manifest.unfinished_chunks():
+        chunk_names.append(name)
+        chunk_command_options.append(call_var_bam_command_options + activation_only_command_options + [
+            CommandOption('ctgName', chunk["ctgName"]),
+            CommandOption('ctgStart', chunk["ctgStart"]),
+            CommandOption('ctgEnd', chunk["ctgEnd"]),
+            CommandOption('call_fn', chunk["call_fn"]),
+            CommandOption('bed_fn', bed_fn) if chunk["is_region_in_bed"] else None
+        ])
+
+    if args.queue_dir is not None:
+        publish_chunk_jobs(args.queue_dir, chunk_names, chunk_command_options, max_attempts=args.retries + 1)
+        return
+
+    if args.execute is None:
+        for command_options in chunk_command_options:
+            print(command_string_from([call_var_bam_command] + command_options))
+        return
+
+    # parsed in advance with the parser of callVarBam, no re-parsing or re-importing in the forked workers
+    chunk_jobs = [
+        ChunkJob(
+            name=name,
+            args=callVarBam.argument_parser().parse_args(shlex.split(command_string_from(command_options))),
+        )
+        for name, command_options in zip(chunk_names, chunk_command_options)
+    ]
+    shared_server = None
+    if args.share_model:
+        shared_server, shared_server_socket = shared_inference_server_from(
+            chkpnt_fn=chkpnt_fn,
+            threads=args.tensorflowThreads,
+            is_adaptive_batch_size=args.adaptive_batch_size,
+        )
+        for chunk_job in chunk_jobs:
+            chunk_job.args.server_socket = shared_server_socket
+
+    try:
+        is_all_done = execute_chunk_jobs(
+            chunk_jobs,
+            no_of_workers=args.execute,
+            retries=args.retries,
+            output_prefix=output_prefix,
+            manifest=manifest,
+            is_splitting_stragglers=args.split_stragglers,
+            memory_budget=int(args.memory_budget * GIGABYTE) if args.memory_budget is not None else None,
+            chunk_memory_estimate=int(args.chunk_memory * GIGABYTE),
+        )
+    finally:
+        if shared_server is not None:
+            shared_server.terminate()
+            shared_server.wait()
+            rmtree(os.path.dirname(shared_server_socket), ignore_errors=True)
+    if not is_all_done:
+        sys.exit(1)
+
+
+def publish_chunk_jobs(queue_dir, chunk_names, chunk_command_options, max_attempts):
+    """
+    Publish the chunks to a queue for clair.py worker processes on any host mounting queue_dir
+    """
+    chunk_queue = ChunkQueue(queue_dir)
+    chunk_queue.create()
+    for index, (name, command_options) in enumerate(zip(chunk_names, chunk_command_options)):
+        chunk_queue.publish(index, name, command_string_from(command_options), max_attempts=max_attempts)
+    print("[INFO] %d chunks published to %s, run them with: python %s worker --queue_dir %s" % (
+        len(chunk_names), queue_dir, os.path.abspath(os.path.dirname(__file__) + "/../clair.py"), queue_dir
+    ), file=sys.stderr)
+
+
+def shared_inference_server_from(chkpnt_fn, threads, is_adaptive_batch_size):
+    """
+    Start serve with the model in a new process, for all chunks to predict through, so the model is loaded only once
+    Returns:
+        (the server process, its UNIX socket) once the socket is ready
+    """
+    socket_fn = os.path.join(mkdtemp(prefix="clair_serve_"), "serve.sock")
+    serve_command_options = [
+        ExecuteCommand('python', os.path.dirname(__file__) + "/../clair.py serve"),
+        CommandOption('chkpnt_fn', chkpnt_fn),
+        CommandOption('socket_fn', socket_fn),
+        CommandOption('threads', threads),
+        command_option_from(is_adaptive_batch_size, 'adaptive_batch_size'),
+    ]
+    server = subprocess_popen(shlex.split(command_string_from(serve_command_options)), stdout=sys.stderr)
+
+    start_time = time()
+    while not os.path.exists(socket_fn):
+        if server.poll() is not None:
+            sys.exit("[ERROR] Failed to start the inference server for --share_model")
+        if time() - start_time > SHARED_SERVER_START_TIMEOUT:
+            server.terminate()
+            sys.exit("[ERROR] The inference server for --share_model is not ready in %d s" % (SHARED_SERVER_START_TIMEOUT))
+        sleep(0.5)
+    print("[INFO] Model shared by all chunks through %s" % (socket_fn), file=sys.stderr)
+    return server, socket_fn
+
+
+def resumed_manifest_from(manifest_fn, parameters_hash, model_hash):
+    """
+    Load the manifest of a previous run with the same parameters and model, chunks without a VCF are to be rerun
+    """
+    if not os.path.isfile(manifest_fn):
+        sys.exit("[ERROR] manifest %s not found, cannot resume" % (manifest_fn))
+    try:
+        manifest = ChunkManifest.load(manifest_fn)
+    except (ValueError, KeyError) as e:
+        sys.exit("[ERROR] manifest %s is invalid: %s" % (manifest_fn, e))
+    if manifest.parameters_hash != parameters_hash:
+        sys.exit("[ERROR] Calling parameters differ from the run recorded in %s, cannot resume" % (manifest_fn))
+    if manifest.model_hash != model_hash:
+        sys.exit("[ERROR] Model differs from the run recorded in %s, cannot resume" % (manifest_fn))
+
+    manifest.refresh_status()
+    no_of_unfinished_chunks = len(manifest.unfinished_chunks())
+    print("[INFO] Resuming %s, %d of %d chunks to be run" % (
+        manifest_fn, no_of_unfinished_chunks, len(manifest.chunks)
+    ), file=sys.stderr)
+    return manifest
+
+
+def contigs_from(fai_fn, is_include_all_contigs):
+    """
+    Yield (contig name, contig length) of the contigs to be called
+    """
     with open(fai_fn, 'r') as fai_fp:
         for row in fai_fp:
             columns = row.strip().split("\t")
@@ -95,28 +305,383 @@ def Run(args):
             if not is_include_all_contigs and str(contig_name) not in major_contigs:
                 continue
 
-            region_start, region_end = 0, 0
-            contig_length = int(columns[1])
-            while region_end < contig_length:
-                region_start = region_end
-                region_end = region_start + region_chunk_size
-                if region_end > contig_length:
-                    region_end = contig_length
-                output_fn = "%s.%s_%d_%d.vcf" % (output_prefix, contig_name, region_start, region_end)
-
-                is_region_in_bed = is_bed_file_provided and is_region_in(tree, contig_name, region_start, region_end)
-                need_output_command = not is_bed_file_provided or is_region_in_bed
-                if not need_output_command:
+            yield contig_name, int(columns[1])
+
+
+def chunks_from(fai_fn, bam_fn, tree, is_bed_file_provided, is_include_all_contigs, region_chunk_size):
+    """
+    Yield (contig name, start, end, is region in bed) for each chunk of the genome to be called
+    """
+    for contig_name, contig_length in contigs_from(fai_fn, is_include_all_contigs):
+        region_start, region_end = 0, 0
+        while region_end < contig_length:
+            region_start = region_end
+            region_end = region_start + region_chunk_size
+            if region_end > contig_length:
+                region_end = contig_length
+
+            is_region_in_bed = is_bed_file_provided and is_region_in(tree, contig_name, region_start, region_end)
+            need_output_command = not is_bed_file_provided or is_region_in_bed
+            if not need_output_command:
+                continue
+
+            yield contig_name, region_start, region_end, is_region_in_bed
+
+
+def balanced_chunks_from(fai_fn, bam_fn, tree, is_bed_file_provided, is_include_all_contigs, region_chunk_size):
+    """
+    Yield (contig name, start, end, is region in bed) for chunks of roughly equal estimated work,
+    estimated from the compressed size of alignments in the BAM index, within the BED regions if provided
+    The number of chunks is about the same as fixed size chunks of region_chunk_size, and no chunk is longer than
+    MAX_BALANCED_CHUNK_SIZE_RATIO * region_chunk_size. Empty regions of at least MIN_SKIPPED_REGION_SIZE are skipped.
+    """
+    bam_index = BamIndex.from_bam(bam_fn, exit_on_not_found=True)
+    window_size = bam_index.window_size
+
+    contig_windows = []
+    total_work = 0.0
+    total_length = 0
+    for contig_name, contig_length in contigs_from(fai_fn, is_include_all_contigs):
+        work, is_occupied = bam_index.window_work_from(contig_name, contig_length)
+        if is_bed_file_provided:
+            for window in range(len(work)):
+                window_start = window * window_size
+                if not is_region_in(tree, contig_name, window_start, min(window_start + window_size, contig_length)):
+                    work[window], is_occupied[window] = 0.0, False
+        contig_windows.append((contig_name, contig_length, work, is_occupied))
+        total_work += sum(work)
+        total_length += contig_length
+
+    no_of_chunks = max(1, (total_length + region_chunk_size - 1) // region_chunk_size)
+    target_work = total_work / no_of_chunks
+    max_chunk_size = MAX_BALANCED_CHUNK_SIZE_RATIO * region_chunk_size
+    min_skipped_windows = (MIN_SKIPPED_REGION_SIZE + window_size - 1) // window_size
+
+    for contig_name, contig_length, work, is_occupied in contig_windows:
+        is_skipped = skipped_windows_from(is_occupied, min_skipped_windows)
+
+        chunk_start, chunk_work = None, 0.0
+        for window in range(len(work)):
+            window_start = window * window_size
+            window_end = min(window_start + window_size, contig_length)
+            if is_skipped[window]:
+                if chunk_start is not None:
+                    yield contig_name, chunk_start, window_start, is_bed_file_provided
+                    chunk_start, chunk_work = None, 0.0
+                continue
+
+            if chunk_start is None:
+                chunk_start = window_start
+            chunk_work += work[window]
+            if chunk_work >= target_work or window_end - chunk_start >= max_chunk_size:
+                yield contig_name, chunk_start, window_end, is_bed_file_provided
+                chunk_start, chunk_work = None, 0.0
+
+        if chunk_start is not None:
+            yield contig_name, chunk_start, contig_length, is_bed_file_provided
+
+
+def skipped_windows_from(is_occupied, min_skipped_windows):
+    """
+    Windows in runs of at least min_skipped_windows windows without alignments, shorter gaps are kept in the chunks
+    """
+    is_skipped = [False] * len(is_occupied)
+    run_start = None
+    for window, is_window_occupied in enumerate(is_occupied + [True]):
+        if not is_window_occupied:
+            if run_start is None:
+                run_start = window
+            continue
+        if run_start is not None and window - run_start >= min_skipped_windows:
+            for skipped_window in range(run_start, window):
+                is_skipped[skipped_window] = True
+        run_start = None
+    return is_skipped
+
+
+def setup_chunk_worker():
+    # Ctrl-C is handled by the main process, which terminates the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, raise_keyboard_interrupt)
+
+
+def raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run_chunk_job(chunk_job):
+    start_time = time()
+    try:
+        callVarBam.Run(chunk_job.args)
+        is_succeeded = True
+    except KeyboardInterrupt:
+        raise
+    except BaseException as e:
+        print("[WARNING] %s failed: %s" % (chunk_job.name, e), file=sys.stderr)
+        is_succeeded = False
+    return is_succeeded, time() - start_time
+
+
+def region_name_from(chunk_args):
+    return "%s:%d-%d" % (chunk_args.ctgName, chunk_args.ctgStart, chunk_args.ctgEnd)
+
+
+class ChunkJobExecutor(object):
+    """
+    Run callVarBam on the chunks in a pool of no_of_workers processes, a new process per chunk,
+    failed chunks are retried for no more than retries times
+    If progress_directory is set, the chunks report their progress and memory use there
+    If is_splitting_stragglers, once a worker goes idle, the rest of the chunk with the most remaining region
+    is split at its middle, the tail is run as a new chunk
+    If memory_budget (bytes) is set, a chunk is started only if the memory of the running chunks, each the larger of
+    its reported peak and chunk_memory_estimate, plus chunk_memory_estimate fits, chunk_memory_estimate is raised
+    to the peak of the finished chunks
+    If manifest is set, the status of the chunks, including the new ones from splits, is recorded there
+    """
+
+    def __init__(
+        self,
+        no_of_workers,
+        retries,
+        output_prefix,
+        progress_directory=None,
+        is_splitting_stragglers=False,
+        memory_budget=None,
+        chunk_memory_estimate=None,
+        manifest=None,
+    ):
+        self.no_of_workers = no_of_workers
+        self.retries = retries
+        self.output_prefix = output_prefix
+        self.progress_directory = progress_directory
+        self.is_splitting_stragglers = is_splitting_stragglers
+        self.memory_budget = memory_budget
+        self.chunk_memory_estimate = chunk_memory_estimate
+        self.manifest = manifest
+        self.peak_memory = {}
+        self.is_waiting_for_memory = False
+
+        self.pending = deque()
+        self.running = {}
+        self.splitting = {}
+        self.unsplittable = set()
+        # VCF names of split heads given when they were started, renamed to their current names once done
+        self.started_call_fns = {}
+        self.failed = []
+        self.no_of_chunks = 0
+        self.no_of_chunks_done = 0
+        self.start_time = time()
+
+    def add(self, chunk_job, attempt=0, is_urgent=False):
+        if attempt == 0:
+            self.no_of_chunks += 1
+        if self.progress_directory is not None:
+            chunk_job.args.progress_prefix = os.path.join(self.progress_directory, chunk_job.name)
+        (self.pending.appendleft if is_urgent else self.pending.append)((chunk_job, attempt))
+
+    def update_manifest(self, chunk_job, **fields):
+        if self.manifest is not None:
+            self.manifest.update(chunk_job.name, **fields)
+
+    def chunk_progress_of(self, chunk_job):
+        return ChunkProgress(chunk_job.args.progress_prefix)
+
+    def run(self, pool):
+        """
+        Returns:
+            True if all chunks succeeded
+        """
+        while len(self.pending) > 0 or len(self.running) > 0:
+            while len(self.pending) > 0 and len(self.running) < self.no_of_workers and self.is_memory_available():
+                chunk_job, attempt = self.pending.popleft()
+                if self.progress_directory is not None:
+                    self.chunk_progress_of(chunk_job).clear()
+                self.peak_memory[chunk_job.name] = 0
+                self.running[chunk_job.name] = (chunk_job, attempt, pool.apply_async(run_chunk_job, (chunk_job,)))
+                self.update_manifest(chunk_job, status=CHUNK_RUNNING, attempts=attempt + 1)
+
+            sleep(1)
+            if self.progress_directory is not None:
+                self.update_peak_memory()
+            self.collect_finished_chunks()
+            if self.is_splitting_stragglers:
+                self.resolve_splits()
+                self.split_stragglers()
+
+        for chunk_job in self.failed:
+            print("[ERROR] %s failed after %d attempt(s)" % (region_name_from(chunk_job.args), self.retries + 1), file=sys.stderr)
+        return len(self.failed) == 0
+
+    def update_peak_memory(self):
+        for name, (chunk_job, _, _) in self.running.items():
+            self.peak_memory[name] = max(self.peak_memory[name], self.chunk_progress_of(chunk_job).memory())
+
+    def is_memory_available(self):
+        if self.memory_budget is None or len(self.running) == 0:
+            return True
+        projected_memory = self.chunk_memory_estimate + sum(
+            max(self.peak_memory[name], self.chunk_memory_estimate) for name in self.running
+        )
+        is_memory_available = projected_memory <= self.memory_budget
+        if not is_memory_available and not self.is_waiting_for_memory:
+            print("[INFO] %d chunks running, projected memory %.1f GB exceeds the budget %.1f GB with one more" % (
+                len(self.running), float(projected_memory) / GIGABYTE, float(self.memory_budget) / GIGABYTE
+            ), file=sys.stderr)
+        self.is_waiting_for_memory = not is_memory_available
+        return is_memory_available
+
+    def collect_finished_chunks(self):
+        for name in list(self.running.keys()):
+            chunk_job, attempt, result = self.running[name]
+            if not result.ready():
+                continue
+            del self.running[name]
+            peak_memory = self.peak_memory.pop(name, 0)
+            is_succeeded, elapsed_time = result.get()
+            if name in self.splitting:
+                self.resolve_split(chunk_job, is_finished=True)
+
+            started_call_fn = self.started_call_fns.pop(name, None)
+            if is_succeeded and started_call_fn is not None:
+                os.replace(started_call_fn, chunk_job.args.call_fn)
+
+            if is_succeeded:
+                self.update_manifest(chunk_job, status=CHUNK_DONE)
+                self.no_of_chunks_done += 1
+                if self.chunk_memory_estimate is not None:
+                    self.chunk_memory_estimate = max(self.chunk_memory_estimate, int(peak_memory * MEMORY_ESTIMATE_MARGIN))
+                print("[INFO] %s done in %.1f s%s (%d/%d chunks, %.1f s elapsed)" % (
+                    region_name_from(chunk_job.args), elapsed_time,
+                    ", peak memory %.2f GB" % (float(peak_memory) / GIGABYTE) if peak_memory > 0 else "",
+                    self.no_of_chunks_done, self.no_of_chunks, time() - self.start_time
+                ), file=sys.stderr)
+            elif attempt < self.retries:
+                print("[INFO] Retrying %s, attempt %d" % (region_name_from(chunk_job.args), attempt + 2), file=sys.stderr)
+                self.update_manifest(chunk_job, status=CHUNK_PENDING)
+                self.add(chunk_job, attempt=attempt + 1)
+            else:
+                self.update_manifest(chunk_job, status=CHUNK_FAILED)
+                self.failed.append(chunk_job)
+
+    def resolve_splits(self):
+        for name in list(self.splitting.keys()):
+            self.resolve_split(self.running[name][0], is_finished=False)
+
+    def resolve_split(self, chunk_job, is_finished):
+        """
+        A split is accepted by CreateTensor or not, the answer is final once the chunk is finished
+        """
+        split_answer = self.chunk_progress_of(chunk_job).split_answer()
+        if split_answer is None and not is_finished:
+            return
+        del self.splitting[chunk_job.name]
+        # a chunk is split at most once, the answer files of an attempt are kept until the next attempt starts and
+        # would otherwise be read again as the answer to a new request
+        self.unsplittable.add(chunk_job.name)
+        if split_answer is None or split_answer is False:
+            return
+        if not chunk_job.args.ctgStart <= split_answer < chunk_job.args.ctgEnd:
+            print("[WARNING] Ignored the split of %s at %d, outside of the chunk" % (
+                chunk_job.name, split_answer
+            ), file=sys.stderr)
+            return
+
+        # the head keeps [start, split end], also when retried, and the tail (split end, end] is a new chunk
+        # the VCF of the head is named after its new range, the running attempt still writes to the name it was given
+        tail_args = argparse.Namespace(**vars(chunk_job.args))
+        tail_args.ctgStart = split_answer + 1
+        tail_args.call_fn = self.call_fn_from(tail_args)
+        self.started_call_fns.setdefault(chunk_job.name, chunk_job.args.call_fn)
+        chunk_job.args.ctgEnd = split_answer
+        chunk_job.args.call_fn = self.call_fn_from(chunk_job.args)
+        tail_chunk_job = ChunkJob(name=region_name_from(tail_args), args=tail_args)
+        if self.manifest is not None:
+            self.manifest.add(
+                name=tail_chunk_job.name,
+                ctg_name=tail_args.ctgName,
+                ctg_start=tail_args.ctgStart,
+                ctg_end=tail_args.ctgEnd,
+                call_fn=tail_args.call_fn,
+                is_region_in_bed=tail_args.bed_fn is not None,
+            )
+            self.update_manifest(chunk_job, ctgEnd=split_answer, call_fn=chunk_job.args.call_fn)
+        print("[INFO] Split %s, %s is run as a new chunk" % (
+            chunk_job.name, region_name_from(tail_args)
+        ), file=sys.stderr)
+        self.add(tail_chunk_job, is_urgent=True)
+
+    def call_fn_from(self, args):
+        return "%s.%s_%d_%d.vcf" % (self.output_prefix, args.ctgName, args.ctgStart, args.ctgEnd)
+
+    def split_stragglers(self):
+        no_of_idle_workers = self.no_of_workers - len(self.running) - len(self.pending)
+        while len(self.splitting) < no_of_idle_workers:
+            straggler, split_end = None, None
+            longest_remaining_region = 2 * MIN_SPLIT_REGION_SIZE
+            for name, (chunk_job, _, _) in self.running.items():
+                if name in self.splitting or name in self.unsplittable:
                     continue
+                position = self.chunk_progress_of(chunk_job).position_of(CREATE_TENSOR_STAGE)
+                position = max(position or 0, chunk_job.args.ctgStart)
+                remaining_region = chunk_job.args.ctgEnd - position
+                if remaining_region >= longest_remaining_region:
+                    straggler, split_end = chunk_job, position + remaining_region // 2
+                    longest_remaining_region = remaining_region
+            if straggler is None:
+                return
+            self.chunk_progress_of(straggler).request_split(split_end)
+            self.splitting[straggler.name] = split_end
+
+
+def execute_chunk_jobs(
+    chunk_jobs,
+    no_of_workers,
+    retries,
+    output_prefix,
+    manifest=None,
+    is_splitting_stragglers=False,
+    memory_budget=None,
+    chunk_memory_estimate=None,
+):
+    """
+    Returns:
+        True if all chunks succeeded
+    """
+    # cached in this process before forking, the workers then skip the checks
+    for command in ["taskset", "gzip"]:
+        is_command_exists(command)
+
+    is_reporting_progress = is_splitting_stragglers or memory_budget is not None
+    progress_directory = mkdtemp(prefix="clair_progress_") if is_reporting_progress else None
+    executor = ChunkJobExecutor(
+        no_of_workers=no_of_workers,
+        retries=retries,
+        output_prefix=output_prefix,
+        progress_directory=progress_directory,
+        is_splitting_stragglers=is_splitting_stragglers,
+        memory_budget=memory_budget,
+        chunk_memory_estimate=chunk_memory_estimate,
+        manifest=manifest,
+    )
+    for chunk_job in chunk_jobs:
+        executor.add(chunk_job)
+
+    signal.signal(signal.SIGTERM, raise_keyboard_interrupt)
+    pool = multiprocessing.Pool(processes=no_of_workers, initializer=setup_chunk_worker, maxtasksperchild=1)
+    try:
+        is_all_done = executor.run(pool)
+        pool.close()
+    except KeyboardInterrupt:
+        print("[INFO] Interrupted, terminating all running chunks", file=sys.stderr)
+        pool.terminate()
+        pool.join()
+        sys.exit(1)
+    finally:
+        if progress_directory is not None:
+            rmtree(progress_directory, ignore_errors=True)
+    pool.join()
 
-                additional_command_options = [
-                    CommandOption('ctgName', contig_name),
-                    CommandOption('ctgStart', region_start),
-                    CommandOption('ctgEnd', region_end),
-                    CommandOption('call_fn', output_fn),
-                    CommandOption('bed_fn', bed_fn) if is_region_in_bed else None
-                ]
-                print(command_string + " " + command_string_from(additional_command_options))
+    return is_all_done
 
 
 def main():
@@ -126,6 +691,9 @@ def main():
     parser.add_argument('--chkpnt_fn', type=str, default=None,
                         help="Input a model")
 
+    parser.add_argument('--server_socket', type=str, default=None,
+                        help="Predict using an inference server started by serve at this UNIX socket, --chkpnt_fn is not required if set, optional")
+
     parser.add_argument('--ref_fn', type=str, default="ref.fa",
                         help="Reference fasta file input, default: %(default)s")
 
@@ -135,6 +703,9 @@ def main():
     parser.add_argument('--refChunkSize', type=int, default=10000000,
                         help="Divide job with smaller genome chunk size for parallelism, default: %(default)s")
 
+    parser.add_argument('--balanced_chunks', action='store_true',
+                        help="Divide job into chunks of about equal work estimated from the BAM index (.bai or .csi), about as many chunks as with --refChunkSize, and skip regions without alignments")
+
     parser.add_argument('--bam_fn', type=str, default="bam.bam",
                         help="BAM file input, default: %(default)s")
 
@@ -142,7 +713,7 @@ def main():
                         help="Candidate sites VCF file input, if provided, variants will only be called at the sites in the VCF file,  default: %(default)s")
 
     parser.add_argument('--output_prefix', type=str, default=None,
-                        help="Output prefix")
+                        help="Output prefix, required")
 
     parser.add_argument('--includingAllContigs', action='store_true',
                         help="Call variants on all contigs, default: chr{1..22,X,Y,M,MT} and {1..22,X,Y,MT}")
@@ -171,8 +742,14 @@ def main():
     parser.add_argument('--pypy', type=str, default="pypy3",
                         help="Path to the 'pypy', default: %(default)s")
 
-    parser.add_argument('--delay', type=int, default=10,
-                        help="Wait a short while for no more than %(default)s to start the job. This is to avoid starting multiple jobs simultaneously that might use up the maximum number of threads allowed, because Tensorflow will create more threads than needed at the beginning of running the program.")
+    parser.add_argument('--delay', type=int, default=0,
+                        help="Wait a short while for no more than %(default)s seconds to start each job, not needed with the cpu allocation in callVarBam, default: %(default)s")
+
+    parser.add_argument('--adaptive_batch_size', action='store_true',
+                        help="Tune the batch size of call_var at runtime for the highest throughput (tensors/s), optional")
+
+    parser.add_argument('--batch_timeout', type=float, default=None,
+                        help="Predict a partial batch in call_var once its first tensor has waited for this many seconds, optional")
 
     parser.add_argument('--debug', action='store_true',
                         help="Debug mode, optional")
@@ -201,16 +778,50 @@ def main():
     parser.add_argument('--output_for_ensemble', action='store_true',
                         help="Output for ensemble")
 
+    parser.add_argument('--execute', type=int, default=None,
+                        help="Run the callVarBam jobs in this many processes, instead of printing the commands, optional")
+
+    parser.add_argument('--queue_dir', type=str, default=None,
+                        help="Publish the chunks to a queue in this shared directory for clair.py worker processes on any host, instead of printing the commands, optional")
+
+    parser.add_argument('--retries', type=int, default=2,
+                        help="Number of retries for a failed chunk with --execute or --queue_dir, default: %(default)s")
+
+    parser.add_argument('--split_stragglers', action='store_true',
+                        help="With --execute, split the rest of the slowest chunk at a safe position for an idle worker, optional")
+
+    parser.add_argument('--memory_budget', type=float, default=None,
+                        help="With --execute, start a chunk only if the projected memory of all running chunks fits in this many GB, optional")
+
+    parser.add_argument('--chunk_memory', type=float, default=3.0,
+                        help="Initial estimate of the memory of a chunk in GB for --memory_budget, raised to the peak of the finished chunks, default: %(default)s")
+
+    parser.add_argument('--share_model', action='store_true',
+                        help="With --execute, load the model once in an inference server (serve) shared by all chunks instead of once per chunk, optional")
+
+    parser.add_argument('--manifest_fn', type=str, default=None,
+                        help="Record the chunks and their status in this file, always recorded with --execute or --resume, default: OUTPUT_PREFIX.manifest.json")
+
+    parser.add_argument('--resume', action='store_true',
+                        help="Run (or print) only the chunks of the run recorded in the manifest without a complete VCF, the parameters and model must be the same, optional")
+
     args = parser.parse_args()
 
     if len(sys.argv[1:]) == 0:
         parser.print_help()
         sys.exit(1)
 
-    if not args.includingAllContigs:
-        print("echo \"[INFO] --includingAllContigs not enabled, use chr{1..22,X,Y,M,MT} and {1..22,X,Y,MT} by default\"\n")
-    else:
-        print("echo \"[INFO] --includingAllContigs enabled\"\n")
+    if args.share_model and (args.execute is None or args.server_socket is not None or args.activation_only):
+        sys.exit("[ERROR] --share_model requires --execute, and cannot be used with --server_socket or --activation_only.")
+
+    if args.queue_dir is not None and args.execute is not None:
+        sys.exit("[ERROR] --queue_dir and --execute cannot be used together.")
+
+    if args.execute is None and args.queue_dir is None:
+        if not args.includingAllContigs:
+            print("echo \"[INFO] --includingAllContigs not enabled, use chr{1..22,X,Y,M,MT} and {1..22,X,Y,MT} by default\"\n")
+        else:
+            print("echo \"[INFO] --includingAllContigs enabled\"\n")
 
     Run(args)
 
@@ -0,0 +1,365 @@
+import os
+import sys
+import shlex
+import logging
+import numpy as np
+from time import time
+from queue import Queue, Empty
+from threading import Thread
+from argparse import ArgumentParser
+
+import clair.utils as utils
+import shared.param as param
+from clair.call_var import OutputConfig, output_utilties_from, batch_output, model_from
+from clair.callVarBamParallel import chunks_from, balanced_chunks_from
+from shared.command_options import CommandOption, command_string_from, command_option_from
+from shared.interval_tree import bed_tree_from
+from shared.utils import file_path_from, model_file_path_from, executable_command_string_from, subprocess_popen
+
+logging.basicConfig(format='%(message)s', level=logging.INFO)
+
+# tensor rows are passed from a producer to the inference loop in segments of this size
+PRODUCER_SEGMENT_SIZE = 500
+
+
+class OrderedOutput(object):
+    """
+    Output rows of many chunks, in order of the chunk index no matter in which order the chunks are called
+    Rows of the first unfinished chunk are written right away, rows of later chunks are held until it finishes
+    """
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.chunk_index = None
+        self.next_chunk_index = 0
+        self.held_rows = {}
+        self.finished_chunk_indexes = set()
+
+    def output(self, row):
+        if self.chunk_index is None or self.chunk_index == self.next_chunk_index:
+            print(row, file=self.output_file)
+        else:
+            self.held_rows.setdefault(self.chunk_index, []).append(row)
+
+    def finish_chunk(self, chunk_index):
+        self.finished_chunk_indexes.add(chunk_index)
+        while self.next_chunk_index in self.finished_chunk_indexes:
+            self.finished_chunk_indexes.remove(self.next_chunk_index)
+            self.next_chunk_index += 1
+            for row in self.held_rows.pop(self.next_chunk_index, []):
+                print(row, file=self.output_file)
+
+
+class TensorProducers(object):
+    """
+    Run ExtractVariantCandidates | CreateTensor on the chunks in no_of_producers concurrent pipelines
+    Tensor rows are put into segment_queue as (chunk index, rows), followed by (chunk index, None) once a chunk is done
+    or has failed, error is then set
+    """
+
+    def __init__(self, chunk_command_options, no_of_producers, segment_queue):
+        self.chunk_queue = Queue()
+        for chunk_index, command_options in enumerate(chunk_command_options):
+            self.chunk_queue.put((chunk_index, command_options))
+        self.segment_queue = segment_queue
+        self.processes = []
+        self.error = None
+
+        self.threads = [Thread(target=self.produce) for _ in range(no_of_producers)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def produce(self):
+        while self.error is None:
+            try:
+                chunk_index, (evc_command_options, ct_command_options) = self.chunk_queue.get_nowait()
+            except Empty:
+                return
+
+            # the end of the chunk is always put, the inference loop would otherwise wait for it forever
+            try:
+                self.produce_chunk(chunk_index, evc_command_options, ct_command_options)
+            except Exception as e:
+                self.error = "Failed to produce the tensors of chunk %d: %s" % (chunk_index, e)
+            finally:
+                self.segment_queue.put((chunk_index, None))
+
+    def produce_chunk(self, chunk_index, evc_command_options, ct_command_options):
+        evc = subprocess_popen(shlex.split(command_string_from(evc_command_options)))
+        self.processes.append(evc)
+        ct = subprocess_popen(shlex.split(command_string_from(ct_command_options)), stdin=evc.stdout)
+        self.processes.append(ct)
+
+        rows = []
+        for row in ct.stdout:
+            rows.append(row)
+            if len(rows) >= PRODUCER_SEGMENT_SIZE:
+                self.segment_queue.put((chunk_index, rows))
+                rows = []
+        if len(rows) > 0:
+            self.segment_queue.put((chunk_index, rows))
+
+        ct.wait()
+        evc.stdout.close()
+        evc.wait()
+        if evc.returncode != 0 or ct.returncode != 0:
+            self.error = "ExtractVariantCandidates.py or CreateTensor.py exited with exceptions in chunk %d" % (
+                chunk_index
+            )
+
+    def terminate(self):
+        for process in self.processes:
+            if process.poll() is None:
+                process.kill()
+
+
+def segments_in_batch_from(segment_queue, batch_size, batch_timeout):
+    """
+    Returns:
+        [(chunk index, rows or None)], with up to about batch_size tensor rows, from one or more producers
+    """
+    segments = [segment_queue.get()]
+    no_of_rows = len(segments[0][1] or [])
+    deadline = time() + batch_timeout
+    while no_of_rows < batch_size:
+        try:
+            segment = segment_queue.get(timeout=max(0, deadline - time()))
+        except Empty:
+            break
+        segments.append(segment)
+        no_of_rows += len(segment[1] or [])
+    return segments
+
+
+def call_variants_in_genome(args, m, chunks, chunk_command_options, output_config, output_utilities, ordered_output):
+    segment_queue = Queue(maxsize=4 * args.producers)
+    producers = TensorProducers(chunk_command_options, args.producers, segment_queue)
+
+    output_utilities.output_header()
+    no_of_finished_chunks = 0
+    no_of_tensors = 0
+    variant_call_start_time = time()
+
+    while no_of_finished_chunks < len(chunks):
+        segments = segments_in_batch_from(segment_queue, args.batch_size, args.batch_timeout)
+        if producers.error is not None:
+            producers.terminate()
+            sys.exit("[ERROR] %s" % (producers.error))
+
+        # a mini batch per segment, None for the end of a chunk
+        mini_batches = [None if rows is None else utils.tensor_batch_from(rows) for _, rows in segments]
+        Xs = [mini_batch[0] for mini_batch in mini_batches if mini_batch is not None and len(mini_batch[1]) > 0]
+        if len(Xs) > 0:
+            prediction = m.predict(np.concatenate(Xs))
+            no_of_tensors += sum(len(X) for X in Xs)
+
+        # output in the order received, the rows of each chunk are then all output before the chunk is finished
+        offset = 0
+        for (chunk_index, _), mini_batch in zip(segments, mini_batches):
+            if mini_batch is None:
+                ordered_output.finish_chunk(chunk_index)
+                no_of_finished_chunks += 1
+                contig_name, region_start, region_end, _ = chunks[chunk_index]
+                logging.info("[INFO] %s:%d-%d done (%d/%d chunks, %d tensors, %.1f s elapsed)" % (
+                    contig_name, region_start, region_end, no_of_finished_chunks, len(chunks),
+                    no_of_tensors, time() - variant_call_start_time
+                ))
+                continue
+
+            no_of_tensors_in_mini_batch = len(mini_batch[1])
+            if no_of_tensors_in_mini_batch == 0:
+                continue
+            ordered_output.chunk_index = chunk_index
+            batch_output(
+                mini_batch,
+                [probabilities[offset:offset + no_of_tensors_in_mini_batch] for probabilities in prediction],
+                output_config,
+                output_utilities
+            )
+            ordered_output.chunk_index = None
+            offset += no_of_tensors_in_mini_batch
+
+    logging.info("[INFO] Called %d tensors of %d chunks in %.2f s" % (
+        no_of_tensors, len(chunks), time() - variant_call_start_time
+    ))
+
+
+def Run(args):
+    utils.setup_environment()
+    param.NUM_THREADS = args.threads
+
+    basedir = os.path.dirname(__file__)
+    EVCBin = basedir + "/../clair.py ExtractVariantCandidates"
+    CTBin = basedir + "/../clair.py CreateTensor"
+
+    pypyBin = executable_command_string_from(args.pypy, exit_on_not_found=True)
+    samtoolsBin = executable_command_string_from(args.samtools, exit_on_not_found=True)
+    chkpnt_fn = model_file_path_from(args.chkpnt_fn, exit_on_not_found=True)
+    bam_fn = file_path_from(args.bam_fn, exit_on_not_found=True)
+    ref_fn = file_path_from(args.ref_fn, exit_on_not_found=True)
+    fai_fn = file_path_from(args.ref_fn + ".fai", exit_on_not_found=True)
+    bed_fn = file_path_from(args.bed_fn)
+    stop_consider_left_edge = command_option_from(args.stop_consider_left_edge, 'stop_consider_left_edge')
+
+    chunks = list((balanced_chunks_from if args.balanced_chunks else chunks_from)(
+        fai_fn=fai_fn,
+        bam_fn=bam_fn,
+        tree=bed_tree_from(bed_file_path=bed_fn),
+        is_bed_file_provided=bed_fn is not None,
+        is_include_all_contigs=args.includingAllContigs,
+        region_chunk_size=args.refChunkSize,
+    ))
+    if len(chunks) == 0:
+        sys.exit("[ERROR] No region to call variants in")
+
+    chunk_command_options = []
+    for contig_name, region_start, region_end, is_region_in_bed in chunks:
+        # consecutive chunks share their boundary, [ctgStart, ctgEnd] is 1-based and inclusive, so that a chunk is
+        # called from the position after its start, and a candidate at a boundary is output once
+        region_command_options = [
+            CommandOption('bam_fn', bam_fn),
+            CommandOption('ref_fn', ref_fn),
+            CommandOption('ctgName', contig_name),
+            CommandOption('ctgStart', region_start + 1),
+            CommandOption('ctgEnd', region_end),
+            CommandOption('samtools', samtoolsBin),
+        ]
+        chunk_command_options.append((
+            [pypyBin, EVCBin] + region_command_options + [
+                CommandOption('bed_fn', bed_fn) if is_region_in_bed else None,
+                CommandOption('threshold', args.threshold),
+                CommandOption('minCoverage', int(args.minCoverage)),
+            ],
+            [pypyBin, CTBin] + region_command_options + [
+                stop_consider_left_edge,
+                CommandOption('dcov', args.dcov),
+            ],
+        ))
+
+    output_config = OutputConfig(
+        is_show_reference=False,
+        is_debug=args.debug,
+        is_haploid_precision_mode_enabled=args.haploid_precision,
+        is_haploid_sensitive_mode_enabled=args.haploid_sensitive,
+        is_output_for_ensemble=False,
+        quality_score_for_pass=args.qual,
+    )
+
+    # written to a temporary file first, a VCF at call_fn is then always complete
+    temporary_call_fn = args.call_fn + ".tmp"
+    try:
+        with open(temporary_call_fn, "w") as output_file:
+            ordered_output = OrderedOutput(output_file)
+            output_utilities = output_utilties_from(
+                sample_name=args.sampleName,
+                is_debug=args.debug,
+                is_output_for_ensemble=False,
+                is_using_pysam_for_all_indel_bases_output=args.pysam_for_all_indel_bases,
+                reference_file_path=ref_fn,
+                bam_file_path=bam_fn,
+                output_file_path=None,
+                output_function=ordered_output.output,
+            )
+
+            m = model_from(chkpnt_fn)
+            call_variants_in_genome(
+                args, m, chunks, chunk_command_options, output_config, output_utilities, ordered_output
+            )
+            output_utilities.close_opened_files()
+        os.replace(temporary_call_fn, args.call_fn)
+    finally:
+        if os.path.exists(temporary_call_fn):
+            os.remove(temporary_call_fn)
+
+
+def main():
+    parser = ArgumentParser(
+        description="Call variants in the whole genome with a single model, fed by concurrent candidate and tensor producers")
+
+    parser.add_argument('--chkpnt_fn', type=str, default=None,
+                        help="Input a model, or a model exported by export_inference_model (.pb or .npz), REQUIRED")
+
+    parser.add_argument('--ref_fn', type=str, default="ref.fa",
+                        help="Reference fasta file input, default: %(default)s")
+
+    parser.add_argument('--bam_fn', type=str, default="bam.bam",
+                        help="BAM file input, default: %(default)s")
+
+    parser.add_argument('--bed_fn', type=str, default=None,
+                        help="Call variant only in these regions, optional, default: whole genome")
+
+    parser.add_argument('--call_fn', type=str, default=None,
+                        help="Output a single VCF of the whole genome, sorted in the contig order of the reference, REQUIRED")
+
+    parser.add_argument('--producers', type=int, default=4,
+                        help="Number of concurrent ExtractVariantCandidates | CreateTensor pipelines, default: %(default)s")
+
+    parser.add_argument('--threads', type=int, default=4,
+                        help="Number of threads for inference, default: %(default)s")
+
+    parser.add_argument('--batch_size', type=int, default=param.predictBatchSize,
+                        help="Number of tensors predicted in a batch, gathered from all producers, default: %(default)s")
+
+    parser.add_argument('--batch_timeout', type=float, default=0.05,
+                        help="Seconds to wait for more tensors before predicting a partial batch, default: %(default)s")
+
+    parser.add_argument('--refChunkSize', type=int, default=10000000,
+                        help="Divide the genome into chunks of this size, default: %(default)s")
+
+    parser.add_argument('--balanced_chunks', action='store_true',
+                        help="Divide the genome into chunks of about equal work estimated from the BAM index (.bai or .csi), optional")
+
+    parser.add_argument('--includingAllContigs', action='store_true',
+                        help="Call variants on all contigs, default: chr{1..22,X,Y,M,MT} and {1..22,X,Y,MT}")
+
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Minimum allele frequence of the 1st non-reference allele for a site to be considered as a condidate site, default: %(default)f")
+
+    parser.add_argument('--minCoverage', type=float, default=4,
+                        help="Minimum coverage required to call a variant, default: %(default)d")
+
+    parser.add_argument('--qual', type=int, default=None,
+                        help="If set, variant with equal or higher quality will be marked PASS, or LowQual otherwise, optional")
+
+    parser.add_argument('--sampleName', type=str, default="SAMPLE",
+                        help="Define the sample name to be shown in the VCF file")
+
+    parser.add_argument('--stop_consider_left_edge', action='store_true',
+                        help="If not set, would consider left edge only. That is, count the left-most base-pairs of a read for coverage even if the starting position of a read is after the starting position of a tensor")
+
+    parser.add_argument('--dcov', type=int, default=250,
+                        help="Cap depth per position at %(default)d")
+
+    parser.add_argument('--samtools', type=str, default="samtools",
+                        help="Path to the 'samtools', default: %(default)s")
+
+    parser.add_argument('--pypy', type=str, default="pypy3",
+                        help="Path to the 'pypy', default: %(default)s")
+
+    parser.add_argument('--debug', action='store_true',
+                        help="Debug mode, optional")
+
+    parser.add_argument('--pysam_for_all_indel_bases', action='store_true',
+                        help="Always using pysam for outputting indel bases, optional")
+
+    parser.add_argument('--haploid_precision', action='store_true',
+                        help="call haploid instead of diploid (output homo-variant only)")
+
+    parser.add_argument('--haploid_sensitive', action='store_true',
+                        help="call haploid instead of diploid (output non-multi-variant only)")
+
+    args = parser.parse_args()
+
+    if len(sys.argv[1:]) == 0:
+        parser.print_help()
+        sys.exit(1)
+
+    if args.chkpnt_fn is None or args.call_fn is None:
+        sys.exit("[ERROR] --chkpnt_fn and --call_fn must be specified.")
+
+    Run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,7 +12,6 @@ from collections import namedtuple, defaultdict
 
 
 import clair.utils as utils
-from clair.model import Clair
 from clair.task.gt21 import (
     GT21_Type, gt21_enum_from_label, gt21_enum_from,
     HOMO_SNP_GT21, HOMO_SNP_LABELS,
@@ -20,7 +19,8 @@ from clair.task.gt21 import (
 )
 from clair.task.genotype import Genotype, genotype_string_from, genotype_enum_from, genotype_enum_for_task
 from clair.task.variant_length import VariantLength
-from shared.utils import IUPAC_base_to_num_dict as BASE2NUM, IUPAC_base_to_ACGT_base_dict as BASE2ACGT, BASIC_BASES
+from shared.chunk_progress import ChunkProgress, CALL_VARIANT_STAGE
+from shared.utils import is_frozen_model_file, IUPAC_base_to_num_dict as BASE2NUM, IUPAC_base_to_ACGT_base_dict as BASE2ACGT, BASIC_BASES
 import shared.param as param
 
 
@@ -210,9 +210,14 @@ def Run(args):
         call_variants_with_probabilities_input(args, output_config, output_utilities)
         return
 
-    m = Clair()
-    m.init()
-    m.restore_parameters(os.path.abspath(args.chkpnt_fn))
+    if args.activation_only and (is_frozen_model_file(args.chkpnt_fn) or args.server_socket is not None):
+        sys.exit("[ERROR] --activation_only requires a model checkpoint, not an exported model or an inference server")
+
+    if args.server_socket is not None:
+        from clair.serve import InferenceClient
+        m = InferenceClient(args.server_socket)
+    else:
+        m = model_from(args.chkpnt_fn)
 
     if args.activation_only:
         log_activation(args, m)
@@ -220,6 +225,24 @@ def Run(args):
         call_variants(args, m, output_config, output_utilities)
 
 
+def model_from(chkpnt_fn):
+    model_load_start_time = time()
+    # models are imported here, calling with numpy weights (.npz) does not import tensorflow at all
+    if chkpnt_fn.endswith(".npz"):
+        from clair.model_numpy import NumpyClair
+        m = NumpyClair(os.path.abspath(chkpnt_fn))
+    elif is_frozen_model_file(chkpnt_fn):
+        from clair.model import FrozenClair
+        m = FrozenClair(os.path.abspath(chkpnt_fn))
+    else:
+        from clair.model import Clair
+        m = Clair()
+        m.init()
+        m.restore_parameters(os.path.abspath(chkpnt_fn))
+    logging.info("[INFO] Model loaded in %.2f s" % (time() - model_load_start_time))
+    return m
+
+
 def output_utilties_from(
     sample_name,
     is_debug,
@@ -228,12 +251,19 @@ def output_utilties_from(
     bam_file_path,
     reference_file_path,
     output_file_path,
+    output_function=None,
 ):
+    """
+    output_function: if set, output rows are passed to it instead of written to output_file_path
+    """
     fasta_file = pysam.FastaFile(filename=reference_file_path) if reference_file_path else None
     sam_file = pysam.AlignmentFile(bam_file_path, mode="rb")
-    output_file = open(output_file_path, "w")
+    output_file = open(output_file_path, "w") if output_function is None else None
 
     def output(string_value):
+        if output_function is not None:
+            output_function(string_value)
+            return
         print(string_value, file=output_file)
 
     def print_debug_message(
@@ -299,7 +329,8 @@ def output_utilties_from(
     def close_opened_files():
         sam_file.close()
         fasta_file.close()
-        output_file.close()
+        if output_file is not None:
+            output_file.close()
 
     def output_header():
         if is_output_for_ensemble:
@@ -1312,7 +1343,14 @@ def call_variants_with_probabilities_input(args, output_config, output_utilities
 def call_variants(args, m, output_config, output_utilities):
     output_utilities.output_header()
 
-    tensor_generator = utils.tensor_generator_from(args.tensor_fn, param.predictBatchSize)
+    batch_size_tuner = utils.BatchSizeTuner(initial_batch_size=args.batch_size) if args.adaptive_batch_size else None
+    tensor_generator = utils.tensor_generator_from(
+        args.tensor_fn,
+        args.batch_size,
+        batch_timeout=args.batch_timeout,
+        batch_size_tuner=batch_size_tuner,
+    )
+    chunk_progress = ChunkProgress(args.progress_prefix) if args.progress_prefix is not None else None
     logging.info("Calling variants ...")
     variant_call_start_time = time()
 
@@ -1330,6 +1368,8 @@ def call_variants(args, m, output_config, output_utilities):
 
     while True:
         thread_pool = []
+        iteration_start_time = time()
+        no_of_tensors_to_predict = 0
 
         if len(mini_batches_to_output) > 0:
             mini_batch = mini_batches_to_output.pop(0)
@@ -1340,6 +1380,7 @@ def call_variants(args, m, output_config, output_utilities):
         if len(mini_batches_to_predict) > 0:
             mini_batch = mini_batches_to_predict.pop(0)
             X, _ = mini_batch
+            no_of_tensors_to_predict = len(X)
             thread_pool.append(Thread(target=m.predict, kwargs={"batchX":X}))
             mini_batches_to_output.append(mini_batch)
 
@@ -1351,10 +1392,17 @@ def call_variants(args, m, output_config, output_utilities):
         for t in thread_pool:
             t.join()
 
+        # the pipeline moves one batch per iteration, so the iteration time reflects the overall throughput
+        if batch_size_tuner is not None and no_of_tensors_to_predict > 0:
+            batch_size_tuner.record(no_of_tensors_to_predict, time() - iteration_start_time)
+
         is_finish_loaded_all_mini_batches = len(mini_batches_loaded) == 0
         while len(mini_batches_loaded) > 0:
             mini_batch = mini_batches_loaded.pop(0)
             mini_batches_to_predict.append(mini_batch)
+            if chunk_progress is not None:
+                _, non_tensor_infos = mini_batch
+                chunk_progress.report(CALL_VARIANT_STAGE, int(non_tensor_infos[-1][1]))
 
         is_nothing_to_predict_and_output = (
             len(thread_pool) <= 0 and len(mini_batches_to_predict) <= 0 and len(mini_batches_to_output) <= 0
@@ -1362,6 +1410,8 @@ def call_variants(args, m, output_config, output_utilities):
         if is_finish_loaded_all_mini_batches and is_nothing_to_predict_and_output:
             break
 
+    if batch_size_tuner is not None:
+        batch_size_tuner.log_summary()
     logging.info("Total time elapsed: %.2f s" % (time() - variant_call_start_time))
 
     output_utilities.close_opened_files()
@@ -1374,7 +1424,22 @@ def main():
                         help="Tensor input, use PIPE for standard input")
 
     parser.add_argument('--chkpnt_fn', type=str, default=None,
-                        help="Input a checkpoint for testing")
+                        help="Input a checkpoint for testing, or a model exported by export_inference_model (.pb or .npz)")
+
+    parser.add_argument('--batch_size', type=int, default=param.predictBatchSize,
+                        help="Number of tensors predicted in a batch, the initial batch size if --adaptive_batch_size is set, default: %(default)s")
+
+    parser.add_argument('--adaptive_batch_size', action='store_true',
+                        help="Tune the batch size at runtime for the highest throughput (tensors/s), optional")
+
+    parser.add_argument('--batch_timeout', type=float, default=None,
+                        help="Predict a partial batch once its first tensor has waited for this many seconds, optional")
+
+    parser.add_argument('--progress_prefix', type=str, default=None,
+                        help="Report progress and memory use to the parallel runner through files with this prefix, optional")
+
+    parser.add_argument('--server_socket', type=str, default=None,
+                        help="Predict using an inference server started by serve at this UNIX socket instead of loading --chkpnt_fn, optional")
 
     parser.add_argument('--call_fn', type=str, default=None,
                         help="Output variant predictions")
@@ -0,0 +1,268 @@
+import logging
+import blosc
+import numpy as np
+from time import time
+from queue import Queue, Full
+from threading import Thread, Event
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+import shared.param as param
+from clair.task.main import OUTPUT_LABEL_SIZE
+from clair.utils import is_raw_counts, subtract_reference_channel, is_label_indexes, one_hot_labels_into
+
+
+def shuffled_rows_from(blocks, buffer_blocks, batch_size, random_state):
+    """
+    Yield (x_rows, y_rows) of batch_size rows sampled across a buffer of decompressed blocks, instead of from a few
+    contiguous blocks. Rows left over from a buffer are carried into the next one.
+    Memory is bounded by about buffer_blocks blocks + batch_size rows.
+    """
+    x_buffer, y_buffer = [], []
+    no_of_buffer_rows = 0
+    is_blocks_exhausted = False
+    while not is_blocks_exhausted:
+        while len(x_buffer) < buffer_blocks + 1 or no_of_buffer_rows < batch_size:
+            try:
+                x_rows, y_rows = next(blocks)
+            except StopIteration:
+                is_blocks_exhausted = True
+                break
+            x_buffer.append(x_rows)
+            y_buffer.append(y_rows)
+            no_of_buffer_rows += len(x_rows)
+        if no_of_buffer_rows == 0:
+            return
+
+        x_rows, y_rows = np.concatenate(x_buffer), np.concatenate(y_buffer)
+        shuffled_indexes = random_state.permutation(no_of_buffer_rows)
+        no_of_batches = (
+            int(np.ceil(float(no_of_buffer_rows) / batch_size)) if is_blocks_exhausted else
+            no_of_buffer_rows // batch_size
+        )
+        for i in range(no_of_batches):
+            indexes = shuffled_indexes[i * batch_size:(i + 1) * batch_size]
+            yield x_rows[indexes], y_rows[indexes]
+
+        left_over_indexes = shuffled_indexes[no_of_batches * batch_size:]
+        x_buffer, y_buffer = [x_rows[left_over_indexes]], [y_rows[left_over_indexes]]
+        no_of_buffer_rows = len(left_over_indexes)
+
+
+class BatchBuffers(object):
+    """
+    A ring of output buffers reused for the mini-batches, allocated once with the shape and type of the first rows
+    Raw counts are converted to float32 and their reference channel subtracted as they are copied in,
+    label indexes are expanded to one-hot labels
+    """
+
+    def __init__(self, no_of_slots, max_batch_size):
+        self.no_of_slots = no_of_slots
+        self.max_batch_size = max_batch_size
+        self.slots = []
+        self.next_slot_index = 0
+
+    def next_slot(self, x_rows, y_rows):
+        if len(self.slots) < self.no_of_slots:
+            x_dtype = np.float32 if is_raw_counts(x_rows) else x_rows.dtype
+            y_shape, y_dtype = ((OUTPUT_LABEL_SIZE,), np.float32) if is_label_indexes(y_rows) else \
+                (y_rows.shape[1:], y_rows.dtype)
+            self.slots.append((
+                np.empty((self.max_batch_size,) + x_rows.shape[1:], dtype=x_dtype),
+                np.empty((self.max_batch_size,) + y_shape, dtype=y_dtype),
+            ))
+        slot = self.slots[self.next_slot_index]
+        self.next_slot_index = (self.next_slot_index + 1) % self.no_of_slots
+        return slot
+
+    def batches_from(self, rows, batch_size):
+        """
+        Yield (x_batch, y_batch) of batch_size rows copied from (x_rows, y_rows), the last one could be shorter
+        """
+        x_batch, y_batch = None, None
+        no_of_rows = 0
+        for x_rows, y_rows in rows:
+            start = 0
+            while start < len(x_rows):
+                if x_batch is None:
+                    x_batch, y_batch = self.next_slot(x_rows, y_rows)
+                count = min(batch_size - no_of_rows, len(x_rows) - start)
+                x_batch[no_of_rows:no_of_rows + count] = x_rows[start:start + count]
+                if is_raw_counts(x_rows):
+                    subtract_reference_channel(x_batch[no_of_rows:no_of_rows + count])
+                if is_label_indexes(y_rows):
+                    one_hot_labels_into(y_rows[start:start + count], y_batch[no_of_rows:no_of_rows + count])
+                else:
+                    y_batch[no_of_rows:no_of_rows + count] = y_rows[start:start + count]
+                no_of_rows += count
+                start += count
+                if no_of_rows == batch_size:
+                    yield x_batch[:no_of_rows], y_batch[:no_of_rows]
+                    x_batch, y_batch = None, None
+                    no_of_rows = 0
+        if no_of_rows > 0:
+            yield x_batch[:no_of_rows], y_batch[:no_of_rows]
+
+
+class MiniBatchLoader(object):
+    """
+    Mini-batches of an epoch prepared ahead by a background thread, the training examples first and then the
+    validation examples, in the form returned by utils.new_mini_batch.
+    Blocks are decompressed by workers threads (blosc releases the GIL), in order and at most 2 * workers blocks
+    ahead, and copied into a ring of reusable output buffers. Up to prefetch mini-batches are kept ready.
+    With shuffle_buffer_blocks > 0, the training blocks are read in a random order and training examples are shuffled
+    across that many decompressed blocks, reproducible with the same seed and epoch.
+    """
+
+    def __init__(
+        self,
+        dataset_info,
+        no_of_training_examples,
+        workers=1,
+        prefetch=2,
+        shuffle_buffer_blocks=0,
+        seed=None,
+        training_batch_size=param.trainBatchSize,
+        validation_batch_size=param.predictBatchSize,
+    ):
+        self.x_array_compressed = dataset_info.x_array_compressed
+        self.y_array_compressed = dataset_info.y_array_compressed
+        self.no_of_training_examples = no_of_training_examples
+        self.workers = workers
+        self.prefetch = max(1, prefetch)
+        self.shuffle_buffer_blocks = shuffle_buffer_blocks
+        self.seed = seed
+        self.training_batch_size = training_batch_size
+        self.validation_batch_size = validation_batch_size
+        self.wait_time = 0.0
+
+        # held at once: prefetch in the queue, one being filled, one looked ahead, two taken by the training loop
+        self.batch_buffers = BatchBuffers(self.prefetch + 4, max(training_batch_size, validation_batch_size))
+        self.pool = None
+        if workers > 1:
+            blosc.set_releasegil(True)
+            self.pool = ThreadPool(workers)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def pop_wait_time(self):
+        """
+        Returns:
+            seconds the training loop waited for mini-batches since the last call
+        """
+        wait_time, self.wait_time = self.wait_time, 0.0
+        return wait_time
+
+    def decompressed_block(self, block_index):
+        return (
+            blosc.unpack_array(self.x_array_compressed[block_index]),
+            blosc.unpack_array(self.y_array_compressed[block_index]),
+        )
+
+    def decompressed_blocks_from(self, block_indexes):
+        if self.pool is None:
+            for block_index in block_indexes:
+                yield self.decompressed_block(block_index)
+            return
+
+        pending = deque()
+        for block_index in block_indexes:
+            pending.append(self.pool.apply_async(self.decompressed_block, (block_index,)))
+            if len(pending) > 2 * self.workers:
+                yield pending.popleft().get()
+        while len(pending) > 0:
+            yield pending.popleft().get()
+
+    def mini_batches_from(self, block_indexes, epoch):
+        """
+        Yield (x_batch, y_batch) of the training examples and then of the validation examples
+        """
+        no_of_training_blosc_blocks = min(int(self.no_of_training_examples / param.bloscBlockSize), len(block_indexes))
+        random_state = None
+        if self.shuffle_buffer_blocks > 0:
+            random_state = np.random.RandomState(None if self.seed is None else (self.seed + epoch) % (2 ** 32))
+            block_indexes = list(random_state.permutation(block_indexes[:no_of_training_blosc_blocks])) + \
+                list(block_indexes[no_of_training_blosc_blocks:])
+
+        blocks = self.decompressed_blocks_from(block_indexes)
+        boundary_block_rows = []
+
+        def training_rows():
+            no_of_rows = 0
+            for x_rows, y_rows in blocks:
+                no_of_rows_needed = self.no_of_training_examples - no_of_rows
+                if len(x_rows) >= no_of_rows_needed:
+                    if no_of_rows_needed > 0:
+                        yield x_rows[:no_of_rows_needed], y_rows[:no_of_rows_needed]
+                    boundary_block_rows.append((x_rows[no_of_rows_needed:], y_rows[no_of_rows_needed:]))
+                    return
+                yield x_rows, y_rows
+                no_of_rows += len(x_rows)
+
+        def validation_rows():
+            for rows in boundary_block_rows:
+                yield rows
+            for rows in blocks:
+                yield rows
+
+        rows = training_rows()
+        if random_state is not None:
+            rows = shuffled_rows_from(rows, self.shuffle_buffer_blocks, self.training_batch_size, random_state)
+        for batch in self.batch_buffers.batches_from(rows, self.training_batch_size):
+            yield batch
+        for batch in self.batch_buffers.batches_from(validation_rows(), self.validation_batch_size):
+            yield batch
+
+    def produce(self, block_indexes, epoch, queue, stop_event):
+        def put(item):
+            while not stop_event.is_set():
+                try:
+                    queue.put(item, timeout=1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        try:
+            # one mini-batch ahead, so that the last one is known
+            last_batch = None
+            for batch in self.mini_batches_from(block_indexes, epoch):
+                if last_batch is not None and not put(last_batch + (0, 0)):
+                    return
+                last_batch = batch
+            if last_batch is not None:
+                put(last_batch + (-1, -1))
+            put(None)
+        except Exception as e:
+            logging.exception("[ERROR] Failed to load mini-batches")
+            put(e)
+
+    def batches(self, block_indexes, epoch):
+        """
+        Yield (x_batch, y_batch, next_first_blosc_block_data_index, next_blosc_start_index) of an epoch as
+        utils.new_mini_batch does, the indexes are negative only for the last mini-batch
+        A mini-batch is a view of a reusable buffer, valid until two more mini-batches are taken
+        """
+        queue = Queue(maxsize=self.prefetch)
+        stop_event = Event()
+        thread = Thread(target=self.produce, args=(block_indexes, epoch, queue, stop_event))
+        thread.daemon = True
+        thread.start()
+
+        try:
+            while True:
+                start_time = time()
+                item = queue.get()
+                self.wait_time += time() - start_time
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop_event.set()
+            thread.join()
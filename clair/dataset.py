@@ -0,0 +1,139 @@
+import mmap
+import struct
+from bisect import bisect_right
+import numpy as np
+
+# header: magic, version, block size, no. of rows, no. of blocks, offset of the block index
+MAGIC = b"CLAIRDS\x00"
+VERSION = 1
+HEADER_FORMAT = "<8sIIQQQ"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# block index row: offset and length of the X, Y and position blobs, and no. of rows in the block
+BLOCK_INDEX_COLUMNS = 7
+X_BLOB, Y_BLOB, POSITION_BLOB = 0, 2, 4
+NO_OF_ROWS_COLUMN = 6
+
+
+def is_dataset_file(file_path):
+    with open(file_path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class DatasetWriter(object):
+    """
+    Write a dataset file block by block:
+        header | X, Y and position blobs of each block | block index (uint64, no. of blocks x 7) | contig names
+    The header is rewritten with the counts and the index offset on close, the contig names of structured positions
+    are joined by "\n" after the block index (none for files written before positions were structured)
+    """
+
+    def __init__(self, file_path, block_size):
+        self.file = open(file_path, "wb")
+        self.block_size = block_size
+        self.block_index = []
+        self.total = 0
+        self.write_header(0)
+
+    def write_header(self, index_offset):
+        self.file.seek(0)
+        self.file.write(struct.pack(
+            HEADER_FORMAT, MAGIC, VERSION, self.block_size, self.total, len(self.block_index), index_offset
+        ))
+
+    def add_block(self, x_blob, y_blob, position_blob, no_of_rows):
+        row = []
+        for blob in [x_blob, y_blob, position_blob]:
+            row.extend([self.file.tell(), len(blob)])
+            self.file.write(blob)
+        row.append(no_of_rows)
+        self.block_index.append(row)
+        self.total += no_of_rows
+
+    def close(self, contig_names=None):
+        index_offset = self.file.tell()
+        self.file.write(np.array(self.block_index, dtype=np.uint64).reshape(-1, BLOCK_INDEX_COLUMNS).tobytes())
+        if contig_names is not None:
+            self.file.write("\n".join(contig_names).encode())
+        self.write_header(index_offset)
+        self.file.close()
+        return self.total
+
+
+class CompressedBlocks(object):
+    """
+    A read-only sequence of compressed blobs in one or more memory-mapped dataset files, standing in for the
+    list of blosc blobs of a pickled bin. A blob is read, from the page cache, only when indexed.
+    """
+
+    def __init__(self, parts):
+        # parts: [(mmap, offsets, lengths)]
+        self.parts = parts
+        self.part_starts = list(np.cumsum([0] + [len(offsets) for _, offsets, _ in parts]))
+
+    def __len__(self):
+        return self.part_starts[-1]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("block index out of range")
+        part_index = bisect_right(self.part_starts, index) - 1
+        buffer, offsets, lengths = self.parts[part_index]
+        i = index - self.part_starts[part_index]
+        offset = int(offsets[i])
+        return buffer[offset:offset + int(lengths[i])]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __add__(self, other):
+        if isinstance(other, CompressedBlocks):
+            return CompressedBlocks(self.parts + other.parts)
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+
+class Dataset(object):
+    """
+    A dataset file opened with mmap, only the header and the block index are read on open
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        with open(file_path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.block_size, self.total, no_of_blocks, index_offset = \
+            struct.unpack_from(HEADER_FORMAT, self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("%s is not a dataset file" % (file_path))
+        if version != VERSION:
+            raise ValueError("unsupported dataset version %d of %s" % (version, file_path))
+
+        self.block_index = np.frombuffer(
+            self.buffer, dtype=np.uint64, count=no_of_blocks * BLOCK_INDEX_COLUMNS, offset=index_offset
+        ).reshape(no_of_blocks, BLOCK_INDEX_COLUMNS)
+
+        contig_names = self.buffer[index_offset + self.block_index.nbytes:].decode()
+        self.contig_names = contig_names.split("\n") if len(contig_names) > 0 else None
+
+    def blocks_of(self, column):
+        return CompressedBlocks([(self.buffer, self.block_index[:, column], self.block_index[:, column + 1])])
+
+    @property
+    def no_of_rows_in_blocks(self):
+        return self.block_index[:, NO_OF_ROWS_COLUMN]
+
+    def compressed_arrays(self):
+        """
+        Returns:
+            (total, X, Y, pos, contig names) in the same form as the pickled objects of a bin
+        """
+        return (
+            self.total, self.blocks_of(X_BLOB), self.blocks_of(Y_BLOB), self.blocks_of(POSITION_BLOB), self.contig_names
+        )
@@ -35,17 +35,13 @@ def new_confusion_matrix_with_dimension(size):
     return np.zeros((size, size), dtype=np.int)
 
 
-def evaluate_model(m, dataset_info):
-    dataset_size = dataset_info.dataset_size
-    x_array_compressed = dataset_info.x_array_compressed
-    y_array_compressed = dataset_info.y_array_compressed
-
-    logging.info("[INFO] Testing on the training and validation dataset ...")
-    prediction_start_time = time()
-    prediction_batch_size = param.predictBatchSize
-
+def mini_batches_from(dataset_info, batch_size):
+    """
+    Yield (x_batch, y_batch) of all examples in the dataset, in the order stored
+    """
     no_of_training_examples = (
-        dataset_info.no_of_training_examples_from_train_binary or int(dataset_size * param.trainingDatasetPercentage)
+        dataset_info.no_of_training_examples_from_train_binary or
+        int(dataset_info.dataset_size * param.trainingDatasetPercentage)
     )
     no_of_blosc_blocks = utils.no_of_blosc_blocks_from(
         dataset_info=dataset_info,
@@ -56,33 +52,50 @@ def evaluate_model(m, dataset_info):
     blosc_index = 0
     first_blosc_block_data_index = 0
 
-    confusion_matrix_gt21 = new_confusion_matrix_with_dimension(GT21.output_label_count)
-    confusion_matrix_genotype = new_confusion_matrix_with_dimension(GENOTYPE.output_label_count)
-    confusion_matrix_indel_length_1 = new_confusion_matrix_with_dimension(VARIANT_LENGTH_1.output_label_count)
-    confusion_matrix_indel_length_2 = new_confusion_matrix_with_dimension(VARIANT_LENGTH_2.output_label_count)
-
-    all_gt21_count = top_1_count = top_2_count = 0
-
     while True:
         x_batch, next_x_first_blosc_block_data_index, next_x_blosc_index = utils.decompress_array(
-            array=x_array_compressed,
+            array=dataset_info.x_array_compressed,
             blosc_start_index=blosc_index,
             first_blosc_block_data_index=first_blosc_block_data_index,
-            no_of_data_rows_to_retrieve=prediction_batch_size,
+            no_of_data_rows_to_retrieve=batch_size,
             no_of_blosc_blocks=no_of_blosc_blocks,
+            rows_from=utils.input_tensors_from,
         )
         y_batch, _next_y_first_blosc_block_data_index, _next_y_blosc_index = utils.decompress_array(
-            array=y_array_compressed,
+            array=dataset_info.y_array_compressed,
             blosc_start_index=blosc_index,
             first_blosc_block_data_index=first_blosc_block_data_index,
-            no_of_data_rows_to_retrieve=prediction_batch_size,
+            no_of_data_rows_to_retrieve=batch_size,
             no_of_blosc_blocks=no_of_blosc_blocks,
+            rows_from=utils.output_labels_from,
         )
-        minibatch_gt21_prediction, minibatch_genotype_prediction, \
-            minibatch_indel_length_prediction_1, minibatch_indel_length_prediction_2 = m.predict(x_batch)
+        yield x_batch, y_batch
 
         blosc_index = next_x_blosc_index
         first_blosc_block_data_index = next_x_first_blosc_block_data_index
+        if not (next_x_first_blosc_block_data_index >= 0 and next_x_blosc_index >= 0):
+            break
+
+
+def evaluate_model(m, dataset_info, mini_batches=None):
+    """
+    Evaluate on mini_batches of (x_batch, y_batch), all examples in the dataset if not given
+    """
+    logging.info("[INFO] Testing on the training and validation dataset ...")
+    prediction_start_time = time()
+    if mini_batches is None:
+        mini_batches = mini_batches_from(dataset_info, param.predictBatchSize)
+
+    confusion_matrix_gt21 = new_confusion_matrix_with_dimension(GT21.output_label_count)
+    confusion_matrix_genotype = new_confusion_matrix_with_dimension(GENOTYPE.output_label_count)
+    confusion_matrix_indel_length_1 = new_confusion_matrix_with_dimension(VARIANT_LENGTH_1.output_label_count)
+    confusion_matrix_indel_length_2 = new_confusion_matrix_with_dimension(VARIANT_LENGTH_2.output_label_count)
+
+    all_gt21_count = top_1_count = top_2_count = 0
+
+    for x_batch, y_batch in mini_batches:
+        minibatch_gt21_prediction, minibatch_genotype_prediction, \
+            minibatch_indel_length_prediction_1, minibatch_indel_length_prediction_2 = m.predict(x_batch)
 
         # update confusion matrix for gt21 prediction
         for gt21_prediction, gt21_label in zip(
@@ -128,10 +141,10 @@ def evaluate_model(m, dataset_info):
             confusion_matrix_indel_length_1[true_label_index_1][predict_label_index_1] += 1
             confusion_matrix_indel_length_2[true_label_index_2][predict_label_index_2] += 1
 
-        if not (next_x_first_blosc_block_data_index >= 0 and next_x_blosc_index >= 0):
-            break
-
     logging.info("[INFO] Prediciton time elapsed: %.2f s" % (time() - prediction_start_time))
+    if all_gt21_count == 0:
+        logging.info("[INFO] No example to evaluate")
+        return
 
     print("[INFO] Evaluation on gt21:")
     print("[INFO] all/top1/top2/top1p/top2p: %d/%d/%d/%.2f/%.2f" %
@@ -185,6 +198,15 @@ def main():
     parser.add_argument('--chkpnt_fn', type=str, default=None,
                         help="Input a checkpoint for testing, REQUIRED")
 
+    parser.add_argument('--ctgName', type=str, default=None,
+                        help="Evaluate only the examples on this sequence, found by the region index of the bin, optional")
+
+    parser.add_argument('--ctgStart', type=int, default=None,
+                        help="The 1-based starting position of the examples evaluated with --ctgName, optional")
+
+    parser.add_argument('--ctgEnd', type=int, default=None,
+                        help="The 1-based inclusive ending position of the examples evaluated with --ctgName, optional")
+
     args = parser.parse_args()
 
     if len(sys.argv[1:]) == 0:
@@ -210,8 +232,22 @@ def main():
     model_initalization_file_path = args.chkpnt_fn
     m.restore_parameters(abspath(model_initalization_file_path))
 
+    mini_batches = None
+    if args.ctgName is not None:
+        try:
+            region_index = utils.region_index_from(
+                dataset_info, None if dataset_info.is_separated_train_and_validation_binary else args.bin_fn
+            )
+        except ValueError as e:
+            sys.exit("[ERROR] Failed to build the region index: %s" % (e))
+        mini_batches = (
+            (x_batch, y_batch) for x_batch, y_batch, _ in utils.examples_in_region_from(
+                dataset_info, region_index, args.ctgName, args.ctgStart, args.ctgEnd
+            )
+        )
+
     # start evaluation
-    evaluate_model(m, dataset_info)
+    evaluate_model(m, dataset_info, mini_batches)
 
 
 if __name__ == "__main__":
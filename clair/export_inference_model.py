@@ -0,0 +1,132 @@
+import os
+import sys
+import logging
+import numpy as np
+from time import time
+from argparse import ArgumentParser
+
+import clair.utils as utils
+import shared.param as param
+
+logging.basicConfig(format='%(message)s', level=logging.INFO)
+
+
+def export_frozen_graph(chkpnt_fn, pb_fn):
+    from clair.model import Clair
+
+    m = Clair()
+    m.init()
+    m.restore_parameters(os.path.abspath(chkpnt_fn))
+    m.export_inference_graph(pb_fn)
+    m.close()
+
+
+def export_numpy_weights(chkpnt_fn, npz_fn):
+    import tensorflow as tf
+    from clair.model_numpy import model_weights_from
+
+    reader = tf.train.load_checkpoint(os.path.abspath(chkpnt_fn))
+    variables = dict(
+        (name, reader.get_tensor(name)) for name in reader.get_variable_to_shape_map() if "Adam" not in name
+    )
+    weights = model_weights_from(variables)
+
+    # uncompressed, the arrays could then be memory mapped
+    with open(npz_fn, "wb") as f:
+        np.savez(f, **weights)
+
+
+def verification_batch_from(tensor_fn, batch_size):
+    if tensor_fn is not None:
+        for X, _ in utils.tensor_generator_from(tensor_fn, batch_size):
+            return X
+        sys.exit("[ERROR] No tensor found in %s" % (tensor_fn))
+
+    # random allele counts, differenced against the reference channel as in utils.tensor_generator_from
+    np.random.seed(param.RANDOM_SEED)
+    X = np.random.poisson(lam=10, size=(batch_size, 2 * param.flankingBaseNum + 1, param.matrixRow, param.matrixNum))
+    X = X.astype(np.float32)
+    for i in range(1, param.matrixNum):
+        X[:, :, :, i] -= X[:, :, :, 0]
+    return X
+
+
+def verify_numpy_weights(chkpnt_fn, npz_fn, tensor_fn, tolerance):
+    from clair.model import Clair
+    from clair.model_numpy import NumpyClair
+
+    X = verification_batch_from(tensor_fn, param.predictBatchSize)
+
+    m = Clair()
+    m.init()
+    m.restore_parameters(os.path.abspath(chkpnt_fn))
+    expected_prediction = m.predict(X)
+    m.close()
+
+    prediction = NumpyClair(npz_fn).predict(X)
+
+    max_differences = [
+        float(np.max(np.abs(expected - actual))) for expected, actual in zip(expected_prediction, prediction)
+    ]
+    logging.info("[INFO] Maximum absolute differences against the checkpoint on %d tensors: %s" % (
+        X.shape[0], " ".join("%.3e" % (difference) for difference in max_differences)
+    ))
+    if max(max_differences) > tolerance:
+        sys.exit("[ERROR] Exported weights differ from the checkpoint by more than %g" % (tolerance))
+
+
+def Run(args):
+    utils.setup_environment()
+
+    # the exported graph has to use the CPU compatible LSTM cells, which load the weights trained by Cudnn LSTM too
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+    if args.pb_fn is not None:
+        export_start_time = time()
+        export_frozen_graph(args.chkpnt_fn, args.pb_fn)
+        logging.info("[INFO] Frozen inference graph exported to %s in %.2f s" % (args.pb_fn, time() - export_start_time))
+
+    if args.npz_fn is not None:
+        export_start_time = time()
+        export_numpy_weights(args.chkpnt_fn, args.npz_fn)
+        logging.info("[INFO] Numpy weights exported to %s in %.2f s" % (args.npz_fn, time() - export_start_time))
+
+        if args.verify:
+            verify_numpy_weights(args.chkpnt_fn, args.npz_fn, args.tensor_fn, args.tolerance)
+
+
+def main():
+    parser = ArgumentParser(description="Export a trained model for inference only use in call_var")
+
+    parser.add_argument('--chkpnt_fn', type=str, default=None,
+                        help="Input a checkpoint to be exported, REQUIRED")
+
+    parser.add_argument('--pb_fn', type=str, default=None,
+                        help="Output a constant-folded inference graph (.pb), use it as --chkpnt_fn in call_var and callVarBam")
+
+    parser.add_argument('--npz_fn', type=str, default=None,
+                        help="Output the weights (.npz) for the numpy implementation of 2BiLSTM, which calls variants without tensorflow")
+
+    parser.add_argument('--verify', action='store_true',
+                        help="Compare the predictions using the exported weights (.npz) against the checkpoint")
+
+    parser.add_argument('--tensor_fn', type=str, default=None,
+                        help="Tensors for verification, use random tensors if not set")
+
+    parser.add_argument('--tolerance', type=float, default=1e-4,
+                        help="Maximum absolute difference in probabilities allowed in verification, default: %(default)g")
+
+    args = parser.parse_args()
+
+    if len(sys.argv[1:]) == 0:
+        parser.print_help()
+        sys.exit(1)
+
+    if args.chkpnt_fn is None:
+        sys.exit("[ERROR] --chkpnt_fn must be specified.")
+
+    Run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,7 @@ from threading import Thread
 
 import clair.evaluate as evaluate
 from clair.model import Clair
+from clair.data_loader import MiniBatchLoader
 import clair.utils as utils
 from clair.task.main import GT21, GENOTYPE, VARIANT_LENGTH_1, VARIANT_LENGTH_2
 import shared.param as param
@@ -97,7 +98,7 @@ def shuffle_first_n_items(array, n):
     return np.append(a1, a2)
 
 
-def train_model(m, training_config):
+def train_model(m, training_config, data_workers=1, prefetch=2):
     learning_rate = param.min_lr
     l2_regularization_lambda = training_config.l2_regularization_lambda
     output_file_path_prefix = training_config.output_file_path_prefix
@@ -142,22 +143,12 @@ def train_model(m, training_config):
 
     global_step = 0
 
-    mini_batches_loaded = []
-
-    def load_mini_batch(data_index, blosc_index, first_blosc_block_data_index, tensor_block_index_list):
-        mini_batch = utils.new_mini_batch(
-            data_index=data_index,
-            blosc_start_index=blosc_index,
-            first_blosc_block_data_index=first_blosc_block_data_index,
-            no_of_training_examples=no_of_training_examples,
-            no_of_blosc_blocks=no_of_blosc_blocks,
-            dataset_info=dataset_info,
-            tensor_block_index_list=tensor_block_index_list,
-        )
-        _, _, next_first_blosc_block_data_index, next_blosc_start_index = mini_batch
-        if next_first_blosc_block_data_index < 0 or next_blosc_start_index < 0:
-            return
-        mini_batches_loaded.append(mini_batch)
+    mini_batch_loader = MiniBatchLoader(
+        dataset_info=dataset_info,
+        no_of_training_examples=no_of_training_examples,
+        workers=data_workers,
+        prefetch=prefetch,
+    )
 
     while epoch_count <= param.lr_finder_max_epoch:
         # init variables for process one epoch
@@ -165,9 +156,8 @@ def train_model(m, training_config):
         training_loss_sum = 0
         validation_loss_sum = 0
         data_index = 0
-        blosc_index = 0
-        first_blosc_block_data_index = 0
         x_batch, y_batch = None, None
+        mini_batches = mini_batch_loader.batches(tensor_block_index_list, epoch_count)
 
         gt21_loss_sum = 0
         genotype_loss_sum = 0
@@ -185,15 +175,13 @@ def train_model(m, training_config):
                 thread_pool.append(Thread(target=m.train, args=(x_batch, y_batch)))
             elif is_validation:
                 thread_pool.append(Thread(target=m.validate, args=(x_batch, y_batch)))
-            thread_pool.append(
-                Thread(
-                    target=load_mini_batch,
-                    args=(data_index, blosc_index, first_blosc_block_data_index, tensor_block_index_list)
-                )
-            )
 
             for t in thread_pool:
                 t.start()
+            # the last mini-batch is left out as before
+            mini_batch = next(mini_batches, None)
+            if mini_batch is not None and (mini_batch[2] < 0 or mini_batch[3] < 0):
+                mini_batch = None
             for t in thread_pool:
                 t.join()
 
@@ -217,16 +205,12 @@ def train_model(m, training_config):
             if is_with_batch_data:
                 data_index += np.shape(x_batch)[0]
 
-            have_next_mini_batch = len(mini_batches_loaded) > 0
-            is_processed_a_mini_batch = len(thread_pool) > 0
-
-            if have_next_mini_batch:
-                x_batch, y_batch, first_blosc_block_data_index, blosc_index = mini_batches_loaded.pop(0)
-                learning_rate, global_step, _max_learning_rate = m.clr(
-                    global_step, step_size, param.max_lr, "tri"
-                )
-            if not have_next_mini_batch and not is_processed_a_mini_batch:
+            if mini_batch is None:
                 break
+            x_batch, y_batch, _, _ = mini_batch
+            learning_rate, global_step, _max_learning_rate = m.clr(
+                global_step, step_size, param.max_lr, "tri"
+            )
 
         logging.info(
             " ".join([str(epoch_count), "Training loss:", str(training_loss_sum/no_of_training_examples)])
@@ -242,7 +226,9 @@ def train_model(m, training_config):
             ])
         )
 
-        logging.info("[INFO] Epoch time elapsed: %.2f s" % (time() - epoch_start_time))
+        logging.info("[INFO] Epoch time elapsed: %.2f s, %.2f s waiting for data" % (
+            time() - epoch_start_time, mini_batch_loader.pop_wait_time()
+        ))
         training_losses.append((training_loss_sum, epoch_count))
         validation_losses.append((validation_loss_sum, epoch_count))
 
@@ -263,6 +249,7 @@ def train_model(m, training_config):
             [str(x) for x in np.append(tensor_block_index_list[:5], tensor_block_index_list[-5:])]
         ))
 
+    mini_batch_loader.close()
     logging.info("[INFO] Training time elapsed: %.2f s" % (time() - training_start_time))
     return training_losses, validation_losses
 
@@ -307,6 +294,11 @@ if __name__ == "__main__":
     parser.add_argument('--olog_dir', type=str, default=None,
                         help="Directory for tensorboard log outputs, optional")
 
+    parser.add_argument('--data_workers', type=int, default=1,
+                        help="Number of threads decompressing mini-batches, default: %(default)s")
+    parser.add_argument('--prefetch', type=int, default=2,
+                        help="Number of mini-batches loaded ahead of training, default: %(default)s")
+
     args = parser.parse_args()
 
     if len(sys.argv[1:]) == 0:
@@ -334,7 +326,9 @@ if __name__ == "__main__":
         summary_writer=m.get_summary_file_writer(args.olog_dir) if args.olog_dir != None else None,
     )
 
-    _training_losses, validation_losses = train_model(m, training_config)
+    _training_losses, validation_losses = train_model(
+        m, training_config, data_workers=args.data_workers, prefetch=args.prefetch
+    )
 
     # show the parameter set with the smallest validation loss
     validation_losses.sort()
@@ -20,6 +20,15 @@ from clair.task.main import GT21, GENOTYPE, VARIANT_LENGTH_1, VARIANT_LENGTH_2
 import clair.selu as selu
 import shared.param as param
 
+# Tensor names of the inference-only graph exported by Clair.inference_graph_def()
+INFERENCE_INPUT_TENSOR_NAME = "X_placeholder:0"
+INFERENCE_OUTPUT_TENSOR_NAMES = [
+    "Prediction/Y_base_change:0",
+    "Prediction/Y_genotype:0",
+    "Prediction/Y_indel_length_1:0",
+    "Prediction/Y_indel_length_2:0",
+]
+
 
 class Clair(object):
     """
@@ -1019,6 +1028,48 @@ class Clair(object):
         """
         self.saver.restore(self.session, file_name)
 
+    def inference_graph_def(self):
+        """
+        Return a pruned and constant-folded GraphDef containing the inference path only,
+        i.e. from X_placeholder to the four softmax outputs, with the current weights frozen as constants.
+        The phase placeholder and the dropout rate placeholders are replaced by their prediction values,
+        so the exported graph takes only the input tensor in the feed dict.
+        """
+        output_node_names = [y.op.name for y in self.Y]
+        frozen_graph_def = tf.graph_util.convert_variables_to_constants(
+            self.session, self.graph.as_graph_def(), output_node_names
+        )
+
+        inference_graph = tf.Graph()
+        with inference_graph.as_default():
+            input_map = {
+                self.phase_placeholder.name: tf.constant(False, dtype=tf.bool, name="phase_constant")
+            }
+            for placeholder, value in self.get_structure_dict(phase='predict').items():
+                input_map[placeholder.name] = tf.constant(
+                    value, dtype=self.float_type, name=placeholder.op.name + "_constant"
+                )
+            tf.import_graph_def(frozen_graph_def, input_map=input_map, name="")
+        inference_graph_def = tf.graph_util.extract_sub_graph(inference_graph.as_graph_def(), output_node_names)
+
+        try:
+            from tensorflow.tools.graph_transforms import TransformGraph
+        except ImportError:
+            return inference_graph_def
+        return TransformGraph(
+            inference_graph_def,
+            [self.X_placeholder.op.name],
+            output_node_names,
+            ["fold_constants(ignore_errors=true)", "sort_by_execution_order"]
+        )
+
+    def export_inference_graph(self, file_name):
+        """
+        Write the inference-only graph (see inference_graph_def) to the specific file (file_name)
+        """
+        with tf.gfile.GFile(file_name, "wb") as f:
+            f.write(self.inference_graph_def().SerializeToString())
+
     def get_variable_objects(self, regular_expression):
         """
         Get all variable objects from the graph matching the regular expression
@@ -1152,6 +1203,56 @@ class Clair(object):
         self.session.close()
 
 
+class FrozenClair(object):
+    """
+    Inference-only model loaded from a graph exported by Clair.export_inference_graph()
+    No training graph, variables or checkpoint restoration is involved, and only the input tensor is fed on predict.
+    Arguments:
+        file_name: the path of the exported graph (.pb)
+    """
+
+    def __init__(self, file_name):
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(file_name, "rb") as f:
+            graph_def.ParseFromString(f.read())
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name="")
+        self.X_placeholder = self.graph.get_tensor_by_name(INFERENCE_INPUT_TENSOR_NAME)
+        self.Y = [self.graph.get_tensor_by_name(tensor_name) for tensor_name in INFERENCE_OUTPUT_TENSOR_NAMES]
+
+        print("[INFO] Using %d CPU threads" % (param.NUM_THREADS))
+        self.netcfg = tf.ConfigProto()
+        self.netcfg.intra_op_parallelism_threads = param.NUM_THREADS
+        self.netcfg.inter_op_parallelism_threads = param.NUM_THREADS
+
+        self.session = tf.Session(
+            graph=self.graph,
+            config=self.netcfg
+        )
+
+    def predict(self, batchX):
+        """
+        Predict using model in batch with input tensor batchX
+        Returns:
+            prediction: predictions from the model in batch
+        """
+        prediction = self.session.run(self.Y, feed_dict={self.X_placeholder: batchX})
+        self.prediction = prediction
+
+        return prediction
+
+    def close(self):
+        """
+        Closes the current tf session
+        """
+        self.session.close()
+
+    def __del__(self):
+        self.session.close()
+
+
 class FunctionCallConsumer(multiprocessing.Process):
     """
     A class implementing thread safe consumer which does a function call for each task
@@ -0,0 +1,246 @@
+import re
+import struct
+import zipfile
+import numpy as np
+
+import shared.param as param
+
+# SELU constants, identical to those in clair/selu.py
+SELU_ALPHA = 1.6732632423543772848170429916717
+SELU_SCALE = 1.0507009873554804934193349852946
+
+# Regular expressions for locating the weights of the 2BiLSTM structure in a checkpoint,
+# the names are the same for checkpoints trained with CudnnLSTM and CudnnCompatibleLSTMCell
+LSTM_KERNEL_NAME_PATTERN = r"^%s/.*/%s/cudnn_compatible_lstm_cell/kernel$"
+LSTM_BIAS_NAME_PATTERN = r"^%s/.*/%s/cudnn_compatible_lstm_cell/bias$"
+L3_KERNEL_NAME_PATTERN = r"^L3/Unit_(\d+)/kernel$"
+L3_BIAS_NAME_PATTERN = r"^L3/Unit_(\d+)/bias$"
+
+LSTM_LAYER_NAMES = ["LSTM1", "LSTM2"]
+DENSE_LAYER_NAMES = ["L4", "L5_1", "L5_2", "L5_3", "L5_4"]
+OUTPUT_LAYER_NAMES = [
+    "Prediction/Y_base_change_logits",
+    "Prediction/Y_genotype_logits",
+    "Prediction/Y_indel_length_logits_1",
+    "Prediction/Y_indel_length_logits_2",
+]
+
+
+def selu(x):
+    return SELU_SCALE * np.where(x >= 0.0, x, SELU_ALPHA * np.expm1(np.minimum(x, 0.0)))
+
+
+def sigmoid(x):
+    return 0.5 * (np.tanh(0.5 * x) + 1.0)
+
+
+def softmax(x):
+    e = np.exp(x - np.max(x, axis=1, keepdims=True))
+    return e / np.sum(e, axis=1, keepdims=True)
+
+
+def arrays_from_npz(file_name):
+    """
+    Read the arrays of an .npz file, memory mapped read-only if stored uncompressed (as by np.savez)
+    The pages of memory mapped arrays are shared by all processes mapping the same file
+    Returns:
+        dict, array name -> numpy array
+    """
+    arrays = {}
+    with zipfile.ZipFile(file_name) as zip_file, open(file_name, "rb") as f:
+        for info in zip_file.infolist():
+            name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            if info.compress_type != zipfile.ZIP_STORED:
+                with zip_file.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+
+            # the member data follows its local file header, of which the name and extra field lengths are at offset 26
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack("<HH", f.read(4))
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if dtype.hasobject:
+                raise ValueError("array %s in %s holds python objects" % (name, file_name))
+            arrays[name] = np.memmap(
+                file_name, dtype=dtype, mode="r", offset=f.tell(), shape=shape, order="F" if fortran_order else "C"
+            )
+    return arrays
+
+
+def fused_lstm_weights_from(weights, layer_name):
+    """
+    The input kernels and biases of both directions of an LSTM layer concatenated, to project the whole sequence with
+    a single matmul, and the recurrent kernels of both directions
+    """
+    fw_kernel = weights["%s/fw/kernel" % (layer_name)]
+    bw_kernel = weights["%s/bw/kernel" % (layer_name)]
+    input_size = fw_kernel.shape[0] - fw_kernel.shape[1] // 4
+    return {
+        "%s/input_kernel" % (layer_name): np.concatenate([fw_kernel[:input_size], bw_kernel[:input_size]], axis=1),
+        "%s/input_bias" % (layer_name): np.concatenate([
+            weights["%s/fw/bias" % (layer_name)], weights["%s/bw/bias" % (layer_name)]
+        ]),
+        "%s/fw/recurrent_kernel" % (layer_name): fw_kernel[input_size:],
+        "%s/bw/recurrent_kernel" % (layer_name): bw_kernel[input_size:],
+    }
+
+
+def model_weights_from(variables):
+    """
+    Pick the weights used in inference out of the checkpoint variables of the 2BiLSTM structure
+    Arguments:
+        variables: dict, variable name -> numpy array, e.g. from tf.train.load_checkpoint()
+    Returns:
+        dict of float32 numpy arrays, with the keys expected by NumpyClair
+    """
+    def variable_matching(pattern):
+        names = [name for name in variables if re.match(pattern, name) and "Adam" not in name]
+        if len(names) != 1:
+            raise KeyError("expect one variable matching %s, found %d" % (pattern, len(names)))
+        return variables[names[0]]
+
+    weights = {}
+    for layer_name in LSTM_LAYER_NAMES:
+        for direction in ["fw", "bw"]:
+            weights["%s/%s/kernel" % (layer_name, direction)] = variable_matching(
+                LSTM_KERNEL_NAME_PATTERN % (layer_name, direction)
+            )
+            weights["%s/%s/bias" % (layer_name, direction)] = variable_matching(
+                LSTM_BIAS_NAME_PATTERN % (layer_name, direction)
+            )
+
+    # stack the slice dense kernels into (slices, inputs, units), in order of the slice index
+    for key, pattern in [("L3/kernel", L3_KERNEL_NAME_PATTERN), ("L3/bias", L3_BIAS_NAME_PATTERN)]:
+        unit_variables = {}
+        for name in variables:
+            matched = re.match(pattern, name)
+            if matched is not None and "Adam" not in name:
+                unit_variables[int(matched.group(1))] = variables[name]
+        if len(unit_variables) == 0:
+            raise KeyError("no variable matching %s" % (pattern))
+        weights[key] = np.stack([unit_variables[i] for i in range(len(unit_variables))])
+
+    for layer_name in DENSE_LAYER_NAMES + OUTPUT_LAYER_NAMES:
+        weights[layer_name + "/kernel"] = variable_matching("^%s/kernel$" % (layer_name))
+        weights[layer_name + "/bias"] = variable_matching("^%s/bias$" % (layer_name))
+
+    # fused when exported, the fused weights are then memory mapped as well instead of built in every process
+    for layer_name in LSTM_LAYER_NAMES:
+        weights.update(fused_lstm_weights_from(weights, layer_name))
+
+    return dict((key, np.ascontiguousarray(value, dtype=np.float32)) for key, value in weights.items())
+
+
+class NumpyClair(object):
+    """
+    Inference-only implementation of the 2BiLSTM structure of Clair using numpy, no tensorflow is imported
+    Weights are exported from a checkpoint by clair/export_inference_model.py (--npz_fn), and memory mapped,
+    concurrent processes using the same file share a single copy of the weights in memory
+    The fused LSTM weights are built in each process for files exported without them
+    Arguments:
+        file_name: the path of the exported weights (.npz)
+    """
+
+    def __init__(self, file_name):
+        self.weights = dict(
+            (key, np.asarray(value, dtype=np.float32)) for key, value in arrays_from_npz(file_name).items()
+        )
+
+        self.input_shape = (2 * param.flankingBaseNum + 1, param.matrixRow, param.matrixNum)
+
+        self.lstm_layers = []
+        for layer_name in LSTM_LAYER_NAMES:
+            if "%s/input_kernel" % (layer_name) not in self.weights:
+                self.weights.update(
+                    (key, np.ascontiguousarray(value))
+                    for key, value in fused_lstm_weights_from(self.weights, layer_name).items()
+                )
+            fw_recurrent_kernel = self.weights["%s/fw/recurrent_kernel" % (layer_name)]
+            self.lstm_layers.append(dict(
+                num_units=fw_recurrent_kernel.shape[0],
+                input_kernel=self.weights["%s/input_kernel" % (layer_name)],
+                input_bias=self.weights["%s/input_bias" % (layer_name)],
+                fw_recurrent_kernel=fw_recurrent_kernel,
+                bw_recurrent_kernel=self.weights["%s/bw/recurrent_kernel" % (layer_name)],
+            ))
+
+    @staticmethod
+    def lstm_direction(projected_input, recurrent_kernel, reverse=False):
+        """
+        Run one direction of a CudnnCompatibleLSTMCell (gate order i, c, f, o, forget bias 0) over time-major inputs
+        projected_input: (time-steps, batch, 4 * num_units), inputs already multiplied by the input kernel plus bias
+        """
+        time_steps, batch_size, _ = projected_input.shape
+        num_units = recurrent_kernel.shape[0]
+        h = np.zeros((batch_size, num_units), dtype=np.float32)
+        c = np.zeros((batch_size, num_units), dtype=np.float32)
+        outputs = np.empty((time_steps, batch_size, num_units), dtype=np.float32)
+
+        for t in (range(time_steps - 1, -1, -1) if reverse else range(time_steps)):
+            gates = projected_input[t] + np.dot(h, recurrent_kernel)
+            i = sigmoid(gates[:, :num_units])
+            c_candidate = np.tanh(gates[:, num_units:2 * num_units])
+            f = sigmoid(gates[:, 2 * num_units:3 * num_units])
+            o = sigmoid(gates[:, 3 * num_units:])
+            c = f * c + i * c_candidate
+            h = o * np.tanh(c)
+            outputs[t] = h
+
+        return outputs
+
+    def bidirectional_lstm(self, inputs, layer):
+        """
+        inputs: (time-steps, batch, input size)
+        Returns:
+            (time-steps, batch, 2 * num_units), forward outputs followed by backward outputs
+        """
+        time_steps, batch_size, input_size = inputs.shape
+        num_units = layer["num_units"]
+        projected = np.dot(inputs.reshape(-1, input_size), layer["input_kernel"]) + layer["input_bias"]
+        projected = projected.reshape(time_steps, batch_size, 8 * num_units)
+
+        fw_outputs = NumpyClair.lstm_direction(projected[:, :, :4 * num_units], layer["fw_recurrent_kernel"])
+        bw_outputs = NumpyClair.lstm_direction(projected[:, :, 4 * num_units:], layer["bw_recurrent_kernel"], reverse=True)
+        return np.concatenate([fw_outputs, bw_outputs], axis=2)
+
+    def dense(self, inputs, layer_name):
+        return np.dot(inputs, self.weights[layer_name + "/kernel"]) + self.weights[layer_name + "/bias"]
+
+    def predict(self, batchX):
+        """
+        Predict using model in batch with input tensor batchX
+        Returns:
+            prediction: predictions from the model in batch
+        """
+        batchX = np.asarray(batchX, dtype=np.float32)
+        batch_size = batchX.shape[0]
+
+        # (# of bases, batch_size, (# of ACGTacgt) * (# of channels))
+        X = batchX.reshape(batch_size, self.input_shape[0], self.input_shape[1] * self.input_shape[2])
+        X = np.ascontiguousarray(X.transpose(1, 0, 2))
+
+        LSTM = X
+        for layer in self.lstm_layers:
+            LSTM = self.bidirectional_lstm(LSTM, layer)
+
+        # slice dense layer, one dense unit per LSTM output dimension, connecting all positions
+        # LSTM: (# of bases, batch, slices), kernel: (slices, # of bases, units) -> (batch, units, slices)
+        L3 = np.matmul(LSTM.transpose(2, 1, 0), self.weights["L3/kernel"]) + self.weights["L3/bias"][:, np.newaxis, :]
+        L3 = selu(L3).transpose(1, 2, 0).reshape(batch_size, -1)
+
+        L4 = selu(self.dense(L3, "L4"))
+        prediction = [
+            softmax(selu(self.dense(selu(self.dense(L4, dense_layer_name)), output_layer_name)))
+            for dense_layer_name, output_layer_name in zip(DENSE_LAYER_NAMES[1:], OUTPUT_LAYER_NAMES)
+        ]
+        self.prediction = prediction
+
+        return prediction
+
+    def close(self):
+        pass
@@ -0,0 +1,180 @@
+import mmap
+import struct
+import blosc
+import numpy as np
+
+# position of an example: id in the contig table of its bin, 1-based position, and the no. of examples at the same
+# chr:pos before it (duplicates kept with --allow_duplicate_chr_pos)
+POSITION_DTYPE = np.dtype([("contig", "<u4"), ("position", "<i4"), ("duplicate", "u1")])
+
+# region index sidecar: header | contig names joined by "\n" | entries sorted by contig and position
+# header: magic, version, no. of entries, no. of bytes of the contig names
+REGION_INDEX_MAGIC = b"CLAIRRI\x00"
+REGION_INDEX_VERSION = 1
+REGION_INDEX_HEADER_FORMAT = "<8sIQQ"
+REGION_INDEX_HEADER_SIZE = struct.calcsize(REGION_INDEX_HEADER_FORMAT)
+REGION_INDEX_ENTRY_DTYPE = np.dtype([("contig", "<u4"), ("position", "<i4"), ("block", "<u4"), ("row", "<u4")])
+REGION_INDEX_SUFFIX = ".regions"
+
+
+def region_index_file_path_from(binary_file_path):
+    return binary_file_path + REGION_INDEX_SUFFIX
+
+
+class ContigTable(object):
+    """
+    Contig names of a bin, an id is the index of a name in the order first seen
+    """
+
+    def __init__(self, names=None):
+        self.names = []
+        self.ids = {}
+        for name in names or []:
+            self.id_of(name)
+
+    def id_of(self, name):
+        contig_id = self.ids.get(name)
+        if contig_id is None:
+            contig_id = len(self.names)
+            self.ids[name] = contig_id
+            self.names.append(name)
+        return contig_id
+
+
+def is_structured_positions(position_rows):
+    return position_rows.dtype == POSITION_DTYPE
+
+
+def position_rows_from(positions, contig_table):
+    """
+    Structured position rows of [("chr:pos", duplicate)], contigs added to contig_table
+    """
+    rows = np.empty(len(positions), dtype=POSITION_DTYPE)
+    for i, (key, duplicate) in enumerate(positions):
+        contig_name, position = key.rsplit(":", 1)
+        rows[i] = (contig_table.id_of(contig_name), int(position), duplicate)
+    return rows
+
+
+def remapped_position_rows_from(position_rows, contig_names, contig_table):
+    """
+    Position rows of a bin with contig_names, in the ids of contig_table
+    "chr:pos" strings of bins written before positions were structured are converted, with no duplicate counts
+    """
+    if not is_structured_positions(position_rows):
+        return position_rows_from([(key, 0) for key in position_rows], contig_table)
+
+    contig_ids = np.array([contig_table.id_of(name) for name in contig_names], dtype=np.uint32)
+    rows = position_rows.copy()
+    rows["contig"] = contig_ids[position_rows["contig"]]
+    return rows
+
+
+def position_strings_from(position_rows, contig_names):
+    """
+    "chr:pos" of each position row
+    """
+    if not is_structured_positions(position_rows):
+        return position_rows
+    return [
+        "%s:%d" % (contig_names[contig_id], position)
+        for contig_id, position in zip(position_rows["contig"], position_rows["position"])
+    ]
+
+
+class RegionIndex(object):
+    """
+    (block, row) of each example, sorted by contig and position, so that the examples in a region are found
+    without decompressing the blocks
+    """
+
+    def __init__(self, contig_names, entries):
+        self.contig_names = contig_names
+        self.contig_table = ContigTable(contig_names)
+        self.entries = entries
+
+    def entries_in(self, contig_name, start=None, end=None):
+        """
+        Entries of the examples at contig_name:start-end, 1-based and inclusive, the whole contig if not bounded
+        """
+        contig_id = self.contig_table.ids.get(contig_name)
+        if contig_id is None:
+            return self.entries[:0]
+
+        contigs = self.entries["contig"]
+        contig_start = np.searchsorted(contigs, contig_id)
+        contig_end = np.searchsorted(contigs, contig_id, side="right")
+        positions = self.entries["position"][contig_start:contig_end]
+        first = 0 if start is None else np.searchsorted(positions, start)
+        last = len(positions) if end is None else np.searchsorted(positions, end, side="right")
+        return self.entries[contig_start + first:contig_start + last]
+
+    def block_rows_in(self, contig_name, start=None, end=None):
+        """
+        Returns:
+            [(block index, row indexes in the block)] of the examples in the region, in the order of the blocks
+        """
+        entries = self.entries_in(contig_name, start, end)
+        entries = entries[np.lexsort((entries["row"], entries["block"]))]
+        block_starts = np.flatnonzero(np.diff(entries["block"].astype(np.int64), prepend=-1))
+        block_ends = list(block_starts[1:]) + [len(entries)]
+        return [
+            (int(entries["block"][block_start]), entries["row"][block_start:block_end].astype(np.intp))
+            for block_start, block_end in zip(block_starts, block_ends)
+        ]
+
+    def write(self, file_path):
+        contig_names = "\n".join(self.contig_names).encode()
+        with open(file_path, "wb") as f:
+            f.write(struct.pack(
+                REGION_INDEX_HEADER_FORMAT,
+                REGION_INDEX_MAGIC, REGION_INDEX_VERSION, len(self.entries), len(contig_names)
+            ))
+            f.write(contig_names)
+            f.write(np.ascontiguousarray(self.entries, dtype=REGION_INDEX_ENTRY_DTYPE).tobytes())
+
+
+def read_region_index(file_path):
+    """
+    A region index sidecar opened with mmap, entries are paged in only when searched
+    """
+    with open(file_path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, no_of_entries, no_of_contig_name_bytes = \
+        struct.unpack_from(REGION_INDEX_HEADER_FORMAT, buffer, 0)
+    if magic != REGION_INDEX_MAGIC:
+        raise ValueError("%s is not a region index file" % (file_path))
+    if version != REGION_INDEX_VERSION:
+        raise ValueError("unsupported region index version %d of %s" % (version, file_path))
+
+    contig_names_end = REGION_INDEX_HEADER_SIZE + no_of_contig_name_bytes
+    contig_names = buffer[REGION_INDEX_HEADER_SIZE:contig_names_end].decode()
+    entries = np.frombuffer(buffer, dtype=REGION_INDEX_ENTRY_DTYPE, count=no_of_entries, offset=contig_names_end)
+    return RegionIndex(contig_names.split("\n") if no_of_contig_name_bytes > 0 else [], entries)
+
+
+def region_index_from_position_blocks(position_blocks, contig_names=None):
+    """
+    Build the region index of a bin from its compressed position blocks, only the position blocks are decompressed
+    """
+    contig_table = ContigTable()
+    block_entries = []
+    for block_index, position_blob in enumerate(position_blocks):
+        position_rows = blosc.unpack_array(position_blob)
+        if is_structured_positions(position_rows) and contig_names is None:
+            raise ValueError("contig names are required for structured positions")
+        position_rows = remapped_position_rows_from(position_rows, contig_names, contig_table)
+
+        entries = np.empty(len(position_rows), dtype=REGION_INDEX_ENTRY_DTYPE)
+        entries["contig"] = position_rows["contig"]
+        entries["position"] = position_rows["position"]
+        entries["block"] = block_index
+        entries["row"] = np.arange(len(position_rows))
+        block_entries.append(entries)
+
+    if len(block_entries) == 0:
+        return RegionIndex([], np.empty(0, dtype=REGION_INDEX_ENTRY_DTYPE))
+    entries = np.concatenate(block_entries)
+    entries = entries[np.lexsort((entries["row"], entries["block"], entries["position"], entries["contig"]))]
+    return RegionIndex(contig_table.names, entries)
@@ -0,0 +1,251 @@
+import re
+import heapq
+from os.path import isfile
+from glob import glob
+from sys import stderr, argv, exit
+from argparse import ArgumentParser
+
+from clair.post_processing.overlap_variant import variant_from, is_two_variants_overlap, variant_to_output_for
+
+# e.g. prefix.chr1_10000001_20000000.vcf, the chunk VCFs named by callVarBamParallel
+CHUNK_FILE_NAME_PATTERN = re.compile(r"_(\d+)_(\d+)\.vcf$")
+
+
+def contig_order_from(fai_fn):
+    contig_order = {}
+    with open(fai_fn) as f:
+        for row in f:
+            contig_order.setdefault(row.split("\t")[0], len(contig_order))
+    return contig_order
+
+
+class ChunkVcfReader(object):
+    """
+    Read the header and variant rows of a position-sorted chunk VCF, one row ahead
+    """
+
+    def __init__(self, file_path, contig_order):
+        self.file_path = file_path
+        self.contig_order = contig_order
+        self.file = open(file_path)
+        self.header_rows = []
+        self.row = None
+        self.key = None
+
+        for row in self.file:
+            if row[0] != "#":
+                self.set_row(row)
+                break
+            self.header_rows.append(row.rstrip("\n"))
+        if self.row is None:
+            self.close()
+
+    def set_row(self, row):
+        columns = row.split("\t", 2)
+        contig_name = columns[0]
+        if contig_name not in self.contig_order:
+            self.contig_order[contig_name] = len(self.contig_order)
+        self.row = row.rstrip("\n")
+        self.key = (self.contig_order[contig_name], int(columns[1]))
+
+    def next(self):
+        """
+        Returns:
+            False if no more rows
+        """
+        for row in self.file:
+            if row[0] == "#" or row.strip() == "":
+                continue
+            self.set_row(row)
+            return True
+        self.close()
+        self.row, self.key = None, None
+        return False
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+def chunk_start_key_from(file_path, contig_order):
+    """
+    The (contig order, start position) a chunk VCF cannot have rows before, parsed from its file name
+    """
+    match = CHUNK_FILE_NAME_PATTERN.search(file_path)
+    if match is None:
+        return (-1, 0)
+    # both the prefix and the contig name could contain dots
+    prefix_and_contig_name = file_path[:match.start()]
+    for index, character in enumerate(prefix_and_contig_name):
+        if character == "." and prefix_and_contig_name[index + 1:] in contig_order:
+            return (contig_order[prefix_and_contig_name[index + 1:]], int(match.group(1)))
+    return (-1, 0)
+
+
+def merged_rows_from(vcf_fns, contig_order, header_rows):
+    """
+    Yield the variant rows of all chunk VCFs in (contig order, position) order
+    A chunk VCF is opened only once the merge reaches its start, the header of the first opened one is appended to header_rows
+    """
+    pending_chunks = sorted(
+        (chunk_start_key_from(vcf_fn, contig_order), index, vcf_fn) for index, vcf_fn in enumerate(vcf_fns)
+    )
+    pending_chunks.reverse()
+    heap = []
+
+    while len(heap) > 0 or len(pending_chunks) > 0:
+        while len(pending_chunks) > 0 and (len(heap) == 0 or pending_chunks[-1][0] <= heap[0][0]):
+            _, index, vcf_fn = pending_chunks.pop()
+            reader = ChunkVcfReader(vcf_fn, contig_order)
+            if len(header_rows) == 0:
+                header_rows.extend(reader.header_rows)
+            if reader.row is not None:
+                heapq.heappush(heap, (reader.key, index, reader))
+
+        if len(heap) == 0:
+            continue
+        key, index, reader = heap[0]
+        yield reader.row
+        if reader.next():
+            if reader.key < key:
+                exit("[ERROR] %s is not sorted by position" % (reader.file_path))
+            heapq.heapreplace(heap, (reader.key, index, reader))
+        else:
+            heapq.heappop(heap)
+
+
+def quality_score_from(row):
+    try:
+        return float(row.split("\t", 6)[5])
+    except (IndexError, ValueError):
+        return 0.0
+
+
+def deduplicated_rows_from(rows):
+    """
+    Keep the row with the highest quality among rows at the same position, e.g. called by two chunks at their boundary
+    """
+    last_row, last_key = None, None
+    for row in rows:
+        columns = row.split("\t", 2)
+        key = (columns[0], columns[1])
+        if key == last_key:
+            if quality_score_from(row) > quality_score_from(last_row):
+                last_row = row
+            continue
+        if last_row is not None:
+            yield last_row
+        last_row, last_key = row, key
+    if last_row is not None:
+        yield last_row
+
+
+def overlap_filtered_rows_from(rows):
+    """
+    The filter of overlap_variant in a single pass, keeping the original rows
+    """
+    last_row, last_variant = None, None
+    for row in rows:
+        variant = variant_from(row)
+        if last_variant is not None and is_two_variants_overlap(last_variant, variant):
+            if variant_to_output_for(last_variant, variant) != last_variant:
+                last_row, last_variant = row, variant
+            continue
+        if last_row is not None:
+            yield last_row
+        last_row, last_variant = row, variant
+    if last_row is not None:
+        yield last_row
+
+
+def output_function_from(output_fn):
+    """
+    Returns:
+        (output function, close function), BGZF compressed if output_fn ends with .gz
+    """
+    if output_fn.endswith(".gz"):
+        from pysam import BGZFile
+        output_file = BGZFile(output_fn, "wb")
+        return lambda row: output_file.write((row + "\n").encode()), output_file.close
+
+    output_file = open(output_fn, "w")
+    return lambda row: output_file.write(row + "\n"), output_file.close
+
+
+def Run(args):
+    if not isfile(args.ref_fn + ".fai"):
+        exit("[ERROR] file %s not found" % (args.ref_fn + ".fai"))
+    contig_order = contig_order_from(args.ref_fn + ".fai")
+
+    vcf_fns = list(args.vcf_fns or [])
+    if args.input_prefix is not None:
+        vcf_fns.extend(
+            vcf_fn for vcf_fn in glob(args.input_prefix + ".*.vcf") if CHUNK_FILE_NAME_PATTERN.search(vcf_fn)
+        )
+    vcf_fns = [vcf_fn for vcf_fn in vcf_fns if vcf_fn != args.output_fn]
+    if len(vcf_fns) == 0:
+        exit("[ERROR] No chunk VCF found")
+
+    header_rows = []
+    rows = merged_rows_from(vcf_fns, contig_order, header_rows)
+    rows = deduplicated_rows_from(rows)
+    if args.overlap_filter:
+        rows = overlap_filtered_rows_from(rows)
+
+    output, close = output_function_from(args.output_fn)
+    no_of_rows = 0
+    is_header_output = False
+    for row in rows:
+        if not is_header_output:
+            for header_row in header_rows:
+                output(header_row)
+            is_header_output = True
+        output(row)
+        no_of_rows += 1
+    if not is_header_output:
+        for header_row in header_rows:
+            output(header_row)
+    close()
+
+    if args.output_fn.endswith(".gz") and not args.no_index:
+        from pysam import tabix_index
+        tabix_index(args.output_fn, preset="vcf", force=True)
+
+    print("[INFO] Merged %d variants from %d chunk VCFs into %s" % (no_of_rows, len(vcf_fns), args.output_fn), file=stderr)
+
+
+def main():
+    parser = ArgumentParser(description="Merge the chunk VCFs of callVarBamParallel into one sorted VCF")
+
+    parser.add_argument('--ref_fn', type=str, default="ref.fa",
+                        help="Reference fasta file input, contigs are sorted as in its .fai, default: %(default)s")
+
+    parser.add_argument('--input_prefix', type=str, default=None,
+                        help="Merge all chunk VCFs with this prefix, i.e. the --output_prefix of callVarBamParallel")
+
+    parser.add_argument('--vcf_fns', type=str, nargs='+', default=None,
+                        help="Chunk VCFs to be merged, optional")
+
+    parser.add_argument('--output_fn', type=str, default=None,
+                        help="Output VCF, BGZF compressed and tabix indexed if ending with .gz, REQUIRED")
+
+    parser.add_argument('--overlap_filter', action='store_true',
+                        help="Apply the filter of overlap_variant while merging, optional")
+
+    parser.add_argument('--no_index', action='store_true',
+                        help="Do not create the tabix index for a .gz output, optional")
+
+    args = parser.parse_args()
+
+    if len(argv[1:]) == 0:
+        parser.print_help()
+        exit(1)
+
+    if args.output_fn is None or (args.input_prefix is None and args.vcf_fns is None):
+        exit("[ERROR] --output_fn, and --input_prefix or --vcf_fns must be specified.")
+
+    Run(args)
+
+
+if __name__ == "__main__":
+    main()
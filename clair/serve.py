@@ -0,0 +1,270 @@
+import os
+import sys
+import socket
+import signal
+import struct
+import logging
+import socketserver
+import numpy as np
+from time import time
+from queue import Queue, Empty
+from threading import Thread, Event
+from argparse import ArgumentParser
+
+import clair.utils as utils
+import shared.param as param
+from clair.task.main import GT21, GENOTYPE, VARIANT_LENGTH_1, VARIANT_LENGTH_2
+
+logging.basicConfig(format='%(message)s', level=logging.INFO)
+
+# Protocol, per request on a connection:
+#   client -> server: number of tensors n (uint32, little-endian), followed by n * input_tensor_size float32
+#   server -> client: n * output_probability_size float32, the four predictions concatenated per tensor
+# A request with n = 0 ends the connection, a connection closed without response means the prediction failed
+REQUEST_HEADER = struct.Struct("<I")
+input_tensor_size = utils.input_tensor_size
+output_label_split = [
+    GT21.output_label_count,
+    GENOTYPE.output_label_count,
+    VARIANT_LENGTH_1.output_label_count,
+    VARIANT_LENGTH_2.output_label_count,
+]
+output_probability_size = sum(output_label_split)
+
+
+def receive_exactly(connection, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        no_of_bytes = connection.recv_into(view[received:], size - received)
+        if no_of_bytes == 0:
+            return None
+        received += no_of_bytes
+    return buffer
+
+
+class InferenceRequest(object):
+    def __init__(self, X):
+        self.X = X
+        self.prediction = None
+        self.done = Event()
+
+
+class InferenceRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            header = receive_exactly(self.request, REQUEST_HEADER.size)
+            if header is None:
+                return
+            no_of_tensors, = REQUEST_HEADER.unpack(header)
+            if no_of_tensors == 0:
+                return
+
+            tensors = receive_exactly(self.request, no_of_tensors * input_tensor_size * 4)
+            if tensors is None:
+                return
+
+            X = np.frombuffer(tensors, dtype=np.float32).reshape(
+                no_of_tensors, utils.no_of_positions, utils.matrix_row, utils.matrix_num
+            )
+            inference_request = InferenceRequest(X)
+            self.server.request_queue.put(inference_request)
+            inference_request.done.wait()
+            if inference_request.prediction is None:
+                return
+            self.request.sendall(inference_request.prediction.tobytes())
+
+
+class InferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serve predictions of a single model to multiple call_var processes through a UNIX socket
+    Requests from all connections are gathered into batches of up to max_batch_size tensors,
+    waiting no more than batch_timeout seconds for more requests once the first one arrives
+    If batch_size_tuner is set, max_batch_size is tuned at runtime for the highest throughput
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_fn, model, max_batch_size, batch_timeout, batch_size_tuner=None):
+        socketserver.UnixStreamServer.__init__(self, socket_fn, InferenceRequestHandler)
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.batch_timeout = batch_timeout
+        self.batch_size_tuner = batch_size_tuner
+        self.request_queue = Queue()
+
+        self.no_of_batches = 0
+        self.no_of_tensors = 0
+        self.inference_time = 0.0
+
+        self.inference_thread = Thread(target=self.inference_loop)
+        self.inference_thread.daemon = True
+        self.inference_thread.start()
+
+    def next_requests(self):
+        """
+        Returns:
+            (requests gathered for a batch, the time the first request is received)
+        """
+        requests = [self.request_queue.get()]
+        first_request_time = time()
+        no_of_tensors = requests[0].X.shape[0]
+        if self.batch_size_tuner is not None:
+            self.max_batch_size = self.batch_size_tuner.batch_size
+        deadline = time() + self.batch_timeout
+        while no_of_tensors < self.max_batch_size:
+            try:
+                inference_request = self.request_queue.get(timeout=max(0, deadline - time()))
+            except Empty:
+                break
+            requests.append(inference_request)
+            no_of_tensors += inference_request.X.shape[0]
+        return requests, first_request_time
+
+    def inference_loop(self):
+        while True:
+            requests, first_request_time = self.next_requests()
+            try:
+                inference_start_time = time()
+                prediction = np.concatenate(
+                    self.model.predict(np.concatenate([r.X for r in requests])), axis=1
+                ).astype(np.float32)
+                self.inference_time += time() - inference_start_time
+                if self.batch_size_tuner is not None:
+                    self.batch_size_tuner.record(len(prediction), time() - first_request_time)
+            except Exception as e:
+                print("[ERROR] Prediction failed: %s" % (e), file=sys.stderr)
+                prediction = None
+
+            offset = 0
+            for inference_request in requests:
+                no_of_tensors = inference_request.X.shape[0]
+                if prediction is not None:
+                    inference_request.prediction = prediction[offset:offset + no_of_tensors]
+                offset += no_of_tensors
+                inference_request.done.set()
+
+            self.no_of_batches += 1
+            self.no_of_tensors += offset
+
+    def log_statistics(self):
+        if self.no_of_batches == 0:
+            return
+        logging.info("[INFO] Predicted %d tensors in %d batches (%.1f tensors per batch), %.1f tensors/s" % (
+            self.no_of_tensors,
+            self.no_of_batches,
+            float(self.no_of_tensors) / self.no_of_batches,
+            self.no_of_tensors / max(self.inference_time, 1e-9),
+        ))
+
+
+class InferenceClient(object):
+    """
+    Model interface (predict and prediction) backed by an InferenceServer, used by call_var with --server_socket
+    """
+
+    def __init__(self, socket_fn):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.socket.connect(socket_fn)
+        except socket.error as e:
+            sys.exit("[ERROR] Cannot connect to the inference server at %s: %s" % (socket_fn, e))
+        self.split_indices = np.cumsum(output_label_split)[:-1]
+
+    def predict(self, batchX):
+        """
+        Predict using model in batch with input tensor batchX
+        Returns:
+            prediction: predictions from the model in batch
+        """
+        X = np.ascontiguousarray(batchX, dtype=np.float32)
+        no_of_tensors = X.shape[0]
+        self.socket.sendall(REQUEST_HEADER.pack(no_of_tensors) + X.tobytes())
+
+        response = receive_exactly(self.socket, no_of_tensors * output_probability_size * 4)
+        if response is None:
+            raise RuntimeError("Inference server closed the connection")
+        Y = np.frombuffer(response, dtype=np.float32).reshape(no_of_tensors, output_probability_size)
+        prediction = np.split(Y, self.split_indices, axis=1)
+        self.prediction = prediction
+
+        return prediction
+
+    def close(self):
+        try:
+            self.socket.sendall(REQUEST_HEADER.pack(0))
+        except socket.error:
+            pass
+        self.socket.close()
+
+
+def Run(args):
+    from clair.call_var import model_from
+
+    utils.setup_environment()
+    param.NUM_THREADS = args.threads
+
+    if os.path.exists(args.socket_fn):
+        os.remove(args.socket_fn)
+
+    m = model_from(args.chkpnt_fn)
+    server = InferenceServer(
+        socket_fn=args.socket_fn,
+        model=m,
+        max_batch_size=args.max_batch_size,
+        batch_timeout=args.batch_timeout,
+        batch_size_tuner=utils.BatchSizeTuner(initial_batch_size=args.max_batch_size) if args.adaptive_batch_size else None,
+    )
+
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, terminate)
+
+    logging.info("[INFO] Serving %s at %s" % (args.chkpnt_fn, args.socket_fn))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket_fn)
+        server.log_statistics()
+        if server.batch_size_tuner is not None:
+            server.batch_size_tuner.log_summary()
+
+
+def main():
+    parser = ArgumentParser(description="Serve a trained model to call_var processes through a local UNIX socket")
+
+    parser.add_argument('--chkpnt_fn', type=str, default=None,
+                        help="Input a model to be served, REQUIRED")
+
+    parser.add_argument('--socket_fn', type=str, default=None,
+                        help="Path of the UNIX socket, use it as --server_socket in call_var, callVarBam and callVarBamParallel, REQUIRED")
+
+    parser.add_argument('--threads', type=int, default=param.NUM_THREADS,
+                        help="Number of threads for inference, default: %(default)s")
+
+    parser.add_argument('--max_batch_size', type=int, default=4 * param.predictBatchSize,
+                        help="Maximum number of tensors gathered into one inference batch, default: %(default)s")
+
+    parser.add_argument('--batch_timeout', type=float, default=0.01,
+                        help="Seconds to wait for more requests before predicting a batch, default: %(default)s")
+
+    parser.add_argument('--adaptive_batch_size', action='store_true',
+                        help="Tune the maximum batch size at runtime for the highest throughput (tensors/s), optional")
+
+    args = parser.parse_args()
+
+    if len(sys.argv[1:]) == 0:
+        parser.print_help()
+        sys.exit(1)
+
+    if args.chkpnt_fn is None or args.socket_fn is None:
+        sys.exit("[ERROR] --chkpnt_fn and --socket_fn must be specified.")
+
+    Run(args)
+
+
+if __name__ == "__main__":
+    main()
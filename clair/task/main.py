@@ -29,26 +29,35 @@ VARIANT_LENGTH_2 = OutputLabelNamedTuple(
 )
 
 
+# tasks in the order of their one-hot labels in a label vector
+OUTPUT_LABEL_TASKS = [GT21, GENOTYPE, VARIANT_LENGTH_1, VARIANT_LENGTH_2]
+OUTPUT_LABEL_SIZE = VARIANT_LENGTH_2.y_end_index
+
+
 def min_max(value, minimum, maximum):
     return max(min(value, maximum), minimum)
 
 
-def output_labels_from_reference(reference_base):
-    gt21_vec = [0] * GT21.output_label_count
-    gt21_vec[gt21_enum_from_label(reference_base + reference_base)] = 1
-
-    genotype_vec = [0] * GENOTYPE.output_label_count
-    genotype_vec[Genotype.homo_reference] = 1
+def output_labels_from_label_indexes(label_indexes):
+    """
+    One-hot label vector of all tasks from the class index of each task
+    """
+    labels = [0] * OUTPUT_LABEL_SIZE
+    for task, label_index in zip(OUTPUT_LABEL_TASKS, label_indexes):
+        labels[task.y_start_index + label_index] = 1
+    return labels
 
-    variant_length_vec_1 = [0] * VARIANT_LENGTH_1.output_label_count
-    variant_length_vec_2 = [0] * VARIANT_LENGTH_2.output_label_count
-    variant_length_vec_1[0 + VariantLength.index_offset] = 1
-    variant_length_vec_2[0 + VariantLength.index_offset] = 1
 
-    return gt21_vec + genotype_vec + variant_length_vec_1 + variant_length_vec_2
+def output_label_indexes_from_reference(reference_base):
+    return (
+        int(gt21_enum_from_label(reference_base + reference_base)),
+        int(Genotype.homo_reference),
+        0 + VariantLength.index_offset,
+        0 + VariantLength.index_offset,
+    )
 
 
-def output_labels_from_vcf_columns(columns):
+def output_label_indexes_from_vcf_columns(columns):
     reference, alternate = columns[2], columns[3]
     genotype_1, genotype_2 = int(columns[4]), int(columns[5])
 
@@ -60,22 +69,27 @@ def output_labels_from_vcf_columns(columns):
         )
 
     gt21 = gt21_enum_from(reference, alternate, genotype_1, genotype_2, alternate_arr)
-    gt21_vec = [0] * GT21.output_label_count
-    gt21_vec[gt21] = 1
 
     genotype = genotype_enum_from(genotype_1, genotype_2)
     genotype_for_task = genotype_enum_for_task(genotype)
-    genotype_vec = [0] * GENOTYPE.output_label_count
-    genotype_vec[genotype_for_task] = 1
 
     variant_lengths = [
         min_max(len(alt) - len(reference), VariantLength.min, VariantLength.max)
         for alt in alternate_arr
     ]
     variant_lengths.sort()
-    variant_length_vec_1 = [0] * VARIANT_LENGTH_1.output_label_count
-    variant_length_vec_2 = [0] * VARIANT_LENGTH_2.output_label_count
-    variant_length_vec_1[variant_lengths[0] + VariantLength.index_offset] = 1
-    variant_length_vec_2[variant_lengths[1] + VariantLength.index_offset] = 1
 
-    return gt21_vec + genotype_vec + variant_length_vec_1 + variant_length_vec_2
+    return (
+        int(gt21),
+        int(genotype_for_task),
+        variant_lengths[0] + VariantLength.index_offset,
+        variant_lengths[1] + VariantLength.index_offset,
+    )
+
+
+def output_labels_from_reference(reference_base):
+    return output_labels_from_label_indexes(output_label_indexes_from_reference(reference_base))
+
+
+def output_labels_from_vcf_columns(columns):
+    return output_labels_from_label_indexes(output_label_indexes_from_vcf_columns(columns))
@@ -8,6 +8,7 @@ from argparse import ArgumentParser
 from threading import Thread
 
 from clair.model import Clair
+from clair.data_loader import MiniBatchLoader
 import clair.utils as utils
 import clair.evaluate as evaluate
 import shared.param as param
@@ -75,7 +76,7 @@ def shuffle_first_n_items(array, n):
     return np.append(a1, a2)
 
 
-def train_model(m, training_config):
+def train_model(m, training_config, data_workers=1, prefetch=2, shuffle_buffer_blocks=0, shuffle_seed=None):
     learning_rate = training_config.learning_rate
     l2_regularization_lambda = training_config.l2_regularization_lambda
     output_file_path_prefix = training_config.output_file_path_prefix
@@ -109,6 +110,15 @@ def train_model(m, training_config):
     )
     no_of_training_blosc_blocks = int(no_of_training_examples / param.bloscBlockSize)
     tensor_block_index_list = np.arange(no_of_blosc_blocks, dtype=int)
+    mini_batch_loader = MiniBatchLoader(
+        dataset_info=dataset_info,
+        no_of_training_examples=no_of_training_examples,
+        workers=data_workers,
+        prefetch=prefetch,
+        shuffle_buffer_blocks=shuffle_buffer_blocks,
+        seed=shuffle_seed,
+    )
+    mini_batches = None
 
     # Initialize variables
     epoch_count = 1
@@ -146,15 +156,9 @@ def train_model(m, training_config):
         for t in thread_pool:
             t.start()
 
-        next_x_batch, next_y_batch, next_first_blosc_block_data_index, next_blosc_start_index = utils.new_mini_batch(
-            data_index=data_index,
-            blosc_start_index=blosc_index,
-            first_blosc_block_data_index=first_blosc_block_data_index,
-            no_of_training_examples=no_of_training_examples,
-            no_of_blosc_blocks=no_of_blosc_blocks,
-            dataset_info=dataset_info,
-            tensor_block_index_list=tensor_block_index_list,
-        )
+        if mini_batches is None:
+            mini_batches = mini_batch_loader.batches(tensor_block_index_list, epoch_count)
+        next_x_batch, next_y_batch, next_first_blosc_block_data_index, next_blosc_start_index = next(mini_batches)
 
         # wait until loaded next mini batch & finished training/validation with current mini batch
         for t in thread_pool:
@@ -202,7 +206,9 @@ def train_model(m, training_config):
             ])
         )
 
-        logging.info("[INFO] Epoch time elapsed: %.2f s" % (time() - epoch_start_time))
+        logging.info("[INFO] Epoch time elapsed: %.2f s, %.2f s waiting for data" % (
+            time() - epoch_start_time, mini_batch_loader.pop_wait_time()
+        ))
         training_losses.append((training_loss_sum, epoch_count))
         validation_losses.append((validation_loss_sum, epoch_count))
 
@@ -245,6 +251,7 @@ def train_model(m, training_config):
         first_blosc_block_data_index = 0
         x_batch = None
         y_batch = None
+        mini_batches = None
 
         gt21_loss_sum = 0
         genotype_loss_sum = 0
@@ -252,12 +259,14 @@ def train_model(m, training_config):
         indel_length_loss_sum_2 = 0
         l2_loss_sum = 0
 
-        # shuffle data on each epoch
-        tensor_block_index_list = shuffle_first_n_items(tensor_block_index_list, no_of_training_blosc_blocks)
-        logging.info("[INFO] Shuffled: " + ' '.join(
-            [str(x) for x in np.append(tensor_block_index_list[:5], tensor_block_index_list[-5:])]
-        ))
+        # shuffle data on each epoch, examples are shuffled by the mini-batch loader if with a shuffle buffer
+        if shuffle_buffer_blocks <= 0:
+            tensor_block_index_list = shuffle_first_n_items(tensor_block_index_list, no_of_training_blosc_blocks)
+            logging.info("[INFO] Shuffled: " + ' '.join(
+                [str(x) for x in np.append(tensor_block_index_list[:5], tensor_block_index_list[-5:])]
+            ))
 
+    mini_batch_loader.close()
     logging.info("[INFO] Training time elapsed: %.2f s" % (time() - training_start_time))
 
     return training_losses, validation_losses
@@ -318,6 +327,15 @@ def main():
     parser.add_argument('--olog_dir', type=str, default=None,
                         help="Directory for tensorboard log outputs, optional")
 
+    parser.add_argument('--data_workers', type=int, default=1,
+                        help="Number of threads decompressing mini-batches, default: %(default)s")
+    parser.add_argument('--prefetch', type=int, default=2,
+                        help="Number of mini-batches loaded ahead of training, default: %(default)s")
+    parser.add_argument('--shuffle_buffer_blocks', type=int, default=0,
+                        help="Shuffle training examples across this many decompressed blocks, instead of shuffling the block order only, 0 to disable, default: %(default)s")
+    parser.add_argument('--shuffle_seed', type=int, default=None,
+                        help="Seed of the shuffle buffer, for a reproducible order of training examples, optional")
+
     args = parser.parse_args()
 
     if len(sys.argv[1:]) == 0:
@@ -358,7 +376,14 @@ def main():
         summary_writer=m.get_summary_file_writer(args.olog_dir) if args.olog_dir != None else None,
     )
 
-    _training_losses, validation_losses = train_model(m, training_config)
+    _training_losses, validation_losses = train_model(
+        m,
+        training_config,
+        data_workers=args.data_workers,
+        prefetch=args.prefetch,
+        shuffle_buffer_blocks=args.shuffle_buffer_blocks,
+        shuffle_seed=args.shuffle_seed,
+    )
 
     # show the parameter set with the smallest validation loss
     validation_losses.sort()
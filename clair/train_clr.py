@@ -8,6 +8,7 @@ from argparse import ArgumentParser
 from threading import Thread
 
 from clair.model import Clair
+from clair.data_loader import MiniBatchLoader
 import clair.utils as utils
 import clair.evaluate as evaluate
 import shared.param as param
@@ -25,7 +26,7 @@ def shuffle_first_n_items(array, n):
     return np.append(a1, a2)
 
 
-def train_model(m, training_config, clr_mode):
+def train_model(m, training_config, clr_mode, data_workers=1, prefetch=2):
     learning_rate = training_config.learning_rate
     max_learning_rate = param.clr_max_lr
     l2_regularization_lambda = training_config.l2_regularization_lambda
@@ -59,6 +60,13 @@ def train_model(m, training_config, clr_mode):
     )
     no_of_training_blosc_blocks = int(no_of_training_examples / param.bloscBlockSize)
     tensor_block_index_list = np.arange(no_of_blosc_blocks, dtype=int)
+    mini_batch_loader = MiniBatchLoader(
+        dataset_info=dataset_info,
+        no_of_training_examples=no_of_training_examples,
+        workers=data_workers,
+        prefetch=prefetch,
+    )
+    mini_batches = None
 
     total_numbers_of_iterations = np.ceil(no_of_training_examples / param.trainBatchSize+1) + \
         np.ceil(no_of_validation_examples/param.predictBatchSize+1)
@@ -100,15 +108,9 @@ def train_model(m, training_config, clr_mode):
         for t in thread_pool:
             t.start()
 
-        next_x_batch, next_y_batch, next_first_blosc_block_data_index, next_blosc_start_index = utils.new_mini_batch(
-            data_index=data_index,
-            blosc_start_index=blosc_index,
-            first_blosc_block_data_index=first_blosc_block_data_index,
-            no_of_training_examples=no_of_training_examples,
-            no_of_blosc_blocks=no_of_blosc_blocks,
-            dataset_info=dataset_info,
-            tensor_block_index_list=tensor_block_index_list,
-        )
+        if mini_batches is None:
+            mini_batches = mini_batch_loader.batches(tensor_block_index_list, epoch_count)
+        next_x_batch, next_y_batch, next_first_blosc_block_data_index, next_blosc_start_index = next(mini_batches)
 
         # wait until loaded next mini batch & finished training/validation with current mini batch
         for t in thread_pool:
@@ -158,7 +160,9 @@ def train_model(m, training_config, clr_mode):
             ])
         )
 
-        logging.info("[INFO] Epoch time elapsed: %.2f s" % (time() - epoch_start_time))
+        logging.info("[INFO] Epoch time elapsed: %.2f s, %.2f s waiting for data" % (
+            time() - epoch_start_time, mini_batch_loader.pop_wait_time()
+        ))
         training_losses.append((training_loss_sum, epoch_count))
         validation_losses.append((validation_loss_sum, epoch_count))
 
@@ -178,6 +182,7 @@ def train_model(m, training_config, clr_mode):
         first_blosc_block_data_index = 0
         x_batch = None
         y_batch = None
+        mini_batches = None
 
         gt21_loss_sum = 0
         genotype_loss_sum = 0
@@ -191,6 +196,7 @@ def train_model(m, training_config, clr_mode):
             [str(x) for x in np.append(tensor_block_index_list[:5], tensor_block_index_list[-5:])]
         ))
 
+    mini_batch_loader.close()
     logging.info("[INFO] Training time elapsed: %.2f s" % (time() - training_start_time))
     return training_losses, validation_losses
 
@@ -254,6 +260,11 @@ def main():
     parser.add_argument('--olog_dir', type=str, default=None,
                         help="Directory for tensorboard log outputs, optional")
 
+    parser.add_argument('--data_workers', type=int, default=1,
+                        help="Number of threads decompressing mini-batches, default: %(default)s")
+    parser.add_argument('--prefetch', type=int, default=2,
+                        help="Number of mini-batches loaded ahead of training, default: %(default)s")
+
     args = parser.parse_args()
 
     if len(sys.argv[1:]) == 0:
@@ -294,7 +305,9 @@ def main():
         summary_writer=m.get_summary_file_writer(args.olog_dir) if args.olog_dir != None else None,
     )
 
-    _training_losses, validation_losses = train_model(m, training_config, clr_mode=args.clr_mode)
+    _training_losses, validation_losses = train_model(
+        m, training_config, clr_mode=args.clr_mode, data_workers=args.data_workers, prefetch=args.prefetch
+    )
 
     # show the parameter set with the smallest validation loss
     validation_losses.sort()
@@ -7,11 +7,30 @@ import logging
 import pickle
 import numpy as np
 import blosc
-from os import environ
+from os import environ, path
+from time import time
+from queue import Queue, Empty
+from threading import Thread
+from multiprocessing import Pool
 from enum import IntEnum
-from collections import namedtuple
-
-from clair.task.main import output_labels_from_reference, output_labels_from_vcf_columns
+from collections import namedtuple, deque
+
+from clair.task.main import (
+    OUTPUT_LABEL_TASKS,
+    OUTPUT_LABEL_SIZE,
+    output_labels_from_reference,
+    output_labels_from_vcf_columns,
+    output_label_indexes_from_reference,
+    output_label_indexes_from_vcf_columns,
+)
+from clair.dataset import Dataset, is_dataset_file
+from clair.positions import (
+    ContigTable,
+    position_rows_from,
+    read_region_index,
+    region_index_file_path_from,
+    region_index_from_position_blocks,
+)
 import shared.param as param
 from shared.interval_tree import bed_tree_from, is_region_in
 from shared.utils import subprocess_popen, IUPAC_base_to_num_dict as BASE2NUM, IUPAC_base_to_ACGT_base_dict as BASE2ACGT, BASIC_BASES
@@ -25,6 +44,7 @@ DatasetInfo = namedtuple('DatasetInfo', [
     'position_array_compressed',
     'no_of_training_examples_from_train_binary',
     'is_separated_train_and_validation_binary',
+    'contig_names',
 ])
 TrainingConfig = namedtuple('TrainingConfig', [
     'dataset_info',
@@ -44,8 +64,57 @@ def setup_environment():
     gc.enable()
 
 
-def blosc_pack_array(array):
-    return blosc.pack_array(array, cname='lz4hc', clevel=9, shuffle=blosc.NOSHUFFLE)
+BLOSC_CODECS = ["blosclz", "lz4", "lz4hc", "zlib", "zstd"]
+BLOSC_SHUFFLES = dict(noshuffle=blosc.NOSHUFFLE, shuffle=blosc.SHUFFLE, bitshuffle=blosc.BITSHUFFLE)
+
+
+def blosc_pack_array(array, cname=param.bloscCodec, clevel=param.bloscLevel, shuffle=param.bloscShuffle):
+    return blosc.pack_array(array, cname=cname, clevel=clevel, shuffle=BLOSC_SHUFFLES[shuffle])
+
+
+def blosc_pack_arrays(arrays, cname, clevel, shuffle):
+    return [blosc_pack_array(array, cname=cname, clevel=clevel, shuffle=shuffle) for array in arrays]
+
+
+class BlockPacker(object):
+    """
+    Compress blocks, each a list of arrays, in a pool of processes and return them in the order put
+    At most 2 * workers blocks are in flight, so that the input is not buffered without bound
+    """
+
+    def __init__(self, workers=1, cname=param.bloscCodec, clevel=param.bloscLevel, shuffle=param.bloscShuffle):
+        self.options = (cname, clevel, shuffle)
+        self.max_pending = 2 * workers
+        self.pending = deque()
+        # a worker is one core, blosc threads would only contend with other workers
+        self.pool = Pool(workers, initializer=blosc.set_nthreads, initargs=(1,)) if workers > 1 else None
+
+    def put(self, arrays, tag=None):
+        """
+        Returns:
+            list of (compressed arrays, tag) of the blocks finished, in the order put
+        """
+        if self.pool is None:
+            return [(blosc_pack_arrays(arrays, *self.options), tag)]
+
+        self.pending.append((self.pool.apply_async(blosc_pack_arrays, (arrays,) + self.options), tag))
+        finished_blocks = []
+        while len(self.pending) > self.max_pending:
+            result, pending_tag = self.pending.popleft()
+            finished_blocks.append((result.get(), pending_tag))
+        return finished_blocks
+
+    def close(self):
+        """
+        Returns:
+            list of (compressed arrays, tag) of the remaining blocks
+        """
+        finished_blocks = [(result.get(), tag) for result, tag in self.pending]
+        self.pending.clear()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+        return finished_blocks
 
 
 def unpack_a_tensor_record(a, b, c, *d):
@@ -68,8 +137,167 @@ def batches_from(iterable, item_from, batch_size=1):
 no_of_positions, matrix_row, matrix_num = 2 * param.flankingBaseNum + 1, param.matrixRow, param.matrixNum
 input_tensor_size = no_of_positions * matrix_row * matrix_num
 
+# dtypes of the tensor blocks in a bin, raw counts are stored in an integer dtype (saturated at its maximum) and
+# the reference channel is subtracted when loaded, float32 blocks are stored subtracted already
+TENSOR_DTYPES = dict(float32=np.float32, int16=np.int16, uint8=np.uint8)
+RAW_COUNT_DTYPES = (np.dtype(np.int16), np.dtype(np.uint8))
+
+
+def subtract_reference_channel(X):
+    """
+    Subtract the reference channel from the insertion, deletion and SNP channels of X in place
+    """
+    for i in range(1, matrix_num):
+        X[..., i] -= X[..., 0]
+
+
+def is_raw_counts(x_rows):
+    return x_rows.dtype in RAW_COUNT_DTYPES
+
+
+def input_tensors_from(x_rows):
+    """
+    Model inputs (float32, reference channel subtracted) of the rows of a decompressed tensor block
+    """
+    if not is_raw_counts(x_rows):
+        return x_rows
+    X = x_rows.astype(np.float32)
+    subtract_reference_channel(X)
+    return X
+
+
+def tensor_batch_from(rows):
+    """
+    Parse rows of tensors into (X, non_tensor_infos), tensors with a non-IUPAC center base are skipped
+    Reference channel is subtracted from the insertion, deletion and SNP channels
+    """
+    tensors = np.empty((len(rows), input_tensor_size), dtype=np.float32)
+    non_tensor_infos = []
+    for row in rows:
+        columns = row.split()
+        non_tensor_info = columns[:-input_tensor_size]
+        _, _, sequence = non_tensor_info
+        if sequence[param.flankingBaseNum] not in BASE2NUM:
+            continue
+        tensors[len(non_tensor_infos)] = np.array(columns[-input_tensor_size:], dtype=np.float32)
+        non_tensor_infos.append(non_tensor_info)
+
+    current_batch_size = len(non_tensor_infos)
+    X = np.reshape(tensors[:current_batch_size], (current_batch_size, no_of_positions, matrix_row, matrix_num))
+    subtract_reference_channel(X)
+
+    return X, non_tensor_infos
+
 
-def tensor_generator_from(tensor_file_path, batch_size):
+class BatchSizeTuner(object):
+    """
+    Hill climbing on the inference batch size, maximizing the throughput (tensors/s)
+    The throughput of each batch size is measured over batches_per_trial batches, the batch size keeps moving
+    (multiplied or divided by step_factor) in the same direction while the throughput improves,
+    and settles at the best one found once moving in both directions does not improve by min_improvement.
+    After settled, a neighbouring batch size is tried again every reprobe_interval trials, in case the input rate changes.
+    """
+
+    def __init__(
+        self,
+        initial_batch_size=param.predictBatchSize,
+        min_batch_size=param.minPredictBatchSize,
+        max_batch_size=param.maxPredictBatchSize,
+        step_factor=1.5,
+        batches_per_trial=3,
+        min_improvement=0.02,
+        reprobe_interval=20,
+    ):
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.step_factor = step_factor
+        self.batches_per_trial = batches_per_trial
+        self.min_improvement = min_improvement
+        self.reprobe_interval = reprobe_interval
+
+        self.batch_size = self.bounded(initial_batch_size)
+        self.direction = 1
+        self.best_batch_size = None
+        self.best_throughput = 0.0
+        self.is_settled = False
+        self.no_of_failed_moves = 0
+        self.trials_since_settled = 0
+
+        self.trial_tensors = 0
+        self.trial_time = 0.0
+        self.trial_batches = 0
+
+    def bounded(self, batch_size):
+        return int(min(self.max_batch_size, max(self.min_batch_size, batch_size)))
+
+    def moved(self, batch_size, direction):
+        return self.bounded(batch_size * self.step_factor if direction > 0 else batch_size / self.step_factor)
+
+    def record(self, no_of_tensors, elapsed_time):
+        """
+        Record the time used for predicting a batch, batches not filled up (e.g. flushed at deadline)
+        or loaded before the batch size changed are not used
+        """
+        if no_of_tensors < self.batch_size * 0.95 or no_of_tensors >= self.batch_size * self.step_factor:
+            return
+        self.trial_tensors += no_of_tensors
+        self.trial_time += elapsed_time
+        self.trial_batches += 1
+        if self.trial_batches < self.batches_per_trial:
+            return
+
+        throughput = self.trial_tensors / max(self.trial_time, 1e-9)
+        self.trial_tensors, self.trial_time, self.trial_batches = 0, 0.0, 0
+        self.next_trial(throughput)
+
+    def next_trial(self, throughput):
+        is_improved = throughput > self.best_throughput * (1 + self.min_improvement)
+        if self.best_batch_size == self.batch_size or is_improved:
+            self.best_throughput = throughput
+        if is_improved:
+            self.best_batch_size = self.batch_size
+            self.no_of_failed_moves = 0
+            if self.is_settled:
+                self.is_settled = False
+                logging.info("[INFO] Batch size %d improves throughput to %.1f tensors/s" % (self.batch_size, throughput))
+        elif not self.is_settled:
+            self.direction = -self.direction
+            self.no_of_failed_moves += 1
+            if self.no_of_failed_moves >= 2:
+                self.is_settled = True
+                self.trials_since_settled = 0
+                logging.info("[INFO] Batch size settled at %d, %.1f tensors/s" % (self.best_batch_size, self.best_throughput))
+
+        if self.is_settled:
+            self.trials_since_settled += 1
+            if self.trials_since_settled % self.reprobe_interval == 0:
+                self.direction = -self.direction
+                self.batch_size = self.moved(self.best_batch_size, self.direction)
+            else:
+                self.batch_size = self.best_batch_size
+            return
+
+        next_batch_size = self.moved(self.best_batch_size, self.direction)
+        if next_batch_size == self.best_batch_size:
+            # reached the bound in this direction
+            self.direction = -self.direction
+            self.no_of_failed_moves += 1
+            next_batch_size = self.moved(self.best_batch_size, self.direction)
+        self.batch_size = next_batch_size
+
+    def log_summary(self):
+        if self.best_batch_size is None:
+            logging.info("[INFO] Batch size %d, not enough full batches to tune" % (self.batch_size))
+            return
+        logging.info("[INFO] Chosen batch size %d, %.1f tensors/s" % (self.best_batch_size, self.best_throughput))
+
+
+def tensor_generator_from(tensor_file_path, batch_size, batch_timeout=None, batch_size_tuner=None):
+    """
+    Yield batches (X, non_tensor_infos) of tensors from a gzipped tensor file or stdin ("PIPE")
+    batch_timeout: if set, a partial batch is yielded once its first tensor has waited for batch_timeout seconds
+    batch_size_tuner: if set, the size of each batch is taken from batch_size_tuner.batch_size
+    """
     if tensor_file_path != "PIPE":
         f = subprocess_popen(shlex.split("gzip -fdc %s" % (tensor_file_path)))
         fo = f.stdout
@@ -78,38 +306,110 @@ def tensor_generator_from(tensor_file_path, batch_size):
 
     processed_tensors = 0
 
-    def item_from(row):
-        columns = row.split()
-        return (columns[:-input_tensor_size], np.array(columns[-input_tensor_size:], dtype=np.float32))
-
-    for batch in batches_from(fo, item_from=item_from, batch_size=batch_size):
-        tensors = np.empty((batch_size, input_tensor_size), dtype=np.float32)
-        non_tensor_infos = []
-        for non_tensor_info, tensor in batch:
-            _, _, sequence = non_tensor_info
-            if sequence[param.flankingBaseNum] not in BASE2NUM:
-                continue
-            tensors[len(non_tensor_infos)] = tensor
-            non_tensor_infos.append(non_tensor_info)
+    if batch_timeout is None and batch_size_tuner is None:
+        row_batches = batches_from(fo, item_from=lambda row: row, batch_size=batch_size)
+    else:
+        row_batches = row_batches_with_deadline_from(fo, batch_size, batch_timeout, batch_size_tuner)
 
-        current_batch_size = len(non_tensor_infos)
-        X = np.reshape(tensors, (batch_size, no_of_positions, matrix_row, matrix_num))
-        for i in range(1, matrix_num):
-            X[:current_batch_size, :, :, i] -= X[:current_batch_size, :, :, 0]
+    for rows in row_batches:
+        X, non_tensor_infos = tensor_batch_from(rows)
 
+        current_batch_size = len(non_tensor_infos)
         processed_tensors += current_batch_size
         print("Processed %d tensors" % processed_tensors, file=sys.stderr)
 
         if current_batch_size <= 0:
             continue
-        yield X[:current_batch_size], non_tensor_infos[:current_batch_size]
+        yield X, non_tensor_infos
 
     if tensor_file_path != "PIPE":
         fo.close()
         f.wait()
 
 
-def variant_map_from(var_fn, tree, is_tree_empty):
+def row_batches_with_deadline_from(fo, batch_size, batch_timeout, batch_size_tuner):
+    """
+    Rows are read by a separate thread, so that a partial batch could be yielded at the deadline
+    """
+    row_queue = Queue(maxsize=param.maxPredictBatchSize * 2)
+
+    def read_rows():
+        for row in fo:
+            row_queue.put(row)
+        row_queue.put(None)
+
+    reader_thread = Thread(target=read_rows)
+    reader_thread.daemon = True
+    reader_thread.start()
+
+    is_end_of_input = False
+    while not is_end_of_input:
+        current_batch_size = batch_size_tuner.batch_size if batch_size_tuner is not None else batch_size
+        rows = []
+        deadline = None
+        while len(rows) < current_batch_size:
+            try:
+                if deadline is None:
+                    row = row_queue.get()
+                else:
+                    row = row_queue.get(timeout=max(0, deadline - time()))
+            except Empty:
+                break
+            if row is None:
+                is_end_of_input = True
+                break
+            rows.append(row)
+            if deadline is None and batch_timeout is not None:
+                deadline = time() + batch_timeout
+        if len(rows) > 0:
+            yield rows
+
+
+# labels stored in a bin, index: the class index of each task (uint8, expanded to one-hot when loaded),
+# one_hot: one-hot vectors of all tasks
+LABEL_FORMAT_INDEX = "index"
+LABEL_FORMAT_ONE_HOT = "one_hot"
+LABEL_FORMATS = [LABEL_FORMAT_INDEX, LABEL_FORMAT_ONE_HOT]
+
+
+def label_from_vcf_columns(columns, label_format=LABEL_FORMAT_INDEX):
+    if label_format == LABEL_FORMAT_INDEX:
+        return np.array(output_label_indexes_from_vcf_columns(columns), dtype=np.uint8)
+    return output_labels_from_vcf_columns(columns)
+
+
+def label_from_reference(reference_base, label_format=LABEL_FORMAT_INDEX):
+    if label_format == LABEL_FORMAT_INDEX:
+        return np.array(output_label_indexes_from_reference(reference_base), dtype=np.uint8)
+    return output_labels_from_reference(reference_base)
+
+
+def is_label_indexes(y_rows):
+    return y_rows.shape[-1] == len(OUTPUT_LABEL_TASKS)
+
+
+def one_hot_labels_into(label_indexes, Y):
+    """
+    Fill Y (no. of rows x OUTPUT_LABEL_SIZE) with the one-hot labels of the class indexes of each task
+    """
+    Y[...] = 0
+    row_indexes = np.arange(len(label_indexes))
+    for i, task in enumerate(OUTPUT_LABEL_TASKS):
+        Y[row_indexes, task.y_start_index + label_indexes[:, i]] = 1
+
+
+def output_labels_from(y_rows):
+    """
+    One-hot labels (float32) of the rows of a decompressed label block
+    """
+    if not is_label_indexes(y_rows):
+        return y_rows
+    Y = np.empty((len(y_rows), OUTPUT_LABEL_SIZE), dtype=np.float32)
+    one_hot_labels_into(y_rows, Y)
+    return Y
+
+
+def variant_map_from(var_fn, tree, is_tree_empty, label_format=LABEL_FORMAT_INDEX):
     Y = {}
     if var_fn is None:
         return Y
@@ -123,23 +423,24 @@ def variant_map_from(var_fn, tree, is_tree_empty):
             continue
 
         key = ctg_name + ":" + position_str
-        Y[key] = output_labels_from_vcf_columns(columns)
+        Y[key] = label_from_vcf_columns(columns, label_format)
 
     f.stdout.close()
     f.wait()
     return Y
 
 
-def get_training_array(tensor_fn, var_fn, bed_fn, shuffle=True, is_allow_duplicate_chr_pos=False):
-    tree = bed_tree_from(bed_file_path=bed_fn)
-    is_tree_empty = len(tree.keys()) == 0
-
-    Y = variant_map_from(var_fn, tree, is_tree_empty)
+def training_tensors_from(tensor_fn, tree, is_tree_empty, tensor_dtype=np.float32):
+    """
+    Yield (key, sequence, x) of each tensor in the BED regions with a basic center base
+    Reference channel is subtracted from the insertion, deletion and SNP channels of float32 tensors,
+    tensors in an integer dtype keep the raw counts, saturated at the maximum of the dtype
+    """
+    is_raw_count_dtype = np.dtype(tensor_dtype) in RAW_COUNT_DTYPES
+    max_count = np.iinfo(tensor_dtype).max if is_raw_count_dtype else None
+    no_of_saturated_tensors = 0
 
-    X = {}
     f = subprocess_popen(shlex.split("gzip -fdc %s" % (tensor_fn)))
-    total = 0
-    mat = np.empty(input_tensor_size, dtype=np.float32)
     for row in f.stdout:
         chrom, coord, seq, mat = unpack_a_tensor_record(*(row.split()))
         if not (is_tree_empty or is_region_in(tree, chrom, int(coord))):
@@ -147,12 +448,50 @@ def get_training_array(tensor_fn, var_fn, bed_fn, shuffle=True, is_allow_duplica
         seq = seq.upper()
         if seq[param.flankingBaseNum] not in BASIC_BASES:
             continue
-        key = chrom + ":" + coord
 
         x = np.reshape(mat, (no_of_positions, matrix_row, matrix_num))
-        for i in range(1, matrix_num):
-            x[:, :, i] -= x[:, :, 0]
+        if is_raw_count_dtype:
+            if x.max() > max_count:
+                no_of_saturated_tensors += 1
+                x = np.minimum(x, max_count)
+            x = x.astype(tensor_dtype)
+        else:
+            subtract_reference_channel(x)
+
+        yield chrom + ":" + coord, seq, x
+    f.stdout.close()
+    f.wait()
 
+    if no_of_saturated_tensors > 0:
+        print(
+            "[WARNING] %d tensors have counts above %d, saturated" % (no_of_saturated_tensors, max_count),
+            file=sys.stderr
+        )
+
+
+def get_training_array(
+    tensor_fn,
+    var_fn,
+    bed_fn,
+    shuffle=True,
+    is_allow_duplicate_chr_pos=False,
+    block_packer=None,
+    tensor_dtype=np.float32,
+    label_format=LABEL_FORMAT_INDEX,
+    contig_table=None,
+):
+    """
+    Returns:
+        (total, X, Y, pos) blocks compressed, the contigs of the structured positions are added to contig_table
+    """
+    tree = bed_tree_from(bed_file_path=bed_fn)
+    is_tree_empty = len(tree.keys()) == 0
+
+    Y = variant_map_from(var_fn, tree, is_tree_empty, label_format)
+
+    X = {}
+    total = 0
+    for key, seq, x in training_tensors_from(tensor_fn, tree, is_tree_empty, tensor_dtype):
         if key not in X:
             X[key] = np.copy(x)
         elif is_allow_duplicate_chr_pos:
@@ -167,13 +506,11 @@ def get_training_array(tensor_fn, var_fn, bed_fn, shuffle=True, is_allow_duplica
 
         is_reference = key not in Y
         if is_reference:
-            Y[key] = output_labels_from_reference(BASE2ACGT[seq[param.flankingBaseNum]])
+            Y[key] = label_from_reference(BASE2ACGT[seq[param.flankingBaseNum]], label_format)
 
         total += 1
         if total % 100000 == 0:
             print("Processed %d tensors" % total, file=sys.stderr)
-    f.stdout.close()
-    f.wait()
 
     # print "[INFO] size of X: {}, size of Y: {}".format(len(X), len(Y))
 
@@ -181,7 +518,16 @@ def get_training_array(tensor_fn, var_fn, bed_fn, shuffle=True, is_allow_duplica
     if shuffle == True:
         np.random.shuffle(all_chr_pos)
 
+    block_packer = block_packer or BlockPacker()
+    contig_table = contig_table if contig_table is not None else ContigTable()
     X_compressed, Y_compressed, pos_compressed = [], [], []
+
+    def append_compressed(finished_blocks):
+        for (x_blob, y_blob, pos_blob), _ in finished_blocks:
+            X_compressed.append(x_blob)
+            Y_compressed.append(y_blob)
+            pos_compressed.append(pos_blob)
+
     X_array, Y_array, pos_array = [], [], []
     count = 0
     total = 0
@@ -193,19 +539,19 @@ def get_training_array(tensor_fn, var_fn, bed_fn, shuffle=True, is_allow_duplica
 
         if key in Y:
             Y_array.append(Y[key])
-            pos_array.append(key)
+            pos_array.append((key, 0))
             if not is_allow_duplicate_chr_pos:
                 del Y[key]
         elif is_allow_duplicate_chr_pos:
             tmp_key = key[1:]
             Y_array.append(Y[tmp_key])
-            pos_array.append(tmp_key)
+            pos_array.append((tmp_key, PREFIX_CHAR_STR.index(key[0]) + 1))
 
         count += 1
         if count == param.bloscBlockSize:
-            X_compressed.append(blosc_pack_array(np.array(X_array)))
-            Y_compressed.append(blosc_pack_array(np.array(Y_array)))
-            pos_compressed.append(blosc_pack_array(np.array(pos_array)))
+            append_compressed(block_packer.put(
+                [np.array(X_array), np.array(Y_array), position_rows_from(pos_array, contig_table)]
+            ))
             X_array, Y_array, pos_array = [], [], []
             count = 0
 
@@ -213,20 +559,43 @@ def get_training_array(tensor_fn, var_fn, bed_fn, shuffle=True, is_allow_duplica
             print("Compressed %d/%d tensor" % (total, len(all_chr_pos)), file=sys.stderr)
 
     if count > 0:
-        X_compressed.append(blosc_pack_array(np.array(X_array)))
-        Y_compressed.append(blosc_pack_array(np.array(Y_array)))
-        pos_compressed.append(blosc_pack_array(np.array(pos_array)))
+        append_compressed(block_packer.put(
+            [np.array(X_array), np.array(Y_array), position_rows_from(pos_array, contig_table)]
+        ))
+    append_compressed(block_packer.close())
 
     return total, X_compressed, Y_compressed, pos_compressed
 
 
+class DecompressedBlockCache(object):
+    """
+    The last decompressed block of each compressed array, so that the block a mini-batch ends in is not
+    decompressed again by the next mini-batch
+    """
+
+    def __init__(self):
+        self.entries = {}
+
+    def rows_of(self, array, block_index):
+        entry = self.entries.get(id(array))
+        if entry is not None and entry[0] is array and entry[1] == block_index:
+            return entry[2]
+        rows = blosc.unpack_array(array[block_index])
+        self.entries[id(array)] = (array, block_index, rows)
+        return rows
+
+
+decompressed_block_cache = DecompressedBlockCache()
+
+
 def decompress_array(
     array,
     blosc_start_index,
     first_blosc_block_data_index,
     no_of_data_rows_to_retrieve,
     no_of_blosc_blocks,
-    read_index_list=None
+    read_index_list=None,
+    rows_from=None
 ):
     """
     Return:
@@ -234,32 +603,62 @@ def decompress_array(
 
     Note:
         blosc_start_index, next_first_blosc_block_data_index and next_blosc_start_index is inclusive.
+        Each block is decompressed once, and only the rows retrieved are copied, once, into data_rows.
+        rows_from, if given, converts the rows retrieved from each block, e.g. input_tensors_from, so that blocks
+        stored differently (in a combined bin) come out the same.
     """
-    data_rows = []
+    segments = []
     no_of_data_rows = 0
+    next_first_blosc_block_data_index, next_blosc_start_index = -1, -1
     for i in range(blosc_start_index, no_of_blosc_blocks):
-        new_data_rows = blosc.unpack_array(array[i if read_index_list is None else read_index_list[i]])
-        data_rows.append(new_data_rows)
-        no_of_data_rows += len(new_data_rows)
-
-        if i == blosc_start_index and first_blosc_block_data_index > 0:
-            return np.concatenate(data_rows[:])[first_blosc_block_data_index:], 0, i+1
+        rows = decompressed_block_cache.rows_of(array, i if read_index_list is None else read_index_list[i])
+        start = first_blosc_block_data_index if i == blosc_start_index else 0
+        no_of_rows_in_segment = min(len(rows) - start, no_of_data_rows_to_retrieve - no_of_data_rows)
+        if no_of_rows_in_segment > 0:
+            segment = rows[start:start + no_of_rows_in_segment]
+            segments.append(segment if rows_from is None else rows_from(segment))
+            no_of_data_rows += no_of_rows_in_segment
 
         if no_of_data_rows >= no_of_data_rows_to_retrieve:
-            extra_no_of_data_rows = no_of_data_rows % no_of_data_rows_to_retrieve
-            next_blosc_start_index = i+1 if extra_no_of_data_rows == 0 else i
-            next_first_blosc_block_data_index = (
-                0 if extra_no_of_data_rows == 0 else (len(new_data_rows) - extra_no_of_data_rows)
-            )
-            return (
-                np.concatenate(data_rows[:])[0:no_of_data_rows_to_retrieve],
-                next_first_blosc_block_data_index if next_blosc_start_index < no_of_blosc_blocks else -1,
-                next_blosc_start_index if next_blosc_start_index < no_of_blosc_blocks else -1
-            )
+            if start + no_of_rows_in_segment < len(rows):
+                next_first_blosc_block_data_index, next_blosc_start_index = start + no_of_rows_in_segment, i
+            elif i + 1 < no_of_blosc_blocks:
+                next_first_blosc_block_data_index, next_blosc_start_index = 0, i + 1
+            break
 
     if no_of_data_rows <= 0:
         return None, -1, -1
-    return np.concatenate(data_rows[:]), -1, -1
+
+    # a common dtype, e.g. "chr:pos" strings of different widths in different blocks
+    data_rows = np.empty(
+        (no_of_data_rows,) + segments[0].shape[1:], dtype=np.result_type(*[segment.dtype for segment in segments])
+    )
+    row_index = 0
+    for segment in segments:
+        data_rows[row_index:row_index + len(segment)] = segment
+        row_index += len(segment)
+    return data_rows, next_first_blosc_block_data_index, next_blosc_start_index
+
+
+def compressed_arrays_from(binary_file_path):
+    """
+    Returns:
+        (dataset size, X, Y, pos, contig names) of a pickled bin, or of a dataset file read through mmap
+        contig names is None for bins written before positions were structured
+    """
+    if is_dataset_file(binary_file_path):
+        return Dataset(binary_file_path).compressed_arrays()
+
+    with open(binary_file_path, "rb") as fh:
+        dataset_size = pickle.load(fh)
+        x_array_compressed = pickle.load(fh)
+        y_array_compressed = pickle.load(fh)
+        position_array_compressed = pickle.load(fh)
+        try:
+            contig_names = pickle.load(fh)
+        except EOFError:
+            contig_names = None
+    return dataset_size, x_array_compressed, y_array_compressed, position_array_compressed, contig_names
 
 
 def dataset_info_from(
@@ -275,29 +674,28 @@ def dataset_info_from(
 
     if train_binary_file_path is not None and validation_binary_file_path is not None:
         logging.info("[INFO] Loading compressed data from train and validation binary file path")
-        with open(train_binary_file_path, "rb") as fh:
-            dataset_size = pickle.load(fh)
-            x_array_compressed = pickle.load(fh)
-            y_array_compressed = pickle.load(fh)
-            position_array_compressed = pickle.load(fh)
+        dataset_size, x_array_compressed, y_array_compressed, position_array_compressed, contig_names = \
+            compressed_arrays_from(train_binary_file_path)
         no_of_training_examples_from_train_binary = dataset_size
-        with open(validation_binary_file_path, "rb") as fh:
-            dataset_size += pickle.load(fh)
-            x_array_compressed += pickle.load(fh)
-            y_array_compressed += pickle.load(fh)
-            position_array_compressed += pickle.load(fh)
+        validation_arrays = compressed_arrays_from(validation_binary_file_path)
+        dataset_size += validation_arrays[0]
+        x_array_compressed = x_array_compressed + validation_arrays[1]
+        y_array_compressed = y_array_compressed + validation_arrays[2]
+        position_array_compressed = position_array_compressed + validation_arrays[3]
+        # contig ids of the two bins are comparable only with the same contig table
+        if contig_names != validation_arrays[4]:
+            contig_names = None
 
     elif binary_file_path != None:
         logging.info("[INFO] Loading compressed data from binary file path")
-        with open(binary_file_path, "rb") as fh:
-            dataset_size = pickle.load(fh)
-            x_array_compressed = pickle.load(fh)
-            y_array_compressed = pickle.load(fh)
-            position_array_compressed = pickle.load(fh)
+        dataset_size, x_array_compressed, y_array_compressed, position_array_compressed, contig_names = \
+            compressed_arrays_from(binary_file_path)
     else:
         logging.info("[INFO] Loading compressed data from utils get training array")
+        contig_table = ContigTable()
         dataset_size, x_array_compressed, y_array_compressed, position_array_compressed = \
-            get_training_array(tensor_file_path, variant_file_path, bed_file_path)
+            get_training_array(tensor_file_path, variant_file_path, bed_file_path, contig_table=contig_table)
+        contig_names = contig_table.names
 
     logging.info("[INFO] The size of dataset: {}".format(dataset_size))
 
@@ -308,9 +706,60 @@ def dataset_info_from(
         position_array_compressed=position_array_compressed,
         no_of_training_examples_from_train_binary=no_of_training_examples_from_train_binary,
         is_separated_train_and_validation_binary=no_of_training_examples_from_train_binary is not None,
+        contig_names=contig_names,
     )
 
 
+def region_index_from(dataset_info, binary_file_path=None):
+    """
+    Region index of a dataset, read from the sidecar of its bin if there is one, else built from the position blocks
+    """
+    if binary_file_path is not None:
+        region_index_file_path = region_index_file_path_from(binary_file_path)
+        if path.exists(region_index_file_path):
+            return read_region_index(region_index_file_path)
+
+    logging.info("[INFO] Building the region index from the position blocks ...")
+    return region_index_from_position_blocks(dataset_info.position_array_compressed, dataset_info.contig_names)
+
+
+def examples_in_region_from(
+    dataset_info,
+    region_index,
+    contig_name,
+    start=None,
+    end=None,
+    batch_size=param.predictBatchSize,
+):
+    """
+    Yield (x_batch, y_batch, pos_batch) of the examples at contig_name:start-end, in the order stored in the bin
+    Only the blocks with examples in the region are decompressed
+    """
+    batch = []
+    no_of_rows = 0
+    for block_index, row_indexes in region_index.block_rows_in(contig_name, start, end):
+        # converted block by block, blocks of a combined bin may be stored differently
+        batch.append([
+            input_tensors_from(blosc.unpack_array(dataset_info.x_array_compressed[block_index])[row_indexes]),
+            output_labels_from(blosc.unpack_array(dataset_info.y_array_compressed[block_index])[row_indexes]),
+            blosc.unpack_array(dataset_info.position_array_compressed[block_index])[row_indexes],
+        ])
+        no_of_rows += len(row_indexes)
+        if no_of_rows < batch_size:
+            continue
+
+        x_rows, y_rows, position_rows = [np.concatenate(rows) for rows in zip(*batch)]
+        no_of_full_batch_rows = no_of_rows - no_of_rows % batch_size
+        for i in range(0, no_of_full_batch_rows, batch_size):
+            yield x_rows[i:i + batch_size], y_rows[i:i + batch_size], position_rows[i:i + batch_size]
+        batch = [[x_rows[no_of_full_batch_rows:], y_rows[no_of_full_batch_rows:], position_rows[no_of_full_batch_rows:]]]
+        no_of_rows -= no_of_full_batch_rows
+
+    if no_of_rows > 0:
+        x_rows, y_rows, position_rows = [np.concatenate(rows) for rows in zip(*batch)]
+        yield x_rows, y_rows, position_rows
+
+
 def new_mini_batch(
     data_index,
     blosc_start_index,
@@ -343,17 +792,20 @@ def new_mini_batch(
     elif is_validation:
         batch_size = validation_batch_size
 
-    def decompress_array_from(array):
+    def decompress_array_from(array, rows_from):
         return decompress_array(
             array=array,
             blosc_start_index=blosc_start_index,
             first_blosc_block_data_index=first_blosc_block_data_index,
             no_of_data_rows_to_retrieve=batch_size,
             no_of_blosc_blocks=no_of_blosc_blocks,
-            read_index_list=tensor_block_index_list
+            read_index_list=tensor_block_index_list,
+            rows_from=rows_from
         )
-    x_batch, next_x_first_blosc_block_data_index, next_x_blosc_index = decompress_array_from(x_array_compressed)
-    y_batch, _next_y_first_blosc_block_data_index, next_y_blosc_index = decompress_array_from(y_array_compressed)
+    x_batch, next_x_first_blosc_block_data_index, next_x_blosc_index = \
+        decompress_array_from(x_array_compressed, input_tensors_from)
+    y_batch, _next_y_first_blosc_block_data_index, next_y_blosc_index = \
+        decompress_array_from(y_array_compressed, output_labels_from)
 
     x_batch_size, y_batch_size = np.shape(x_batch)[0], np.shape(y_batch)[0]
     x_end_flag, y_end_flag = next_x_blosc_index == -1, next_y_blosc_index == -1
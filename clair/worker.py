@@ -0,0 +1,118 @@
+import os
+import sys
+import shlex
+import signal
+from time import time, sleep
+from subprocess import TimeoutExpired
+from argparse import ArgumentParser
+
+from shared.chunk_queue import ChunkQueue, PENDING, RUNNING, DONE, FAILED
+from shared.command_options import ExecuteCommand, command_string_from
+from shared.utils import subprocess_popen
+
+
+def run_job(chunk_queue, lease_file_name, job, heartbeat_interval):
+    """
+    Run callVarBam of the job in a new process, renewing the lease until it exits, callVarBam is terminated once the
+    lease is lost, so that a job is never run by two workers for longer than heartbeat_interval
+    Returns:
+        True if succeeded, False if failed, None if the lease is lost
+    """
+    callVarBamBin = os.path.dirname(__file__) + "/../clair.py callVarBam"
+    command = command_string_from([ExecuteCommand('python', callVarBamBin), job["command_options"]])
+    process = subprocess_popen(shlex.split(command), stdout=sys.stderr)
+
+    try:
+        while True:
+            try:
+                process.wait(timeout=heartbeat_interval)
+                break
+            except TimeoutExpired:
+                pass
+            if not chunk_queue.renew(lease_file_name):
+                process.terminate()
+                process.wait()
+                return None
+    except KeyboardInterrupt:
+        process.terminate()
+        process.wait()
+        raise
+    return process.returncode == 0
+
+
+def Run(args):
+    chunk_queue = ChunkQueue(args.queue_dir, lease_timeout=args.lease_timeout)
+    if not os.path.isdir(chunk_queue.path_of(PENDING)):
+        sys.exit("[ERROR] %s is not a chunk queue, publish chunks with callVarBamParallel --queue_dir" % (args.queue_dir))
+
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, terminate)
+
+    heartbeat_interval = max(1, args.lease_timeout // 5)
+    no_of_jobs_run = 0
+    while args.max_jobs is None or no_of_jobs_run < args.max_jobs:
+        no_of_requeued_jobs = chunk_queue.requeue_expired_leases()
+        if no_of_requeued_jobs > 0:
+            print("[INFO] %d expired job(s) put back to the queue" % (no_of_requeued_jobs), file=sys.stderr)
+
+        lease_file_name, job = chunk_queue.claim()
+        if lease_file_name is None:
+            counts = chunk_queue.counts()
+            if counts[RUNNING] == 0 and not args.wait:
+                break
+            # jobs running elsewhere could still fail or expire
+            sleep(args.poll_interval)
+            continue
+
+        print("[INFO] Running %s, attempt %d" % (job["name"], job["attempts"]), file=sys.stderr)
+        start_time = time()
+        is_succeeded = run_job(chunk_queue, lease_file_name, job, heartbeat_interval)
+        no_of_jobs_run += 1
+        state = chunk_queue.complete(lease_file_name, is_succeeded, job) if is_succeeded is not None else None
+        if state is None:
+            print("[WARNING] Lease of %s expired, the job is left to other workers" % (job["name"]), file=sys.stderr)
+            continue
+        print("[INFO] %s %s in %.1f s" % (
+            job["name"], {DONE: "done", PENDING: "failed, put back to the queue", FAILED: "failed"}[state],
+            time() - start_time
+        ), file=sys.stderr)
+
+    counts = chunk_queue.counts()
+    print("[INFO] Queue: %d pending, %d running, %d done, %d failed" % (
+        counts[PENDING], counts[RUNNING], counts[DONE], counts[FAILED]
+    ), file=sys.stderr)
+
+
+def main():
+    parser = ArgumentParser(description="Claim and run chunks published by callVarBamParallel --queue_dir, on any host mounting the queue")
+
+    parser.add_argument('--queue_dir', type=str, default=None,
+                        help="Directory of the chunk queue, REQUIRED")
+
+    parser.add_argument('--lease_timeout', type=int, default=300,
+                        help="Seconds without a heartbeat before a running chunk is put back to the queue, the same for all workers, default: %(default)s")
+
+    parser.add_argument('--poll_interval', type=int, default=10,
+                        help="Seconds between checks of the queue while no chunk is pending, default: %(default)s")
+
+    parser.add_argument('--max_jobs', type=int, default=None,
+                        help="Exit after running this many chunks, optional")
+
+    parser.add_argument('--wait', action='store_true',
+                        help="Keep waiting for new chunks instead of exiting once the queue is empty, optional")
+
+    args = parser.parse_args()
+
+    if len(sys.argv[1:]) == 0:
+        parser.print_help()
+        sys.exit(1)
+
+    if args.queue_dir is None:
+        sys.exit("[ERROR] --queue_dir must be specified.")
+
+    Run(args)
+
+
+if __name__ == "__main__":
+    main()
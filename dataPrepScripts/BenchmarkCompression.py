@@ -0,0 +1,114 @@
+import sys
+import blosc
+import numpy as np
+from time import time
+from argparse import ArgumentParser
+
+import clair.utils as utils
+import shared.param as param
+
+ARRAY_INDEX = dict(x=1, y=2, pos=3)
+
+
+def sampled_blocks_from(bin_fn, array_name, no_of_blocks):
+    """
+    Decompressed blocks evenly spread over the bin, the last partial block excluded if others exist
+    """
+    arrays = utils.compressed_arrays_from(bin_fn)[ARRAY_INDEX[array_name]]
+    no_of_full_blocks = max(1, len(arrays) - 1)
+    indexes = np.unique(np.linspace(0, no_of_full_blocks - 1, min(no_of_blocks, no_of_full_blocks)).astype(int))
+    return [blosc.unpack_array(arrays[index]) for index in indexes]
+
+
+def benchmark(blocks, cname, clevel, shuffle, repeats):
+    """
+    Returns:
+        (compression ratio, compression MB/s, decompression MB/s), the best time of the repeats
+    """
+    no_of_bytes = sum(block.nbytes for block in blocks)
+    compress_time, decompress_time = float("inf"), float("inf")
+    for _ in range(repeats):
+        start_time = time()
+        packed_blocks = [utils.blosc_pack_array(block, cname=cname, clevel=clevel, shuffle=shuffle) for block in blocks]
+        compress_time = min(compress_time, time() - start_time)
+
+        start_time = time()
+        for packed_block in packed_blocks:
+            blosc.unpack_array(packed_block)
+        decompress_time = min(decompress_time, time() - start_time)
+
+    no_of_packed_bytes = sum(len(packed_block) for packed_block in packed_blocks)
+    megabytes = no_of_bytes / 1e6
+    return (
+        float(no_of_bytes) / no_of_packed_bytes,
+        megabytes / max(compress_time, 1e-9),
+        megabytes / max(decompress_time, 1e-9),
+    )
+
+
+def Run(args):
+    blosc.set_nthreads(args.threads)
+
+    blocks = sampled_blocks_from(args.bin_fn, args.array, args.no_of_blocks)
+    print("[INFO] Benchmarking %d %s blocks of %s, %.1f MB in total" % (
+        len(blocks), args.array, args.bin_fn, sum(block.nbytes for block in blocks) / 1e6
+    ), file=sys.stderr)
+
+    results = []
+    for cname in args.codecs:
+        for clevel in args.levels:
+            for shuffle in args.shuffles:
+                ratio, compress_speed, decompress_speed = benchmark(blocks, cname, clevel, shuffle, args.repeats)
+                results.append((cname, clevel, shuffle, ratio, compress_speed, decompress_speed))
+                print("[INFO] %s level %d %s done" % (cname, clevel, shuffle), file=sys.stderr)
+
+    print("%-8s %5s %-10s %8s %14s %16s" % ("codec", "level", "shuffle", "ratio", "compress MB/s", "decompress MB/s"))
+    for cname, clevel, shuffle, ratio, compress_speed, decompress_speed in sorted(results, key=lambda r: -r[3]):
+        is_default = (cname, clevel, shuffle) == (param.bloscCodec, param.bloscLevel, param.bloscShuffle)
+        print("%-8s %5d %-10s %8.2f %14.1f %16.1f%s" % (
+            cname, clevel, shuffle, ratio, compress_speed, decompress_speed, " (default)" if is_default else ""
+        ))
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark compression ratio and speed of blosc codecs on the blocks of a bin")
+
+    parser.add_argument('--bin_fn', type=str, default=None,
+                        help="Binary tensor input created by Tensor2Bin, REQUIRED")
+
+    parser.add_argument('--array', type=str, default="x", choices=sorted(ARRAY_INDEX.keys()),
+                        help="Array of the blocks to benchmark, default: %(default)s")
+
+    parser.add_argument('--no_of_blocks', type=int, default=100,
+                        help="Number of blocks sampled from the bin, default: %(default)s")
+
+    parser.add_argument('--codecs', type=str, nargs='+', default=utils.BLOSC_CODECS, choices=utils.BLOSC_CODECS,
+                        help="Blosc codecs to benchmark, default: all")
+
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 5, 9],
+                        help="Compression levels to benchmark, default: %(default)s")
+
+    parser.add_argument('--shuffles', type=str, nargs='+', default=sorted(utils.BLOSC_SHUFFLES.keys()),
+                        choices=sorted(utils.BLOSC_SHUFFLES.keys()),
+                        help="Byte or bit shuffles to benchmark, default: all")
+
+    parser.add_argument('--repeats', type=int, default=3,
+                        help="Repeats of each benchmark, the best time is reported, default: %(default)s")
+
+    parser.add_argument('--threads', type=int, default=1,
+                        help="Number of blosc threads, default: %(default)s")
+
+    args = parser.parse_args()
+
+    if len(sys.argv[1:]) == 0:
+        parser.print_help()
+        sys.exit(1)
+
+    if args.bin_fn is None:
+        sys.exit("[ERROR] --bin_fn must be specified.")
+
+    Run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,13 +3,13 @@ from __future__ import print_function
 import sys
 import os
 import logging
-import blosc
 import numpy as np
 from argparse import ArgumentParser
 from threading import Thread
 
 import clair.utils as utils
 import shared.param as param
+from clair.positions import position_strings_from
 
 logging.basicConfig(format='%(message)s', level=logging.INFO)
 
@@ -47,18 +47,23 @@ def new_mini_batch(
     elif is_validation:
         batch_size = validation_batch_size
 
-    def decompress_array_from(array):
+    def decompress_array_from(array, rows_from=None):
         return utils.decompress_array(
             array=array,
             blosc_start_index=blosc_start_index,
             first_blosc_block_data_index=first_blosc_block_data_index,
             no_of_data_rows_to_retrieve=batch_size,
             no_of_blosc_blocks=no_of_blosc_blocks,
-            read_index_list=tensor_block_index_list
+            read_index_list=tensor_block_index_list,
+            rows_from=rows_from
         )
-    x_batch, next_x_first_blosc_block_data_index, next_x_blosc_index = decompress_array_from(x_array_compressed)
-    y_batch, _next_y_first_blosc_block_data_index, next_y_blosc_index = decompress_array_from(y_array_compressed)
+    x_batch, next_x_first_blosc_block_data_index, next_x_blosc_index = \
+        decompress_array_from(x_array_compressed, utils.input_tensors_from)
+    y_batch, _next_y_first_blosc_block_data_index, next_y_blosc_index = \
+        decompress_array_from(y_array_compressed, utils.output_labels_from)
     pos_batch, _, _ = decompress_array_from(position_array_compressed)
+    if pos_batch is not None:
+        pos_batch = position_strings_from(pos_batch, dataset_info.contig_names)
 
     x_batch_size, y_batch_size = np.shape(x_batch)[0], np.shape(y_batch)[0]
     x_end_flag, y_end_flag = next_x_blosc_index == -1, next_y_blosc_index == -1
@@ -69,6 +74,22 @@ def new_mini_batch(
     # return x_batch, y_batch, None, next_x_first_blosc_block_data_index, next_x_blosc_index
 
 
+def print_examples(x_batch, y_batch, pos_batch):
+    for x_tensor, y_tensor, pos in zip(x_batch, y_batch, pos_batch):
+        x_array = ["%d" % int(x_float) for x_float in list(x_tensor.flatten())]
+        y_array = ["%d" % y_number for y_number in list(y_tensor.flatten())]
+
+        print(" ".join(x_array))    # print x_array
+        print(" ".join(y_array))    # print y_array
+        print(pos)                  # print pos
+
+
+def load_examples_in_region(dataset_info, region_index, contig_name, start, end):
+    examples = utils.examples_in_region_from(dataset_info, region_index, contig_name, start, end)
+    for x_batch, y_batch, pos_batch in examples:
+        print_examples(x_batch, y_batch, position_strings_from(pos_batch, dataset_info.contig_names))
+
+
 def load_model(dataset_info):
     dataset_size = dataset_info.dataset_size
 
@@ -94,13 +115,7 @@ def load_model(dataset_info):
 
         thread_pool = []
         if is_with_batch_data:
-            for x_tensor, y_tensor, pos in zip(x_batch, y_batch, pos_batch):
-                x_array = ["%d" % int(x_float) for x_float in list(x_tensor.flatten())]
-                y_array = ["%d" % y_number for y_number in list(y_tensor.flatten())]
-
-                print(" ".join(x_array))    # print x_array
-                print(" ".join(y_array))    # print y_array
-                print(pos)                  # print pos
+            print_examples(x_batch, y_batch, pos_batch)
         for t in thread_pool:
             t.start()
 
@@ -140,7 +155,7 @@ def load_model(dataset_info):
         break
 
 
-def export_model(binary_file_path):
+def export_model(binary_file_path, block_packer):
     try:
         import cPickle as pickle
     except:
@@ -149,14 +164,17 @@ def export_model(binary_file_path):
     def pickle_dump(obj, file):
         return pickle.dump(obj, file, protocol=pickle.HIGHEST_PROTOCOL)
 
-    def blosc_pack_array(array):
-        return blosc.pack_array(array, cname='lz4hc', clevel=9, shuffle=blosc.NOSHUFFLE)
-
     row_index = 0
     x_compressed = []
     y_compressed = []
     pos_compressed = []
 
+    def append_compressed(finished_blocks):
+        for (x_blob, y_blob, pos_blob), _ in finished_blocks:
+            x_compressed.append(x_blob)
+            y_compressed.append(y_blob)
+            pos_compressed.append(pos_blob)
+
     total = 0
     x = []
     y = []
@@ -179,20 +197,17 @@ def export_model(binary_file_path):
         row_index %= 3
 
         if total % param.bloscBlockSize == 0 and row_index == 0:
-            x_compressed.append(blosc_pack_array(np.array(x).reshape(-1, 33, 8, 4)))
-            y_compressed.append(blosc_pack_array(np.array(y)))
-            pos_compressed.append(blosc_pack_array(np.array(pos)))
+            append_compressed(block_packer.put([np.array(x).reshape(-1, 33, 8, 4), np.array(y), np.array(pos)]))
             x, y, pos = [], [], []
 
             if total % 5000 == 0:
                 logging.error("[INFO] Processed %d tensors" % total)
 
     if len(x) > 0:
-        x_compressed.append(blosc_pack_array(np.array(x).reshape(-1, 33, 8, 4)))
-        y_compressed.append(blosc_pack_array(np.array(y)))
-        pos_compressed.append(blosc_pack_array(np.array(pos)))
+        append_compressed(block_packer.put([np.array(x).reshape(-1, 33, 8, 4), np.array(y), np.array(pos)]))
         x, y, pos = [], [], []
         logging.error("[INFO] Processed %d tensors" % total)
+    append_compressed(block_packer.close())
 
     logging.error("[INFO] Writing to binary ...")
     with open(binary_file_path, 'wb') as f:
@@ -211,6 +226,27 @@ def main():
     parser.add_argument('--bin_fn', type=str, default=None,
                         help="If --is_export enabled, this is the export bin file path. If --is_export not enabled, this is the import bin file path")
 
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of processes compressing blocks if --is_export enabled, default: %(default)s")
+
+    parser.add_argument('--blosc_codec', type=str, default=param.bloscCodec, choices=utils.BLOSC_CODECS,
+                        help="Blosc codec of the blocks if --is_export enabled, default: %(default)s")
+
+    parser.add_argument('--blosc_level', type=int, default=param.bloscLevel,
+                        help="Blosc compression level of the blocks if --is_export enabled, 0-9, default: %(default)s")
+
+    parser.add_argument('--blosc_shuffle', type=str, default=param.bloscShuffle, choices=sorted(utils.BLOSC_SHUFFLES.keys()),
+                        help="Blosc byte or bit shuffle of the blocks if --is_export enabled, default: %(default)s")
+
+    parser.add_argument('--ctgName', type=str, default=None,
+                        help="Import only the examples on this sequence, found by the region index of the bin, optional")
+
+    parser.add_argument('--ctgStart', type=int, default=None,
+                        help="The 1-based starting position of the examples imported with --ctgName, optional")
+
+    parser.add_argument('--ctgEnd', type=int, default=None,
+                        help="The 1-based inclusive ending position of the examples imported with --ctgName, optional")
+
     args = parser.parse_args()
 
     if len(sys.argv[1:]) == 0:
@@ -221,7 +257,15 @@ def main():
     logging.error("[INFO] Initializing")
 
     if args.is_export:
-        export_model(binary_file_path=args.bin_fn)
+        export_model(binary_file_path=args.bin_fn, block_packer=utils.BlockPacker(
+            workers=args.workers, cname=args.blosc_codec, clevel=args.blosc_level, shuffle=args.blosc_shuffle
+        ))
+    elif args.ctgName is not None:
+        utils.setup_environment()
+        dataset_info = utils.dataset_info_from(binary_file_path=args.bin_fn)
+        load_examples_in_region(
+            dataset_info, utils.region_index_from(dataset_info, args.bin_fn), args.ctgName, args.ctgStart, args.ctgEnd
+        )
     else:
         utils.setup_environment()
         load_model(utils.dataset_info_from(binary_file_path=args.bin_fn))
@@ -1,10 +1,26 @@
 import os
 import pickle
+import shutil
+import tempfile
+import blosc
+import numpy as np
 from random import shuffle
 from argparse import ArgumentParser
 from collections import namedtuple
 
-Data = namedtuple('Data', ['x', 'y', 'pos', 'total'])
+import shared.param as param
+from clair.bin_builder import BIN_FORMAT_PICKLE, BIN_FORMAT_MMAP, bin_writer_from
+from clair.dataset import Dataset, DatasetWriter, is_dataset_file, X_BLOB, Y_BLOB, POSITION_BLOB
+from clair.positions import (
+    REGION_INDEX_SUFFIX,
+    ContigTable,
+    remapped_position_rows_from,
+    region_index_file_path_from,
+    region_index_from_position_blocks,
+)
+from clair.utils import blosc_pack_array
+
+Data = namedtuple('Data', ['x', 'y', 'pos', 'no_of_rows', 'contig_names'])
 
 
 def process_command():
@@ -25,78 +41,161 @@ def process_command():
         '--shuffle_data', type=bool, default=False,
         help="Shuffle data after loaded all data. (default: %(default)s)"
     )
+    parser.add_argument(
+        '--format', type=str, default=BIN_FORMAT_MMAP, choices=[BIN_FORMAT_PICKLE, BIN_FORMAT_MMAP],
+        help="Format of the large bin, mmap: with a block index, read through mmap. (default: %(default)s)"
+    )
+    parser.add_argument(
+        '--interleave', action='store_true',
+        help="Interleave blocks of the small bins in a random order, in proportion to their sizes. (default: False)"
+    )
 
     return parser.parse_args()
 
 
 def load_data_from_one_file_path(file_path):
-    X = []
-    Y = []
-    pos = []
-    total = 0
+    """
+    Compressed blocks of a bin and the number of rows in each, not decompressed except the position blocks of a
+    pickled bin, which carries no row counts
+    """
+    if is_dataset_file(file_path):
+        dataset = Dataset(file_path)
+        return Data(
+            x=dataset.blocks_of(X_BLOB),
+            y=dataset.blocks_of(Y_BLOB),
+            pos=dataset.blocks_of(POSITION_BLOB),
+            no_of_rows=[int(no_of_rows) for no_of_rows in dataset.no_of_rows_in_blocks],
+            contig_names=dataset.contig_names,
+        )
 
     with open(file_path, "rb") as f:
         total = int(pickle.load(f))
         X = pickle.load(f)
         Y = pickle.load(f)
         pos = pickle.load(f)
-
-    return Data(x=X, y=Y, pos=pos, total=total)
-
-
-def load_data_from(directory_path, need_shuffle_file_paths=False):
-    X = []
-    Y = []
-    pos = []
-    total = 0
-
-    file_paths = os.listdir(directory_path)
+        try:
+            contig_names = pickle.load(f)
+        except EOFError:
+            contig_names = None
+    no_of_rows = [len(blosc.unpack_array(pos_blob)) for pos_blob in pos]
+    if sum(no_of_rows) != total:
+        raise ValueError("%s has %d rows in its blocks, %d expected" % (file_path, sum(no_of_rows), total))
+
+    return Data(x=X, y=Y, pos=pos, no_of_rows=no_of_rows, contig_names=contig_names)
+
+
+def indexed_data_from(file_path, temporary_directory):
+    """
+    Open a bin for random access of its blocks, a pickled bin is copied to a temporary dataset file
+    """
+    if is_dataset_file(file_path):
+        return load_data_from_one_file_path(file_path)
+
+    data = load_data_from_one_file_path(file_path)
+    dataset_file_path = os.path.join(temporary_directory, "%s.dataset" % (os.path.basename(file_path)))
+    dataset_writer = DatasetWriter(dataset_file_path, param.bloscBlockSize)
+    for i in range(len(data.x)):
+        dataset_writer.add_block(data.x[i], data.y[i], data.pos[i], data.no_of_rows[i])
+    dataset_writer.close(data.contig_names)
+    del data
+    return load_data_from_one_file_path(dataset_file_path)
+
+
+def input_file_paths_from(directory_path, need_shuffle_file_paths=False):
+    file_paths = [file_path for file_path in os.listdir(directory_path) if not file_path.endswith(REGION_INDEX_SUFFIX)]
     file_paths.sort()
     if need_shuffle_file_paths:
         shuffle(file_paths)
 
-    absolute_file_paths = []
-    for file_path in file_paths:
-        absolute_file_paths.append(os.path.abspath(os.path.join(directory_path, file_path)))
-
+    return [os.path.abspath(os.path.join(directory_path, file_path)) for file_path in file_paths]
+
+
+class CombinedBinWriter(object):
+    """
+    Copy blocks of the small bins to the bin writer of the large bin. Position blocks are copied as they are if the
+    contig ids of a small bin are the same in the large bin, else decompressed and remapped, and kept for the region
+    index.
+    """
+
+    def __init__(self, bin_writer):
+        self.bin_writer = bin_writer
+        self.contig_table = ContigTable()
+        self.position_blobs = []
+
+    def is_same_contig_ids(self, contig_names):
+        if contig_names is None:
+            return False
+        return [self.contig_table.id_of(name) for name in contig_names] == list(range(len(contig_names)))
+
+    def copy_blocks(self, data, block_indexes):
+        is_position_remapped = not self.is_same_contig_ids(data.contig_names)
+        for i in block_indexes:
+            position_blob = data.pos[i]
+            if is_position_remapped:
+                position_blob = blosc_pack_array(
+                    remapped_position_rows_from(blosc.unpack_array(position_blob), data.contig_names, self.contig_table)
+                )
+            self.bin_writer.add_block(data.x[i], data.y[i], position_blob, data.no_of_rows[i])
+            self.position_blobs.append(bytes(position_blob))
+
+    def close(self, bin_fn):
+        total = self.bin_writer.close(self.contig_table.names)
+        region_index_from_position_blocks(self.position_blobs, self.contig_table.names).write(
+            region_index_file_path_from(bin_fn)
+        )
+        return total
+
+
+def combine_sequentially(absolute_file_paths, bin_writer):
+    """
+    Copy the blocks of one small bin after another, holding at most one small bin in memory
+    """
     for absolute_file_path in absolute_file_paths:
         data = load_data_from_one_file_path(absolute_file_path)
-
-        total += data.total
-        X += data.x
-        Y += data.y
-        pos += data.pos
-
-        print("[INFO] Data loaded: {}".format(absolute_file_path))
-
-    return Data(x=X, y=Y, pos=pos, total=total)
+        bin_writer.copy_blocks(data, range(len(data.x)))
+        del data
+        print("[INFO] Data copied: {}".format(absolute_file_path))
 
 
-def pickle_dump(obj, file):
-    return pickle.dump(obj, file, protocol=pickle.HIGHEST_PROTOCOL)
-
+def combine_interleaved(absolute_file_paths, bin_writer, temporary_directory):
+    """
+    Copy blocks from all small bins in a random order, blocks of each small bin stay in their order
+    """
+    all_data = []
+    for absolute_file_path in absolute_file_paths:
+        all_data.append(indexed_data_from(absolute_file_path, temporary_directory))
+        print("[INFO] Data indexed: {}".format(absolute_file_path))
 
-def output_data(dst, data):
-    print("[INFO] Output: {}".format(os.path.abspath(dst)))
-    with open(dst, "wb") as f:
-        pickle_dump(data.total, f)
-        pickle_dump(data.x, f)
-        pickle_dump(data.y, f)
-        pickle_dump(data.pos, f)
+    data_indexes = np.repeat(np.arange(len(all_data)), [len(data.x) for data in all_data])
+    np.random.shuffle(data_indexes)
+    next_block_indexes = [0] * len(all_data)
+    for data_index in data_indexes:
+        bin_writer.copy_blocks(all_data[data_index], [next_block_indexes[data_index]])
+        next_block_indexes[data_index] += 1
 
 
 def main():
     args = process_command()
 
-    data = load_data_from(
+    absolute_file_paths = input_file_paths_from(
         directory_path=args.src,
         need_shuffle_file_paths=args.shuffle_data
     )
-
-    output_data(
-        dst=os.path.join(args.dst, args.bin_name),
-        data=data
-    )
+    dst = os.path.join(args.dst, args.bin_name)
+    absolute_file_paths = [file_path for file_path in absolute_file_paths if file_path != os.path.abspath(dst)]
+
+    temporary_directory = tempfile.mkdtemp(prefix="combine_bins.", dir=args.dst)
+    try:
+        bin_writer = CombinedBinWriter(bin_writer_from(dst, args.format, temporary_directory))
+        if args.interleave:
+            combine_interleaved(absolute_file_paths, bin_writer, temporary_directory)
+        else:
+            combine_sequentially(absolute_file_paths, bin_writer)
+        total = bin_writer.close(dst)
+    finally:
+        shutil.rmtree(temporary_directory, ignore_errors=True)
+
+    print("[INFO] Output: {}, {} tensors".format(os.path.abspath(dst), total))
 
 
 if __name__ == "__main__":
@@ -8,6 +8,7 @@ from collections import namedtuple
 
 import shared.param as param
 from shared.utils import subprocess_popen, IUPAC_base_to_num_dict as BASE2NUM
+from shared.chunk_progress import ChunkProgress, CREATE_TENSOR_STAGE
 
 is_pypy = '__pypy__' in sys.builtin_module_names
 
@@ -71,7 +72,8 @@ def candidate_position_generator_from(
     ctg_end,
     is_consider_left_edge,
     flanking_base_num,
-    begin_to_end
+    begin_to_end,
+    chunk_progress=None
 ):
     is_read_file_from_standard_input = candidate_file_path == "PIPE"
     if is_read_file_from_standard_input:
@@ -89,6 +91,10 @@ def candidate_position_generator_from(
         if is_ctg_region_provided and not (ctg_start <= position <= ctg_end):
             continue
 
+        # the chunk is split by the parallel runner, candidates beyond the new end are called by another job
+        if chunk_progress is not None and chunk_progress.split_end is not None and position > chunk_progress.split_end:
+            continue
+
         if is_consider_left_edge:
             # i is 0-based
             for i in range(position - (flanking_base_num + 1), position + (flanking_base_num + 1)):
@@ -176,8 +182,30 @@ def samtools_view_process_from(
     )
 
 
+def split_chunk_at(chunk_progress, split_end, ctg_start, ctg_end, max_output_center, begin_to_end, center_to_alignment):
+    """
+    Accept the new end requested by the parallel runner if no tensor beyond it has been output,
+    and drop the candidates beyond it, which will be called by another job
+    """
+    is_valid_split_end = (
+        ctg_start is not None and ctg_end is not None and
+        max(ctg_start, max_output_center) <= split_end < ctg_end
+    )
+    if not is_valid_split_end:
+        chunk_progress.reject_split()
+        return
+
+    chunk_progress.accept_split(split_end)
+    for begin in list(begin_to_end.keys()):
+        begin_to_end[begin] = [(end, center) for end, center in begin_to_end[begin] if center <= split_end]
+        if len(begin_to_end[begin]) == 0:
+            del begin_to_end[begin]
+    for center in [center for center in center_to_alignment if center > split_end]:
+        del center_to_alignment[center]
+
+
 def OutputAlnTensor(args):
-    available_slots = 5000000
+    available_slots = args.max_slots
     samtools = args.samtools
     tensor_file_path = args.tensor_fn
     bam_file_path = args.bam_fn
@@ -190,6 +218,7 @@ def OutputAlnTensor(args):
     ctg_name = args.ctgName
     ctg_start = args.ctgStart
     ctg_end = args.ctgEnd
+    chunk_progress = ChunkProgress(args.progress_prefix) if args.progress_prefix is not None else None
 
     reference_result = reference_result_from(
         ctg_name=ctg_name,
@@ -221,7 +250,8 @@ def OutputAlnTensor(args):
         ctg_end=ctg_end,
         is_consider_left_edge=is_consider_left_edge,
         flanking_base_num=param.flankingBaseNum,
-        begin_to_end=begin_to_end
+        begin_to_end=begin_to_end,
+        chunk_progress=chunk_progress
     )
 
     samtools_view_process = samtools_view_process_from(
@@ -242,6 +272,7 @@ def OutputAlnTensor(args):
 
     previous_position = 0
     depthCap = 0
+    max_output_center = 0
     for l in samtools_view_process.stdout:
         l = l.split()
         if l[0][0] == "@":
@@ -259,6 +290,17 @@ def OutputAlnTensor(args):
         if MQ < minimum_mapping_quality:
             continue
 
+        if chunk_progress is not None:
+            chunk_progress.report(CREATE_TENSOR_STAGE, max_output_center)
+            split_end = chunk_progress.split_request()
+            if split_end is not None:
+                split_chunk_at(
+                    chunk_progress, split_end, ctg_start, ctg_end, max_output_center, begin_to_end, center_to_alignment
+                )
+            # reads starting beyond the flanking region of the new end do not contribute to any tensor
+            if chunk_progress.split_end is not None and POS > chunk_progress.split_end + no_of_positions:
+                break
+
         end_to_center = {}
         active_set = set()
 
@@ -374,6 +416,7 @@ def OutputAlnTensor(args):
                 if l != None:
                     tensor_fp.stdin.write(l)
                     tensor_fp.stdin.write("\n")
+                    max_output_center = max(max_output_center, center)
                 available_slots += sum(len(i) for i in center_to_alignment[center])
                 #print >> sys.stderr, "POS %d: remaining slots %d" % (center, available_slots)
                 del center_to_alignment[center]
@@ -386,6 +429,8 @@ def OutputAlnTensor(args):
             tensor_fp.stdin.write(l)
             tensor_fp.stdin.write("\n")
 
+    if chunk_progress is not None and chunk_progress.split_end is not None:
+        samtools_view_process.kill()
     samtools_view_process.stdout.close()
     samtools_view_process.wait()
     if tensor_file_path != "PIPE":
@@ -434,6 +479,12 @@ def main():
     parser.add_argument('--minCoverage', type=int, default=0,
                         help="Minimum coverage required to generate a tensor, default: %(default)d")
 
+    parser.add_argument('--max_slots', type=int, default=param.maxTensorSlots,
+                        help="Maximum number of alignment bases held for the tensors not yet output, bounds the memory use, default: %(default)d")
+
+    parser.add_argument('--progress_prefix', type=str, default=None,
+                        help="Report progress and memory use to, and accept chunk splits from the parallel runner through files with this prefix, optional")
+
     args = parser.parse_args()
 
     if len(sys.argv[1:]) == 0:
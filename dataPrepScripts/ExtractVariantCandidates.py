@@ -12,6 +12,7 @@ from collections import defaultdict
 import shared.param as param
 from shared.utils import subprocess_popen, IUPAC_base_to_ACGT_base_dict as BASE2ACGT
 from shared.interval_tree import bed_tree_from, is_region_in
+from shared.chunk_progress import ChunkProgress, EXTRACT_VARIANT_CANDIDATES_STAGE
 
 is_pypy = '__pypy__' in sys.builtin_module_names
 
@@ -187,6 +188,7 @@ def make_candidates(args):
     bam_file_path = args.bam_fn
     candidate_output_path = args.can_fn
     is_using_stdout_for_output_candidate = candidate_output_path == "PIPE"
+    chunk_progress = ChunkProgress(args.progress_prefix) if args.progress_prefix is not None else None
 
     is_building_training_dataset = gen4Training == True
     is_variant_file_given = variant_file_path is not None
@@ -316,6 +318,15 @@ def make_candidates(args):
                 # reset advance
                 advance = 0
 
+            if chunk_progress is not None:
+                chunk_progress.report(EXTRACT_VARIANT_CANDIDATES_STAGE, POS + 1)
+                # follow the new end once CreateTensor accepted the split
+                split_end = chunk_progress.accepted_split_end()
+                if split_end is not None and is_ctg_range_given and split_end < ctg_end:
+                    ctg_end = split_end
+                if split_end is not None and is_ctg_range_given and POS > ctg_end + 1:
+                    is_finish_reading_output = True
+
         positions = [x for x in pileup.keys() if x < POS] if not is_finish_reading_output else list(pileup.keys())
         positions.sort()
         for zero_based_position in positions:
@@ -389,6 +400,8 @@ def make_candidates(args):
         print("# of candidates near variant: ", no_of_candidates_near_variant)
         print("# of candidates outside variant: ", no_of_candidates_outside_variant)
 
+    if chunk_progress is not None and chunk_progress.split_end is not None:
+        samtools_view_process.kill()
     samtools_view_process.stdout.close()
     samtools_view_process.wait()
 
@@ -454,6 +467,9 @@ def main():
     parser.add_argument('--samtools', type=str, default="samtools",
                         help="Path to the 'samtools', default: %(default)s")
 
+    parser.add_argument('--progress_prefix', type=str, default=None,
+                        help="Report progress and memory use to, and follow chunk splits from the parallel runner through files with this prefix, optional")
+
     args = parser.parse_args()
 
     if len(sys.argv[1:]) == 0:
@@ -4,6 +4,10 @@ import pickle
 from argparse import ArgumentParser
 
 import clair.utils as utils
+import shared.param as param
+from clair.bin_builder import BIN_FORMAT_PICKLE, BIN_FORMAT_MMAP
+from clair.dataset import DatasetWriter
+from clair.positions import ContigTable, region_index_file_path_from, region_index_from_position_blocks
 
 logging.basicConfig(format='%(message)s', level=logging.INFO)
 
@@ -15,22 +19,64 @@ def pickle_dump(obj, file):
 def Run(args):
     utils.setup_environment()
 
+    # started before the dataset is loaded, so that the forked workers stay small
+    block_packer = utils.BlockPacker(
+        workers=args.workers, cname=args.blosc_codec, clevel=args.blosc_level, shuffle=args.blosc_shuffle
+    )
+
+    if args.streaming:
+        from clair.bin_builder import build_bin_streaming
+        logging.info("Building the binary in %d buckets ..." % (args.buckets))
+        total = build_bin_streaming(
+            tensor_fn=args.tensor_fn,
+            var_fn=args.var_fn,
+            bed_fn=args.bed_fn,
+            bin_fn=args.bin_fn,
+            shuffle=args.shuffle,
+            is_allow_duplicate_chr_pos=args.allow_duplicate_chr_pos,
+            no_of_buckets=args.buckets,
+            temporary_directory=args.temp_dir,
+            bin_format=args.format,
+            block_packer=block_packer,
+            tensor_dtype=utils.TENSOR_DTYPES[args.tensor_dtype],
+            label_format=args.label_format,
+        )
+        logging.info("Wrote %d tensors to binary" % (total))
+        return
+
     logging.info("Loading the dataset ...")
+    contig_table = ContigTable()
     total, XArrayCompressed, YArrayCompressed, posArrayCompressed = \
         utils.get_training_array(
             tensor_fn=args.tensor_fn,
             var_fn=args.var_fn,
             bed_fn=args.bed_fn,
             shuffle=args.shuffle,
-            is_allow_duplicate_chr_pos=args.allow_duplicate_chr_pos
+            is_allow_duplicate_chr_pos=args.allow_duplicate_chr_pos,
+            block_packer=block_packer,
+            tensor_dtype=utils.TENSOR_DTYPES[args.tensor_dtype],
+            label_format=args.label_format,
+            contig_table=contig_table,
         )
 
     logging.info("Writing to binary ...")
-    with open(args.bin_fn, 'wb') as fh:
-        pickle_dump(total, fh)
-        pickle_dump(XArrayCompressed, fh)
-        pickle_dump(YArrayCompressed, fh)
-        pickle_dump(posArrayCompressed, fh)
+    if args.format == BIN_FORMAT_MMAP:
+        dataset_writer = DatasetWriter(args.bin_fn, param.bloscBlockSize)
+        for i in range(len(XArrayCompressed)):
+            no_of_rows = min(param.bloscBlockSize, total - i * param.bloscBlockSize)
+            dataset_writer.add_block(XArrayCompressed[i], YArrayCompressed[i], posArrayCompressed[i], no_of_rows)
+        dataset_writer.close(contig_table.names)
+    else:
+        with open(args.bin_fn, 'wb') as fh:
+            pickle_dump(total, fh)
+            pickle_dump(XArrayCompressed, fh)
+            pickle_dump(YArrayCompressed, fh)
+            pickle_dump(posArrayCompressed, fh)
+            pickle_dump(contig_table.names, fh)
+
+    region_index_from_position_blocks(posArrayCompressed, contig_table.names).write(
+        region_index_file_path_from(args.bin_fn)
+    )
 
 
 def main():
@@ -54,12 +100,47 @@ def main():
     parser.add_argument('--allow_duplicate_chr_pos', action='store_true',
                         help="Allow duplicate chromosome:position in tensor input")
 
+    parser.add_argument('--format', type=str, default=BIN_FORMAT_PICKLE, choices=[BIN_FORMAT_PICKLE, BIN_FORMAT_MMAP],
+                        help="Binary format, pickle: pickled lists of blocks, mmap: a block-indexed file read through mmap without loading, default: %(default)s")
+
+    parser.add_argument('--streaming', action='store_true',
+                        help="Build the binary in two passes over temporary bucket files, memory bounded by the bucket size instead of the dataset size, optional")
+
+    parser.add_argument('--buckets', type=int, default=256,
+                        help="Number of buckets with --streaming, each bucket takes about (no. of tensors / buckets) * 4.2 KB of memory, default: %(default)s")
+
+    parser.add_argument('--temp_dir', type=str, default=None,
+                        help="Directory for the bucket files with --streaming, needs about the uncompressed dataset size of space, default: the directory of --bin_fn")
+
+    parser.add_argument('--tensor_dtype', type=str, default="float32", choices=sorted(utils.TENSOR_DTYPES.keys()),
+                        help="Dtype of the stored tensors, int16 / uint8: raw counts (uint8 saturated at 255), 2-4x smaller, the reference channel is subtracted when loaded, default: %(default)s")
+
+    parser.add_argument('--label_format', type=str, default=utils.LABEL_FORMAT_INDEX, choices=utils.LABEL_FORMATS,
+                        help="Labels stored, index: the class index of each task, expanded to one-hot when loaded, one_hot: one-hot vectors as read by older versions, default: %(default)s")
+
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of processes compressing blocks, default: %(default)s")
+
+    parser.add_argument('--blosc_codec', type=str, default=param.bloscCodec, choices=utils.BLOSC_CODECS,
+                        help="Blosc codec of the blocks, default: %(default)s")
+
+    parser.add_argument('--blosc_level', type=int, default=param.bloscLevel,
+                        help="Blosc compression level of the blocks, 0-9, default: %(default)s")
+
+    parser.add_argument('--blosc_shuffle', type=str, default=param.bloscShuffle, choices=sorted(utils.BLOSC_SHUFFLES.keys()),
+                        help="Blosc byte or bit shuffle of the blocks, see BenchmarkCompression, default: %(default)s")
+
     args = parser.parse_args()
 
     if len(sys.argv[1:]) == 0:
         parser.print_help()
         sys.exit(1)
 
+    if args.streaming and args.buckets <= 0:
+        sys.exit("[ERROR] --buckets must be a positive integer.")
+    if args.workers <= 0 or not 0 <= args.blosc_level <= 9:
+        sys.exit("[ERROR] --workers must be a positive integer and --blosc_level between 0 and 9.")
+
     Run(args)
 
 
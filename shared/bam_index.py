@@ -0,0 +1,155 @@
+import gzip
+import struct
+from sys import exit
+from os.path import isfile
+
+BAI_MAGIC = b"BAI\1"
+CSI_MAGIC = b"CSI\1"
+BAM_MAGIC = b"BAM\1"
+BAI_MIN_SHIFT = 14
+BAI_DEPTH = 5
+
+# for chunks within a single BGZF block, the uncompressed span is scaled down to estimate the compressed bytes
+ESTIMATED_BGZF_COMPRESSION_RATIO = 3.0
+
+# alignments in bins larger than this number of windows (e.g. 64 windows, 1 Mbp in BAI) span bin boundaries
+# at least this far apart, they are counted in the work estimates but not used for deciding whether a window is empty
+OCCUPANCY_MAX_BIN_WINDOWS = 1 << 6
+
+
+def first_bin_of_level(level):
+    return ((1 << (3 * level)) - 1) // 7
+
+
+def bin_level_from(bin_number, depth):
+    for level in range(depth + 1):
+        if bin_number < first_bin_of_level(level + 1):
+            return level
+    return None
+
+
+def compressed_size_from(begin_virtual_offset, end_virtual_offset):
+    begin_block_offset, end_block_offset = begin_virtual_offset >> 16, end_virtual_offset >> 16
+    if end_block_offset > begin_block_offset:
+        return end_block_offset - begin_block_offset
+    uncompressed_size = (end_virtual_offset & 0xFFFF) - (begin_virtual_offset & 0xFFFF)
+    return max(uncompressed_size, 1) / ESTIMATED_BGZF_COMPRESSION_RATIO
+
+
+def reference_names_from_bam(bam_file_path):
+    """
+    Read the reference sequence names in order from the BAM header, which the indices refer to by id
+    """
+    with gzip.open(bam_file_path, "rb") as f:
+        magic, l_text = struct.unpack("<4si", f.read(8))
+        if magic != BAM_MAGIC:
+            raise ValueError("%s is not a BAM file" % (bam_file_path))
+        f.read(l_text)
+        n_ref, = struct.unpack("<i", f.read(4))
+        reference_names = []
+        for _ in range(n_ref):
+            l_name, = struct.unpack("<i", f.read(4))
+            reference_names.append(f.read(l_name).rstrip(b"\0").decode())
+            f.read(4)
+    return reference_names
+
+
+def index_file_path_from(bam_file_path):
+    index_file_paths = [bam_file_path + ".bai", bam_file_path + ".csi"]
+    if bam_file_path.endswith(".bam"):
+        index_file_paths.append(bam_file_path[:-4] + ".bai")
+    for index_file_path in index_file_paths:
+        if isfile(index_file_path):
+            return index_file_path
+    return None
+
+
+class BamIndex(object):
+    """
+    Per-bin compressed alignment sizes read from a BAI or CSI index, for estimating the work of calling a region
+    Arguments:
+        index_file_path: the .bai or .csi file
+        reference_names: reference sequence names in order of the BAM header
+    """
+
+    def __init__(self, index_file_path, reference_names):
+        with open(index_file_path, "rb") as f:
+            data = f.read()
+        if data[:4] == BAI_MAGIC:
+            self.min_shift, self.depth = BAI_MIN_SHIFT, BAI_DEPTH
+            offset = 4
+        else:
+            # CSI is BGZF compressed
+            data = gzip.decompress(data)
+            if data[:4] != CSI_MAGIC:
+                raise ValueError("%s is neither a BAI nor CSI index" % (index_file_path))
+            self.min_shift, self.depth, l_aux = struct.unpack_from("<iii", data, 4)
+            offset = 16 + l_aux
+        is_csi = data[:4] == CSI_MAGIC
+
+        n_ref, = struct.unpack_from("<i", data, offset)
+        offset += 4
+        self.bin_sizes = {}
+        for reference_id in range(n_ref):
+            bin_sizes = {}
+            n_bin, = struct.unpack_from("<i", data, offset)
+            offset += 4
+            for _ in range(n_bin):
+                if is_csi:
+                    bin_number, _, n_chunk = struct.unpack_from("<IQi", data, offset)
+                    offset += 16
+                else:
+                    bin_number, n_chunk = struct.unpack_from("<Ii", data, offset)
+                    offset += 8
+                chunks = struct.unpack_from("<%dQ" % (2 * n_chunk), data, offset)
+                offset += 16 * n_chunk
+
+                # skip the pseudo bin with the mapped / unmapped read counts
+                if bin_number >= first_bin_of_level(self.depth + 1):
+                    continue
+                bin_sizes[bin_number] = sum(
+                    compressed_size_from(chunks[i], chunks[i + 1]) for i in range(0, len(chunks), 2)
+                )
+            if not is_csi:
+                n_intv, = struct.unpack_from("<i", data, offset)
+                offset += 4 + 8 * n_intv
+            if reference_id < len(reference_names):
+                self.bin_sizes[reference_names[reference_id]] = bin_sizes
+
+        self.window_size = 1 << self.min_shift
+
+    @staticmethod
+    def from_bam(bam_file_path, exit_on_not_found=False):
+        index_file_path = index_file_path_from(bam_file_path)
+        if index_file_path is None:
+            if exit_on_not_found:
+                exit("[ERROR] index (.bai or .csi) of %s not found" % (bam_file_path))
+            return None
+        return BamIndex(index_file_path, reference_names_from_bam(bam_file_path))
+
+    def window_work_from(self, contig_name, contig_length):
+        """
+        Spread the compressed size of each bin evenly over the windows it covers
+        Returns:
+            (estimated work per window, whether each window has alignments), windows of self.window_size from position 0
+        """
+        no_of_windows = (contig_length + self.window_size - 1) // self.window_size
+        work = [0.0] * no_of_windows
+        is_occupied = [False] * no_of_windows
+
+        for bin_number, size in self.bin_sizes.get(contig_name, {}).items():
+            level = bin_level_from(bin_number, self.depth)
+            bin_windows = 1 << (3 * (self.depth - level))
+            first_window = (bin_number - first_bin_of_level(level)) * bin_windows
+            last_window = min(first_window + bin_windows, no_of_windows)
+            if first_window >= last_window or size <= 0:
+                continue
+
+            size_per_window = float(size) / (last_window - first_window)
+            for window in range(first_window, last_window):
+                work[window] += size_per_window
+            if bin_windows <= OCCUPANCY_MAX_BIN_WINDOWS:
+                for window in range(first_window, last_window):
+                    is_occupied[window] = True
+
+        return work, is_occupied
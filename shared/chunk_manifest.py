@@ -0,0 +1,78 @@
+import os
+import json
+import hashlib
+from collections import OrderedDict
+
+from shared.utils import write_atomically
+
+MANIFEST_VERSION = 1
+
+CHUNK_PENDING = "pending"
+CHUNK_RUNNING = "running"
+CHUNK_DONE = "done"
+CHUNK_FAILED = "failed"
+
+
+def parameters_hash_from(parameters_string):
+    return hashlib.sha256(parameters_string.encode()).hexdigest()
+
+
+class ChunkManifest(object):
+    """
+    The chunks of a callVarBamParallel run and their status, saved atomically to a JSON file on every update
+    A chunk is done only if its VCF exists, which callVarBam renames into place after all stages succeeded
+    Arguments:
+        file_path: the manifest file
+        parameters_hash: hash of the calling parameters shared by all chunks
+        model_hash: hash of the model files, None if predicting with an inference server
+    """
+
+    def __init__(self, file_path, parameters_hash, model_hash):
+        self.file_path = file_path
+        self.parameters_hash = parameters_hash
+        self.model_hash = model_hash
+        self.chunks = OrderedDict()
+
+    @staticmethod
+    def load(file_path):
+        with open(file_path) as f:
+            content = json.load(f, object_pairs_hook=OrderedDict)
+        if content.get("version") != MANIFEST_VERSION:
+            raise ValueError("unsupported manifest version %s" % (content.get("version")))
+        manifest = ChunkManifest(file_path, content["parameters_hash"], content["model_hash"])
+        manifest.chunks = content["chunks"]
+        return manifest
+
+    def save(self):
+        write_atomically(self.file_path, json.dumps(OrderedDict([
+            ("version", MANIFEST_VERSION),
+            ("parameters_hash", self.parameters_hash),
+            ("model_hash", self.model_hash),
+            ("chunks", self.chunks),
+        ]), indent=1) + "\n")
+
+    def add(self, name, ctg_name, ctg_start, ctg_end, call_fn, is_region_in_bed):
+        self.chunks[name] = OrderedDict([
+            ("ctgName", ctg_name),
+            ("ctgStart", ctg_start),
+            ("ctgEnd", ctg_end),
+            ("call_fn", call_fn),
+            ("is_region_in_bed", is_region_in_bed),
+            ("status", CHUNK_PENDING),
+            ("attempts", 0),
+        ])
+
+    def update(self, name, **fields):
+        self.chunks[name].update(fields)
+        self.save()
+
+    def refresh_status(self):
+        """
+        Mark chunks with their VCF in place as done and all others pending, e.g. chunks left running by a dead node
+        """
+        for chunk in self.chunks.values():
+            chunk["status"] = CHUNK_DONE if os.path.isfile(chunk["call_fn"]) else CHUNK_PENDING
+        self.save()
+
+    def unfinished_chunks(self):
+        return [(name, chunk) for name, chunk in self.chunks.items() if chunk["status"] != CHUNK_DONE]
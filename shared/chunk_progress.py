@@ -0,0 +1,134 @@
+import os
+from time import time
+
+from shared.utils import write_atomically
+
+EXTRACT_VARIANT_CANDIDATES_STAGE = "evc"
+CREATE_TENSOR_STAGE = "ct"
+CALL_VARIANT_STAGE = "cv"
+STAGES = [EXTRACT_VARIANT_CANDIDATES_STAGE, CREATE_TENSOR_STAGE, CALL_VARIANT_STAGE]
+
+STATM_FILE_PATH = "/proc/self/statm"
+
+
+def integers_from_file(file_path):
+    try:
+        with open(file_path) as f:
+            return [int(value) for value in f.read().split()]
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def integer_from_file(file_path):
+    integers = integers_from_file(file_path)
+    return integers[0] if integers else None
+
+
+def resident_set_size():
+    """
+    Resident set size in bytes of this process, 0 if not available
+    """
+    try:
+        with open(STATM_FILE_PATH) as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError, IndexError):
+        return 0
+
+
+class ChunkProgress(object):
+    """
+    Progress of a chunk shared between the pipeline stages of callVarBam and the parallel runner, through files
+        <prefix>.<stage>: the latest 1-based position reached by the stage, and its resident set size in bytes
+        <prefix>.split: a new (1-based, inclusive) end of the chunk requested by the runner
+        <prefix>.split_accepted / <prefix>.split_rejected: the answer of CreateTensor to the request
+    CreateTensor accepts a new end only if no tensor beyond it has been output, ExtractVariantCandidates then stops
+    at the accepted end. All reads and checks are rate limited by check_interval seconds, positions by report_interval.
+    """
+
+    def __init__(self, prefix, report_interval=5, check_interval=1):
+        self.prefix = prefix
+        self.report_interval = report_interval
+        self.check_interval = check_interval
+        self.last_report_time = 0
+        self.last_check_time = 0
+        self.split_end = None
+
+    def file_path_of(self, name):
+        return "%s.%s" % (self.prefix, name)
+
+    def report(self, stage, position, force=False):
+        current_time = time()
+        if not force and current_time - self.last_report_time < self.report_interval:
+            return
+        self.last_report_time = current_time
+        write_atomically(self.file_path_of(stage), "%d %d\n" % (position, resident_set_size()))
+
+    def position_of(self, stage):
+        return integer_from_file(self.file_path_of(stage))
+
+    def memory_of(self, stage):
+        """
+        Returns:
+            the latest resident set size in bytes reported by the stage, 0 if not reported
+        """
+        integers = integers_from_file(self.file_path_of(stage))
+        return integers[1] if integers is not None and len(integers) > 1 else 0
+
+    def memory(self):
+        return sum(self.memory_of(stage) for stage in STAGES)
+
+    def is_time_to_check(self):
+        current_time = time()
+        if current_time - self.last_check_time < self.check_interval:
+            return False
+        self.last_check_time = current_time
+        return True
+
+    # runner side
+
+    def request_split(self, end):
+        write_atomically(self.file_path_of("split"), "%d\n" % (end))
+
+    def split_answer(self):
+        """
+        Returns:
+            the accepted end, False if rejected, or None if not answered yet
+        """
+        accepted_end = integer_from_file(self.file_path_of("split_accepted"))
+        if accepted_end is not None:
+            return accepted_end
+        if os.path.exists(self.file_path_of("split_rejected")):
+            return False
+        return None
+
+    def clear(self):
+        for name in STAGES + ["split", "split_accepted", "split_rejected"]:
+            if os.path.exists(self.file_path_of(name)):
+                os.remove(self.file_path_of(name))
+
+    # CreateTensor side
+
+    def split_request(self):
+        """
+        Returns:
+            the requested end if there is an unanswered request, None otherwise
+        """
+        if self.split_end is not None or not self.is_time_to_check():
+            return None
+        if os.path.exists(self.file_path_of("split_accepted")) or os.path.exists(self.file_path_of("split_rejected")):
+            return None
+        return integer_from_file(self.file_path_of("split"))
+
+    def accept_split(self, end):
+        self.split_end = end
+        write_atomically(self.file_path_of("split_accepted"), "%d\n" % (end))
+
+    def reject_split(self):
+        write_atomically(self.file_path_of("split_rejected"), "\n")
+
+    # ExtractVariantCandidates side
+
+    def accepted_split_end(self):
+        if self.split_end is None and self.is_time_to_check():
+            self.split_end = integer_from_file(self.file_path_of("split_accepted"))
+        return self.split_end
@@ -0,0 +1,171 @@
+import os
+import re
+import json
+import socket
+from time import time
+
+from shared.utils import write_atomically
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+QUEUE_SUBDIRECTORIES = [PENDING, RUNNING, DONE, FAILED, "tmp"]
+
+
+def worker_id():
+    return "%s.%d" % (socket.gethostname(), os.getpid())
+
+
+def job_file_name_from(index, name):
+    return "%06d_%s.json" % (index, re.sub(r"[^A-Za-z0-9._-]", "_", name))
+
+
+def lease_file_name_from(file_name, owner):
+    return "%s@%s" % (owner, file_name)
+
+
+def job_file_name_of(lease_file_name):
+    # job file names have no "@", see job_file_name_from
+    return lease_file_name.split("@", 1)[-1]
+
+
+class ChunkQueue(object):
+    """
+    Chunk jobs shared by workers on any host mounting queue_directory, each job a JSON file in one of
+        pending/, running/, done/ and failed/
+    A job is claimed by renaming it from pending/ to running/WORKER_ID@JOB, which only one worker succeeds in. The
+    worker renews the lease by updating the modification time of its lease file, a job without a renewal in
+    lease_timeout seconds is renamed back to pending/ by any worker. A lease taken back is lost for good, a later claim
+    of the job by another worker is another lease file, which the worker that lost it can neither renew nor complete.
+    Hosts are expected to have synchronised clocks.
+    """
+
+    def __init__(self, queue_directory, lease_timeout=300):
+        self.queue_directory = queue_directory
+        self.lease_timeout = lease_timeout
+
+    def path_of(self, state, file_name=""):
+        return os.path.join(self.queue_directory, state, file_name)
+
+    def create(self):
+        for subdirectory in QUEUE_SUBDIRECTORIES:
+            if not os.path.isdir(self.path_of(subdirectory)):
+                os.makedirs(self.path_of(subdirectory))
+
+    def file_names_in(self, state):
+        try:
+            return sorted(file_name for file_name in os.listdir(self.path_of(state)) if file_name.endswith(".json"))
+        except OSError:
+            return []
+
+    def publish(self, index, name, command_options_string, max_attempts):
+        """
+        Add a job, running callVarBam with command_options_string, to pending/
+        """
+        file_name = job_file_name_from(index, name)
+        temporary_file_path = os.path.join(self.path_of("tmp"), file_name)
+        write_atomically(temporary_file_path, json.dumps(dict(
+            name=name,
+            command_options=command_options_string,
+            attempts=0,
+            max_attempts=max_attempts,
+        )) + "\n")
+        os.rename(temporary_file_path, self.path_of(PENDING, file_name))
+
+    def move(self, file_name, from_state, to_state, to_file_name=None):
+        """
+        Returns:
+            True if moved by this call, False if the job is no longer in from_state
+        """
+        to_file_name = file_name if to_file_name is None else to_file_name
+        try:
+            os.rename(self.path_of(from_state, file_name), self.path_of(to_state, to_file_name))
+            return True
+        except OSError:
+            return False
+
+    def job_of(self, state, file_name):
+        with open(self.path_of(state, file_name)) as f:
+            return json.load(f)
+
+    def claim(self):
+        """
+        Returns:
+            (lease file name, job) of a claimed job, or (None, None) if no job is pending
+        """
+        for file_name in self.file_names_in(PENDING):
+            lease_file_name = lease_file_name_from(file_name, worker_id())
+            if not self.move(file_name, PENDING, RUNNING, to_file_name=lease_file_name):
+                continue
+            # a rename keeps the modification time, renew at once so that the lease is not seen as expired
+            if not self.renew(lease_file_name):
+                continue
+            try:
+                job = self.job_of(RUNNING, lease_file_name)
+            except (IOError, OSError, ValueError):
+                continue
+            job["attempts"] += 1
+            job["worker"] = worker_id()
+            if not self.update(lease_file_name, job):
+                continue
+            return lease_file_name, job
+        return None, None
+
+    def update(self, lease_file_name, job):
+        """
+        Rewrite the job of a lease, the lease file is held in tmp/ meanwhile, out of reach of requeue_expired_leases
+        Returns:
+            False if the lease is lost
+        """
+        if not self.move(lease_file_name, RUNNING, "tmp"):
+            return False
+        write_atomically(self.path_of("tmp", lease_file_name), json.dumps(job) + "\n")
+        return self.move(lease_file_name, "tmp", RUNNING)
+
+    def renew(self, lease_file_name):
+        """
+        Returns:
+            False if the lease is lost, i.e. the job has been taken back to pending/
+        """
+        try:
+            os.utime(self.path_of(RUNNING, lease_file_name), None)
+            return True
+        except OSError:
+            return False
+
+    def requeue_expired_leases(self):
+        """
+        Returns:
+            number of jobs taken back to pending/
+        """
+        no_of_requeued_jobs = 0
+        current_time = time()
+        for lease_file_name in self.file_names_in(RUNNING):
+            try:
+                modified_time = os.path.getmtime(self.path_of(RUNNING, lease_file_name))
+            except OSError:
+                continue
+            if current_time - modified_time > self.lease_timeout and \
+                    self.move(lease_file_name, RUNNING, PENDING, to_file_name=job_file_name_of(lease_file_name)):
+                no_of_requeued_jobs += 1
+        return no_of_requeued_jobs
+
+    def complete(self, lease_file_name, is_succeeded, job):
+        """
+        Move a running job to done/, back to pending/ for a retry, or to failed/ after max_attempts
+        Returns:
+            the state moved to, or None if the lease is lost and the job is left to its new owner
+        """
+        if is_succeeded:
+            to_state = DONE
+        elif job["attempts"] < job["max_attempts"]:
+            to_state = PENDING
+        else:
+            to_state = FAILED
+        if not self.move(lease_file_name, RUNNING, to_state, to_file_name=job_file_name_of(lease_file_name)):
+            return None
+        return to_state
+
+    def counts(self):
+        return dict((state, len(self.file_names_in(state))) for state in [PENDING, RUNNING, DONE, FAILED])
@@ -0,0 +1,143 @@
+import os
+import sys
+import json
+import fcntl
+import tempfile
+from glob import glob
+from time import sleep
+from contextlib import contextmanager
+
+NUMA_NODE_CPU_LIST_PATTERN = "/sys/devices/system/node/node[0-9]*/cpulist"
+DEFAULT_ALLOCATION_FILE_PATH = os.path.join(tempfile.gettempdir(), "clair_cpu_allocation_%d.json" % (os.getuid()))
+# seconds between retries of an allocation while no cpu is free
+ALLOCATION_POLL_INTERVAL = 5
+
+
+def cpus_from(cpu_list_string):
+    """
+    Parse a cpu list, e.g. "0-3,8,10-11", into a list of cpu ids
+    """
+    cpus = []
+    for cpu_range in cpu_list_string.strip().split(","):
+        if cpu_range == "":
+            continue
+        if "-" in cpu_range:
+            start, end = cpu_range.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(cpu_range))
+    return cpus
+
+
+def cpu_list_string_from(cpus):
+    return ",".join(str(cpu) for cpu in sorted(cpus))
+
+
+def available_cpus():
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count()))
+
+
+def numa_nodes():
+    """
+    Returns:
+        list of cpu lists, one per NUMA node, containing only the cpus available to this process
+        a single node with all available cpus if the topology is not found
+    """
+    cpus = set(available_cpus())
+    nodes = []
+    for cpu_list_file_path in sorted(glob(NUMA_NODE_CPU_LIST_PATTERN)):
+        with open(cpu_list_file_path) as f:
+            node_cpus = [cpu for cpu in cpus_from(f.read()) if cpu in cpus]
+        if len(node_cpus) > 0:
+            nodes.append(node_cpus)
+    if len(nodes) == 0:
+        nodes = [sorted(cpus)]
+    return nodes
+
+
+def is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class CpuScheduler(object):
+    """
+    Node-local cpu allocation shared by concurrent jobs through a lock-protected file
+    The file maps each allocated cpu to the pid of the job holding it, cpus of exited jobs are reclaimed on every access
+    Arguments:
+        allocation_file_path: the file shared by all jobs on the node
+    """
+
+    def __init__(self, allocation_file_path=DEFAULT_ALLOCATION_FILE_PATH):
+        self.allocation_file_path = allocation_file_path
+        self.nodes = numa_nodes()
+
+    @contextmanager
+    def locked_allocation(self):
+        fd = os.open(self.allocation_file_path, os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, "r+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                content = f.read()
+                try:
+                    allocation = dict((int(cpu), pid) for cpu, pid in json.loads(content).items()) if content else {}
+                except ValueError:
+                    allocation = {}
+                allocation = dict((cpu, pid) for cpu, pid in allocation.items() if is_process_alive(pid))
+
+                yield allocation
+
+                f.seek(0)
+                f.truncate()
+                json.dump(allocation, f)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def allocate(self, no_of_cpus, pid=None):
+        """
+        Allocate no_of_cpus free cpus to the job, from a single NUMA node whenever one has enough free cpus
+        If no cpu is free, wait until another job releases its cpus, the cpus of a job are never shared
+        Returns:
+            allocated cpus, could be fewer than requested but at least one
+        """
+        pid = os.getpid() if pid is None else pid
+        is_waiting = False
+        while True:
+            with self.locked_allocation() as allocation:
+                free_cpus_per_node = [[cpu for cpu in node if cpu not in allocation] for node in self.nodes]
+
+                # best fit, the node with the fewest free cpus that still has enough
+                fitting_nodes = [free_cpus for free_cpus in free_cpus_per_node if len(free_cpus) >= no_of_cpus]
+                if len(fitting_nodes) > 0:
+                    cpus = min(fitting_nodes, key=len)[:no_of_cpus]
+                else:
+                    cpus = []
+                    for free_cpus in sorted(free_cpus_per_node, key=len, reverse=True):
+                        cpus.extend(free_cpus[:no_of_cpus - len(cpus)])
+
+                for cpu in cpus:
+                    allocation[cpu] = pid
+
+            if len(cpus) > 0:
+                return sorted(cpus)
+            if not is_waiting:
+                print("[INFO] No free cpu in %s, waiting for other jobs to release theirs" % (
+                    self.allocation_file_path
+                ), file=sys.stderr)
+                is_waiting = True
+            sleep(ALLOCATION_POLL_INTERVAL)
+
+    def release(self, pid=None):
+        pid = os.getpid() if pid is None else pid
+        with self.locked_allocation() as allocation:
+            for cpu in [cpu for cpu, allocated_pid in allocation.items() if allocated_pid == pid]:
+                del allocation[cpu]
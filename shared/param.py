@@ -4,6 +4,8 @@ NUM_THREADS = 12
 parameterOutputPlaceHolder = 6
 expandReferenceRegion = 1000000
 SAMTOOLS_VIEW_FILTER_FLAG = 2316
+# maximum number of (position, base) tuples of alignments held by CreateTensor, about 100 bytes each in pypy
+maxTensorSlots = 5000000
 
 # Tensor related parameters, please use the same values for creating tensor, model training and variant calling
 flankingBaseNum = 16
@@ -11,9 +13,16 @@ matrixRow = 8
 matrixNum = 4
 bloscBlockSize = 500
 
+# blosc compression of tensor blocks, codec: blosclz / lz4 / lz4hc / zlib / zstd, shuffle: noshuffle / shuffle / bitshuffle
+bloscCodec = "lz4hc"
+bloscLevel = 9
+bloscShuffle = "noshuffle"
+
 # Model hyperparameters
 trainBatchSize = 10000
 predictBatchSize = 1000
+minPredictBatchSize = 100
+maxPredictBatchSize = 20000
 initialLearningRate = 1e-3
 learningRateDecay = 0.1
 maxLearningRateSwitch = 3
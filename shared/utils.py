@@ -1,6 +1,10 @@
+import os
+import hashlib
+from glob import glob
 from os.path import isfile, abspath
 from sys import exit, stderr
 from subprocess import check_output, PIPE, Popen
+from functools import lru_cache
 
 # A->A
 # C->C
@@ -28,6 +32,10 @@ IUPAC_base_to_num_dict = dict(zip(
 
 BASIC_BASES = set("ACGTU")
 
+# model files loaded as is (no checkpoint .meta/.index/.data), e.g. exported by clair/export_inference_model.py
+FROZEN_MODEL_SUFFIXES = (".pb", ".npz")
+
+
 def is_file_exists(file_name, suffix=""):
     if not isinstance(file_name, str) or not isinstance(suffix, str):
         return False
@@ -42,6 +50,41 @@ def file_path_from(file_name, suffix="", exit_on_not_found=False):
     return None
 
 
+def is_frozen_model_file(file_name):
+    return isinstance(file_name, str) and file_name.endswith(FROZEN_MODEL_SUFFIXES)
+
+
+def model_file_path_from(file_name, exit_on_not_found=False):
+    if is_frozen_model_file(file_name):
+        return file_path_from(file_name, exit_on_not_found=exit_on_not_found)
+    return file_path_from(file_name, suffix=".meta", exit_on_not_found=exit_on_not_found)
+
+
+def write_atomically(file_path, content):
+    temporary_file_path = file_path + ".tmp"
+    with open(temporary_file_path, "w") as f:
+        f.write(content)
+    os.replace(temporary_file_path, file_path)
+
+
+def model_hash_from(file_name):
+    """
+    SHA-256 of the model files, the .pb or .npz file, or the .index and .data files of a checkpoint
+    """
+    if is_frozen_model_file(file_name):
+        file_paths = [file_name]
+    else:
+        file_paths = [file_name + ".index"] + sorted(glob(file_name + ".data-*"))
+    sha256 = hashlib.sha256()
+    for file_path in file_paths:
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha256.update(block)
+    return sha256.hexdigest()
+
+
+# cached, so that jobs forked from the same process do not run "which" again
+@lru_cache(maxsize=None)
 def is_command_exists(command):
     if not isinstance(command, str):
         return False